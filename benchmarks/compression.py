@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Benchmark archive builds across --jobs values.
+
+Generates a dependency-heavy synthetic function (many small python modules
+plus a few larger binary blobs, roughly like vendored numpy/pandas), builds it
+from scratch with each job count and checks every build is byte-identical.
+
+    python benchmarks/compression.py --files 5000 --jobs 1 2 4 8
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent / "src"))
+sys.path.insert(0, str(HERE))
+
+from consolo.archive import IncrementalArchiveBuilder  # noqa: E402
+from consolo.compression import policy_from_spec  # noqa: E402
+from trees import make_tree  # noqa: E402
+
+
+def build(root: Path, manifest, jobs: int, compression: str = "default"):
+    """Cold build with the given job count, returning stats and digest."""
+    builder = IncrementalArchiveBuilder(
+        root, jobs=jobs, policy=policy_from_spec(compression)
+    )
+    out = io.BytesIO()
+    stats = builder.build(manifest, out)
+    return stats, hashlib.sha256(out.getbuffer()).hexdigest(), out.tell()
+
+
+def main() -> None:
+    """Run the benchmark and print one JSON object per job count."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=3000)
+    parser.add_argument("--blobs", type=int, default=20)
+    parser.add_argument("--blob-size", type=int, default=2 * 1024 * 1024)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--compression", default="default")
+    parser.add_argument(
+        "--jobs", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1})
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        manifest = make_tree(root, args.files, args.blobs, args.blob_size)
+
+        digests = set()
+        baseline = None
+        for jobs in args.jobs:
+            best = None
+            for _ in range(args.repeat):
+                stats, digest, size = build(root, manifest, jobs, args.compression)
+                digests.add(digest)
+                best = stats.seconds if best is None else min(best, stats.seconds)
+
+            baseline = baseline or best
+            print(
+                json.dumps(
+                    {
+                        "jobs": jobs,
+                        "compression": args.compression,
+                        "files": stats.files,
+                        "input_bytes": stats.bytes_compressed,
+                        "archive_bytes": size,
+                        "seconds": round(best, 4),
+                        "speedup": round(baseline / best, 2),
+                        "sha256": digest,
+                    }
+                )
+            )
+
+    if len(digests) != 1:
+        sys.exit("Archives differ between job counts.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Benchmark a full reload cycle against a local stand-in for Lambda.
+
+For each synthetic function (see trees.CASES) this serves the package from a
+local HTTP server, drives LambdaReloader through download, expand and build,
+then saves files and times how long each takes to reach update_function_code.
+Every case runs in its own process so peak RSS is per case. Prints one JSON
+object per case.
+
+    python benchmarks/reload.py --cases small 10k 200mb
+"""
+import argparse
+import io
+import json
+import logging
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent / "src"))
+sys.path.insert(0, str(HERE))
+
+from watchdog.events import FileModifiedEvent  # noqa: E402
+
+from consolo.cache import ArchiveCache  # noqa: E402
+from consolo.consolo import LambdaReloader  # noqa: E402
+from stubs import PackageServer, StubLambdaClient  # noqa: E402
+from trees import CASES, make_tree  # noqa: E402
+
+
+def package(root: Path, manifest) -> bytes:
+    """Zip a tree the way it would have been deployed."""
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for name in manifest:
+            zipf.write(root / name, name)
+    return out.getvalue()
+
+
+def timed(fn) -> float:
+    """Seconds a call took."""
+    start = time.perf_counter()
+    fn()
+    return round(time.perf_counter() - start, 4)
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(name: str, args) -> dict:
+    """Run every stage for one synthetic function."""
+    case = CASES[name]
+    server = PackageServer()
+    client = StubLambdaClient(server, activation=args.activation)
+    result = {"case": name, "jobs": args.jobs, "quiet_period": args.quiet_period}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src, dest = Path(tmp, "src"), Path(tmp, "dest")
+        manifest = make_tree(src, case.files, case.blobs, case.blob_size)
+        body = package(src, manifest)
+        client.deploy(body)
+        result.update(files=len(manifest), package_bytes=len(body))
+
+        dest.mkdir()
+        reloader = LambdaReloader(
+            "bench",
+            f"bench-{name}",
+            str(dest),
+            allow_file_creation=False,
+            quiet_period=args.quiet_period,
+            cache=ArchiveCache(Path(tmp, "cache")),
+            jobs=args.jobs,
+        )
+        reloader.lambda_client = client
+
+        try:
+            result["download"] = timed(reloader.download_function_code)
+            reloader.read_manifest()
+            result["expand"] = timed(reloader.expand_function_code)
+            result["expand_unchanged"] = timed(reloader.expand_function_code)
+            result["build_cold"] = timed(lambda: reloader.make_archive(name))
+            target = dest / manifest[0]
+            target.touch()
+            result["build_incremental"] = timed(lambda: reloader.make_archive(name))
+
+            reloader.batcher.start()
+            reloader.pipeline.start()
+            latencies = []
+            for i in range(args.saves):
+                with open(target, "a") as f:
+                    f.write(f"\n# save {i}\n")
+                saved = time.monotonic()
+                reloader.queue_event(FileModifiedEvent(str(target)))
+                arrived = client.wait_for_update(i + 1)
+                latencies.append(arrived - saved)
+                reloader.pipeline.join(timeout=60)
+
+            result["event_to_upload"] = {
+                "min": round(min(latencies), 4),
+                "median": round(statistics.median(latencies), 4),
+                "max": round(max(latencies), 4),
+            }
+        finally:
+            reloader.batcher.stop()
+            reloader.pipeline.stop()
+            reloader.manifest.flush()
+            reloader.manifest_path.unlink(missing_ok=True)
+            server.close()
+
+    result["peak_rss_bytes"] = peak_rss_bytes()
+    return result
+
+
+def main() -> None:
+    """Run each case in a fresh process and print one JSON object per case."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--saves", type=int, default=5)
+    parser.add_argument("--quiet-period", type=float, default=0.05)
+    parser.add_argument("--activation", type=float, default=0.0)
+    parser.add_argument("--in-process", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    if args.in_process:
+        for name in args.cases:
+            print(json.dumps(run_case(name, args)), flush=True)
+        return
+
+    for name in args.cases:
+        command = [sys.executable, __file__, "--in-process", "--cases", name]
+        command += ["--jobs", str(args.jobs), "--saves", str(args.saves)]
+        command += ["--quiet-period", str(args.quiet_period)]
+        command += ["--activation", str(args.activation)]
+        if args.verbose:
+            command.append("--verbose")
+        subprocess.run(command, check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Local stand-ins for the Lambda API and its presigned package URLs."""
+import base64
+import hashlib
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+from botocore.exceptions import ClientError
+
+
+class PackageServer:
+    """Serve deployment packages over HTTP, honouring Range requests."""
+
+    def __init__(self, host: str = "127.0.0.1") -> None:
+        """Init and start serving on a free port."""
+        self.packages: Dict[str, bytes] = {}
+        outer = self
+
+        class PackageHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = outer.packages.get(self.path.lstrip("/"))
+                if body is None:
+                    self.send_error(404)
+                    return
+
+                match = re.match(r"bytes=(\d+)-", self.headers.get("Range", ""))
+                start = int(match.group(1)) if match else 0
+                self.send_response(206 if match else 200)
+                self.send_header("Content-Length", str(len(body) - start))
+                self.end_headers()
+                self.wfile.write(memoryview(body)[start:])
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer((host, 0), PackageHandler)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="bench-packages", daemon=True
+        )
+        self.thread.start()
+
+    def url(self, key: str) -> str:
+        """URL a package is served at."""
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/{key}"
+
+    def close(self) -> None:
+        """Stop serving."""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StubLambdaClient:
+    """Just enough of the boto3 lambda client for LambdaReloader.
+
+    Updates stay `InProgress` for `activation` seconds, and updating again in
+    the meantime raises ResourceConflictException like the real service.
+    """
+
+    def __init__(self, server: PackageServer, activation: float = 0.0) -> None:
+        """Init with nothing deployed."""
+        self.server = server
+        self.activation = activation
+        self.code_sha256 = ""
+        self.ready_at = 0.0
+        # monotonic time of every successful update_function_code
+        self.updates: List[float] = []
+        self._cond = threading.Condition()
+
+    def deploy(self, package: bytes) -> str:
+        """Make a package the deployed code, returning its CodeSha256."""
+        code_sha256 = base64.b64encode(hashlib.sha256(package).digest()).decode()
+        key = hashlib.sha256(package).hexdigest()
+        self.server.packages[key] = bytes(package)
+        self.code_sha256 = code_sha256
+        return code_sha256
+
+    def get_function(self, FunctionName: str) -> dict:
+        """Configuration plus a presigned URL for the deployed package."""
+        key = base64.b64decode(self.code_sha256).hex()
+        return {
+            "Configuration": self.get_function_configuration(FunctionName),
+            "Code": {"Location": self.server.url(key)},
+        }
+
+    def get_function_configuration(self, FunctionName: str) -> dict:
+        """State of the last update."""
+        busy = time.monotonic() < self.ready_at
+        return {
+            "FunctionName": FunctionName,
+            "CodeSha256": self.code_sha256,
+            "State": "Active",
+            "LastUpdateStatus": "InProgress" if busy else "Successful",
+        }
+
+    def update_function_code(self, FunctionName: str, ZipFile) -> dict:
+        """Deploy a new package, unless an update is still in progress."""
+        if time.monotonic() < self.ready_at:
+            raise ClientError(
+                {"Error": {"Code": "ResourceConflictException", "Message": "busy"}},
+                "UpdateFunctionCode",
+            )
+
+        self.deploy(ZipFile)
+        with self._cond:
+            self.ready_at = time.monotonic() + self.activation
+            self.updates.append(time.monotonic())
+            self._cond.notify_all()
+        return self.get_function_configuration(FunctionName)
+
+    def wait_for_update(self, count: int, timeout: float = 60.0) -> float:
+        """Wait until `count` updates arrived, returning when the last one did."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self.updates) >= count, timeout):
+                raise TimeoutError(f"Only {len(self.updates)} updates arrived.")
+            return self.updates[count - 1]
@@ -0,0 +1,55 @@
+"""Synthetic function trees for benchmarks."""
+import random
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+WORDS = "def class return import self lambda value result for in if else".split()
+
+
+class Case(NamedTuple):
+    """Shape of a synthetic function."""
+
+    files: int
+    blobs: int
+    blob_size: int
+
+
+CASES: Dict[str, Case] = {
+    "small": Case(files=20, blobs=0, blob_size=0),
+    "10k": Case(files=10_000, blobs=0, blob_size=0),
+    "200mb": Case(files=2_000, blobs=40, blob_size=5 * 1024 * 1024),
+}
+
+
+def make_tree(
+    root: Path, files: int, blobs: int = 0, blob_size: int = 0, seed: int = 0
+) -> List[str]:
+    """Write a synthetic vendored-dependency tree, returning its manifest.
+
+    Many small python modules plus a few larger binary blobs, roughly like a
+    function that vendors numpy or pandas.
+    """
+    rng = random.Random(seed)
+    manifest = []
+    for i in range(files):
+        name = f"site/pkg{i % 40}/mod{i}.py"
+        lines = (
+            " ".join(rng.choice(WORDS) for _ in range(12))
+            for _ in range(rng.randint(20, 400))
+        )
+        manifest.append(name)
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("\n".join(lines))
+
+    for i in range(blobs):
+        name = f"site/pkg{i % 40}/_native{i}.so"
+        manifest.append(name)
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Half random, half repetitive, like a shared object.
+        half = blob_size // 2
+        noise = rng.getrandbits(half * 8).to_bytes(half, "little")
+        path.write_bytes(noise + bytes(half))
+
+    return manifest
@@ -0,0 +1,466 @@
+"""Build deployment archives, reusing compressed members between builds."""
+import base64
+import copy
+import hashlib
+import io
+import logging
+import os
+import stat
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (BinaryIO, Dict, Iterable, List, NamedTuple, Optional,
+                    Tuple, Union)
+
+from consolo.compression import CompressionPolicy, StoredPolicy
+
+logger = logging.getLogger(__name__)
+
+# How a build got hold of each member.
+REUSED = "reused"
+COMPRESSED = "compressed"
+MISSING = "missing"
+
+
+@dataclass
+class BuildStats:
+    """What one archive build did and how long it took."""
+
+    files: int = 0
+    reused: int = 0
+    compressed: int = 0
+    missing: int = 0
+    bytes_reused: int = 0
+    bytes_compressed: int = 0
+    seconds: float = 0.0
+    # Digest of every member's name, content, header and how it was compressed.
+    # Equal fingerprints mean byte-identical archives.
+    fingerprint: str = ""
+
+    def __str__(self) -> str:
+        """Summarise the build for logging."""
+        return (
+            f"{self.files} files in {self.seconds:.3f}s: "
+            f"reused {self.reused} ({self.bytes_reused} bytes), "
+            f"compressed {self.compressed} ({self.bytes_compressed} bytes)"
+        )
+
+
+class Member(NamedTuple):
+    """A compressed archive member and the local file it was built from."""
+
+    size: int
+    mtime_ns: int
+    sha256: bytes
+    zinfo: zipfile.ZipInfo
+    data: bytes
+    # deflate level the data was compressed at, None if stored
+    level: Optional[int] = None
+
+
+def header_key(zinfo: zipfile.ZipInfo) -> Tuple:
+    """The parts of a member's header that are not derived from its contents."""
+    return (zinfo.date_time, zinfo.external_attr, zinfo.is_dir())
+
+
+def write_member(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, data: bytes) -> None:
+    """Append an already compressed member to an archive open for writing.
+
+    Mirrors what ZipFile does for a compressed write, minus the compression.
+    """
+    zinfo = copy.copy(zinfo)
+    if zipf._seekable:
+        zipf.fp.seek(zipf.start_dir)
+    zinfo.header_offset = zipf.fp.tell()
+
+    zipf._writecheck(zinfo)
+    zipf._didModify = True
+
+    zipf.fp.write(zinfo.FileHeader())
+    zipf.fp.write(data)
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = zipf.fp.tell()
+
+
+def compress(data: bytes, compress_type: int, level: Optional[int] = None) -> bytes:
+    """Compress data the same way ZipFile would for the given method."""
+    if compress_type == zipfile.ZIP_STORED:
+        return data
+
+    if compress_type != zipfile.ZIP_DEFLATED:
+        raise NotImplementedError(f"Unsupported compression type {compress_type}")
+
+    if level is None:
+        level = zlib.Z_DEFAULT_COMPRESSION
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+class IncrementalArchiveBuilder:
+    """Zip the files in a manifest, only compressing files that changed.
+
+    Members are keyed by path, size, mtime and content hash. A file whose size
+    and mtime are unchanged is reused without being read; a file that was only
+    touched is read and hashed, but not compressed again.
+
+    Changed files are compressed on `jobs` threads (zlib releases the GIL) and
+    written in manifest order, so the archive does not depend on `jobs`.
+    """
+
+    def __init__(
+        self,
+        local_root: Path,
+        compress_type: int = zipfile.ZIP_DEFLATED,
+        jobs: Optional[int] = None,
+        prefix: str = "",
+        policy: Optional[CompressionPolicy] = None,
+    ) -> None:
+        """Init and set the directory the manifest is relative to.
+
+        Members are stored under `prefix` plus their manifest name. `policy`
+        decides how each member is compressed, by default deflating everything
+        but already compressed types.
+        """
+        self.local_root = Path(local_root)
+        self.prefix = prefix
+        self.compress_type = compress_type
+        if policy is None:
+            stored = compress_type == zipfile.ZIP_STORED
+            policy = StoredPolicy() if stored else CompressionPolicy()
+        self.policy = policy
+        self.jobs = jobs or os.cpu_count() or 1
+        self.members: Dict[str, Member] = {}
+        self.stats = BuildStats()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Thread pool for compressing members, created on first use."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                self.jobs, thread_name_prefix="consolo-compress"
+            )
+        return self._executor
+
+    def build(self, manifest: Iterable[str], fileobj: BinaryIO) -> BuildStats:
+        """Write an archive of every file in the manifest to fileobj."""
+        start = time.perf_counter()
+        stats = BuildStats()
+        members = {}
+        names = list(manifest)
+        fingerprint = hashlib.sha256()
+        self.policy.begin()
+
+        if self.jobs > 1 and len(names) > 1:
+            results = self.executor.map(self.member, names)
+        else:
+            results = map(self.member, names)
+
+        with zipfile.ZipFile(fileobj, "w") as zipf:
+            for name, (member, outcome) in zip(names, results):
+                if outcome == MISSING:
+                    logger.warning(f"{name} is in the manifest but missing locally.")
+                    stats.missing += 1
+                    continue
+
+                if outcome == REUSED:
+                    stats.reused += 1
+                    stats.bytes_reused += member.zinfo.file_size
+                else:
+                    stats.compressed += 1
+                    stats.bytes_compressed += member.zinfo.file_size
+
+                members[name] = member
+                write_member(zipf, member.zinfo, member.data)
+                stats.files += 1
+                fingerprint.update(name.encode() + b"\0" + member.sha256)
+                zinfo = member.zinfo
+                header = (
+                    header_key(zinfo),
+                    zinfo.compress_type,
+                    member.level,
+                    zinfo.compress_size,
+                )
+                fingerprint.update(repr(header).encode())
+
+        # Anything not in this manifest is stale.
+        self.members = members
+        stats.fingerprint = fingerprint.hexdigest()
+        stats.seconds = time.perf_counter() - start
+        self.stats = stats
+        self.policy.built()
+        logger.debug(f"Built archive, {stats}")
+        if stats.compressed:
+            logger.info(f"Compression {self.policy}")
+        return stats
+
+    def member(self, name: str) -> Tuple[Optional[Member], str]:
+        """Get the member for a manifest entry, compressing only if needed."""
+        path = self.local_root.joinpath(name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None, MISSING
+
+        cached = self.members.get(name)
+        if (
+            cached is not None
+            and cached.size == st.st_size
+            and cached.mtime_ns == st.st_mtime_ns
+        ):
+            return cached, REUSED
+
+        zinfo = zipfile.ZipInfo.from_file(path, self.prefix + name)
+        if stat.S_ISDIR(st.st_mode):
+            data = b""
+        else:
+            with open(path, "rb") as f:
+                data = f.read()
+        sha256 = hashlib.sha256(data).digest()
+
+        if (
+            cached is not None
+            and cached.sha256 == sha256
+            and header_key(cached.zinfo)[1:] == header_key(zinfo)[1:]
+        ):
+            # Touched but not changed. Keep the old header too, so that saving
+            # without changes builds a byte-identical archive.
+            member = cached._replace(size=st.st_size, mtime_ns=st.st_mtime_ns)
+            return member, REUSED
+
+        return self.compress_member(zinfo, data, st, sha256), COMPRESSED
+
+    def compress_member(
+        self,
+        zinfo: zipfile.ZipInfo,
+        data: bytes,
+        st: os.stat_result,
+        sha256: bytes,
+    ) -> Member:
+        """Compress a file's contents into a new member."""
+        if zinfo.is_dir():
+            zinfo.compress_type, level = zipfile.ZIP_STORED, None
+        else:
+            self.policy.sample(data)
+            choice = self.policy.choose(zinfo.filename, len(data))
+            zinfo.compress_type, level = choice
+        if zinfo.compress_type == zipfile.ZIP_DEFLATED and level is None:
+            level = zlib.Z_DEFAULT_COMPRESSION
+
+        compressed = compress(data, zinfo.compress_type, level)
+        if not zinfo.is_dir():
+            self.policy.record(choice, len(data), len(compressed))
+        zinfo.file_size = len(data)
+        zinfo.compress_size = len(compressed)
+        zinfo.CRC = zlib.crc32(data)
+        return Member(st.st_size, st.st_mtime_ns, sha256, zinfo, compressed, level)
+
+
+class ArchiveSink(io.RawIOBase):
+    """Seekable in-memory stream that archives are built into.
+
+    The buffer is kept between builds so that each save reuses the same memory.
+    Once an archive grows past `spill_threshold` bytes the rest of the build goes
+    to a per-process spill file instead.
+    """
+
+    def __init__(self, spill_path: Path, spill_threshold: int = 64 * 1024 * 1024):
+        """Init and set where and when to spill to disk."""
+        super().__init__()
+        self.spill_path = Path(spill_path)
+        self.spill_threshold = spill_threshold
+        self.buffer = bytearray()
+        self.spill: Optional[BinaryIO] = None
+        self.size = 0
+        self.position = 0
+        self.peak_bytes = 0
+
+    def __str__(self) -> str:
+        """Describe where the archive lives."""
+        if self.spill is not None:
+            return str(self.spill_path)
+        return f"<memory {self.size} bytes>"
+
+    @property
+    def spilled(self) -> bool:
+        """Whether the current archive is on disk rather than in memory."""
+        return self.spill is not None
+
+    def readable(self) -> bool:
+        """Archives can be read back from the sink."""
+        return True
+
+    def writable(self) -> bool:
+        """Archives are written into the sink."""
+        return True
+
+    def seekable(self) -> bool:
+        """ZipFile seeks back to patch headers."""
+        return True
+
+    def reset(self) -> None:
+        """Start a new archive, keeping the memory of the previous one."""
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+            self.spill_path.unlink()
+        self.size = 0
+        self.position = 0
+
+    def tell(self) -> int:
+        """Current position."""
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Move the current position."""
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self.position = offset
+        return self.position
+
+    def write(self, data) -> int:
+        """Write at the current position, spilling to disk if too large."""
+        length = len(data)
+        end = self.position + length
+
+        if self.spill is None and end > self.spill_threshold:
+            self.spill_to_disk()
+
+        if self.spill is not None:
+            self.spill.seek(self.position)
+            self.spill.write(data)
+        else:
+            if self.position > len(self.buffer):
+                self.buffer.extend(bytes(self.position - len(self.buffer)))
+            try:
+                self.buffer[self.position : end] = data
+            except BufferError:
+                # A view of an earlier archive is still alive, which stops the
+                # buffer from growing. Leave that view its own copy.
+                self.buffer = bytearray(self.buffer)
+                self.buffer[self.position : end] = data
+            self.peak_bytes = max(self.peak_bytes, len(self.buffer))
+
+        self.position = end
+        self.size = max(self.size, end)
+        return length
+
+    def readinto(self, b) -> int:
+        """Read from the current position."""
+        end = min(self.position + len(b), self.size)
+        length = max(end - self.position, 0)
+
+        if self.spill is not None:
+            self.spill.seek(self.position)
+            length = self.spill.readinto(memoryview(b)[:length])
+        else:
+            b[:length] = self.buffer[self.position : end]
+
+        self.position += length
+        return length
+
+    def spill_to_disk(self) -> None:
+        """Move what has been written so far into the spill file."""
+        logger.debug(f"Archive larger than {self.spill_threshold} bytes, spilling.")
+        spill = open(self.spill_path, "w+b")
+        with self.view() as view:
+            spill.write(view)
+        self.spill = spill
+
+    def sha256(self) -> str:
+        """Base64 SHA256 of the archive, as lambda reports CodeSha256."""
+        hasher = hashlib.sha256()
+        if self.spill is not None:
+            self.spill.seek(0)
+            while True:
+                chunk = self.spill.read(1024 * 1024)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+        else:
+            with self.view() as view:
+                hasher.update(view)
+        return base64.b64encode(hasher.digest()).decode()
+
+    def view(self) -> memoryview:
+        """Zero-copy view of an in-memory archive.
+
+        Release it (or use it as a context manager) before the next build.
+        """
+        if self.spill is not None:
+            raise RuntimeError(f"Archive spilled to {self.spill_path}")
+        return memoryview(self.buffer)[: self.size]
+
+    def payload(self) -> Union[memoryview, BinaryIO]:
+        """Archive contents without copying them.
+
+        A view of the buffer, or the spill file rewound to its start. The
+        buffer keeps its size for the next build.
+        """
+        if self.spill is not None:
+            self.spill.seek(0)
+            return self.spill
+        return self.view()
+
+    def data(self) -> bytes:
+        """Archive contents as bytes, for a ZipFile parameter.
+
+        botocore takes neither views nor, for ZipFile, which goes base64
+        encoded in a JSON body, file objects.
+        """
+        payload = self.payload()
+        if isinstance(payload, memoryview):
+            with payload:
+                return bytes(payload)
+        return payload.read()
+
+    def close(self) -> None:
+        """Drop the spill file, if any."""
+        if not self.closed:
+            self.reset()
+        super().close()
+
+
+class SinkPool:
+    """Sinks that are handed out one per archive in flight and then reused."""
+
+    def __init__(self, spill_prefix: Path, spill_threshold: int = 64 * 1024 * 1024):
+        """Init and set where spilled archives go."""
+        self.spill_prefix = Path(spill_prefix)
+        self.spill_threshold = spill_threshold
+        self.sinks: List[ArchiveSink] = []
+        self.free: List[ArchiveSink] = []
+        self._lock = threading.Lock()
+
+    @property
+    def peak_bytes(self) -> int:
+        """Largest memory every sink has held, summed."""
+        return sum(sink.peak_bytes for sink in self.sinks)
+
+    def acquire(self) -> ArchiveSink:
+        """Get an empty sink, creating one if they are all in use."""
+        with self._lock:
+            if self.free:
+                sink = self.free.pop()
+            else:
+                sink = ArchiveSink(
+                    Path(f"{self.spill_prefix}.{len(self.sinks)}.zip"),
+                    self.spill_threshold,
+                )
+                self.sinks.append(sink)
+        sink.reset()
+        return sink
+
+    def release(self, sink: ArchiveSink) -> None:
+        """Return a sink once its archive has been uploaded or dropped."""
+        with self._lock:
+            self.free.append(sink)
@@ -0,0 +1,212 @@
+"""Collapse bursts of file events into a single change set."""
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from watchdog.events import (FileCreatedEvent, FileDeletedEvent,
+                             FileModifiedEvent, FileMovedEvent)
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeSet:
+    """Net effect of one burst of events, however the editor got there.
+
+    Every path that exists at the end of the burst remembers which path its
+    file started at, or that it is new. Chains of renames, renames onto paths
+    that were themselves moved away, and temporary files that are renamed and
+    deleted again all collapse into one consistent set of created, modified,
+    deleted and moved paths.
+    """
+
+    def __init__(self) -> None:
+        """Init empty change set."""
+        # current path -> path its file started the burst at, None if new;
+        # dicts rather than sets so that paths keep the order they arrived in
+        self.origins: Dict[str, Optional[str]] = {}
+        # paths that held a file when the burst started
+        self.originals: Dict[str, None] = {}
+        self.events = 0
+        self.started = time.monotonic()
+        self.flushed: Optional[float] = None
+
+    @property
+    def created(self) -> Dict[str, None]:
+        """Paths holding a file that did not exist when the burst started."""
+        return {path: None for path, origin in self.origins.items() if origin is None}
+
+    @property
+    def modified(self) -> Dict[str, None]:
+        """Paths whose file stayed where it was but may have changed."""
+        return {path: None for path, origin in self.origins.items() if origin == path}
+
+    @property
+    def moved(self) -> Dict[str, str]:
+        """Source path -> destination path of files that ended up elsewhere."""
+        return {
+            origin: path
+            for path, origin in self.origins.items()
+            if origin is not None and origin != path
+        }
+
+    @property
+    def deleted(self) -> Dict[str, None]:
+        """Paths whose file is gone and that nothing took the place of."""
+        kept = {origin for origin in self.origins.values() if origin is not None}
+        return {
+            path: None
+            for path in self.originals
+            if path not in self.origins and path not in kept
+        }
+
+    def __bool__(self) -> bool:
+        """Truthy if any path was touched."""
+        return bool(self.origins or self.deleted)
+
+    def __len__(self) -> int:
+        """Number of distinct paths in the change set."""
+        return len(self.origins) + len(self.deleted)
+
+    @property
+    def merged(self) -> int:
+        """Number of events that were folded into an existing path."""
+        return self.events - len(self)
+
+    def origin(self, path: str) -> Optional[str]:
+        """Take the file at path out of the burst, returning where it started."""
+        if path in self.origins:
+            return self.origins.pop(path)
+        # First time we hear of it, so it was there all along.
+        self.originals[path] = None
+        return path
+
+    def add(self, event) -> None:
+        """Record a created, modified, deleted or moved event."""
+        self.events += 1
+        path = str(event.src_path)
+
+        if isinstance(event, FileCreatedEvent):
+            # Whatever was at path before is gone, even if it was there at the
+            # start, as with editors that delete and write again.
+            self.origins.pop(path, None)
+            self.origins[path] = None
+        elif isinstance(event, FileModifiedEvent):
+            if path not in self.origins:
+                self.origin(path)
+                self.origins[path] = path
+        elif isinstance(event, FileDeletedEvent):
+            self.origin(path)
+        elif isinstance(event, FileMovedEvent):
+            dest = str(event.dest_path)
+            origin = self.origin(path)
+            # Anything at dest is replaced.
+            self.origins.pop(dest, None)
+            self.origins[dest] = origin
+
+
+class EventBatcher:
+    """Debounce file events and hand them over as one change set.
+
+    A burst is flushed once no event has arrived for `quiet_period` seconds, or
+    `max_latency` seconds after its first event, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        on_batch: Callable[[ChangeSet], None],
+        quiet_period: float = 0.5,
+        max_latency: float = 5.0,
+    ) -> None:
+        """Init and set the callback fired with each flushed change set."""
+        self.on_batch = on_batch
+        self.quiet_period = quiet_period
+        self.max_latency = max(max_latency, quiet_period)
+        self.pending: Optional[ChangeSet] = None
+        self.last_event = 0.0
+        self.batches = 0
+        self.events = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def add(self, event) -> None:
+        """Queue an event into the current burst."""
+        with self._cond:
+            if self.pending is None:
+                self.pending = ChangeSet()
+            self.pending.add(event)
+            self.last_event = time.monotonic()
+            self._cond.notify()
+
+        if self._thread is None:
+            self.start()
+
+    def deadline(self) -> float:
+        """Monotonic time at which the pending burst must be flushed."""
+        return min(
+            self.last_event + self.quiet_period,
+            self.pending.started + self.max_latency,
+        )
+
+    def start(self) -> None:
+        """Start the flushing thread."""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(
+                target=self._run, name="consolo-batcher", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Flush anything pending and stop the flushing thread."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._thread
+
+        if thread is not None:
+            thread.join()
+        self._thread = None
+
+    def take(self) -> Optional[ChangeSet]:
+        """Block until a burst is due, then detach and return it."""
+        with self._cond:
+            while True:
+                if self.pending is None:
+                    if self._stopped:
+                        return None
+                    self._cond.wait()
+                    continue
+
+                remaining = self.deadline() - time.monotonic()
+                if remaining <= 0 or self._stopped:
+                    changes, self.pending = self.pending, None
+                    changes.flushed = time.monotonic()
+                    return changes
+
+                self._cond.wait(remaining)
+
+    def flush(self, changes: ChangeSet) -> None:
+        """Fire the callback for one change set."""
+        self.batches += 1
+        self.events += changes.events
+        logger.debug(
+            f"Flushing {len(changes)} changed files, merged {changes.merged} of "
+            f"{changes.events} events."
+        )
+        self.on_batch(changes)
+
+    def _run(self) -> None:
+        """Flush bursts until stopped."""
+        while True:
+            changes = self.take()
+            if changes is None:
+                return
+
+            try:
+                self.flush(changes)
+            except Exception:
+                logger.exception("Failed to handle change set.")
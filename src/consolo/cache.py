@@ -0,0 +1,119 @@
+"""Content addressed cache of downloaded deployment packages."""
+import base64
+import fcntl
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_dir() -> Path:
+    """Per-user cache directory."""
+    return Path(os.environ.get("XDG_CACHE_HOME", "~/.cache")).expanduser() / "consolo"
+
+
+def sha256_to_hex(code_sha256: str) -> str:
+    """Convert a lambda CodeSha256 (base64) to the hex used for file names."""
+    return base64.b64decode(code_sha256).hex()
+
+
+def hex_to_sha256(digest: str) -> str:
+    """Convert a hex digest back to a lambda CodeSha256."""
+    return base64.b64encode(bytes.fromhex(digest)).decode("ascii")
+
+
+class ArchiveCache:
+    """Deployment packages stored by CodeSha256 with LRU eviction.
+
+    An entry's mtime is bumped every time it is used, so eviction drops the
+    least recently used packages once the cache outgrows `max_bytes`.
+    """
+
+    def __init__(self, root: Optional[Path] = None, max_bytes: int = 1024**3) -> None:
+        """Init and set where packages are kept and how much space they get."""
+        self.root = Path(root) if root is not None else default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def path(self, code_sha256: str) -> Path:
+        """Where the package with this CodeSha256 lives in the cache."""
+        return self.root.joinpath(f"{sha256_to_hex(code_sha256)}.zip")
+
+    def partial_path(self, code_sha256: str) -> Path:
+        """Download target, moved into place once verified.
+
+        The name is the same in every process, so a later run resumes what an
+        interrupted one left. Only write to it while holding `lock`.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        return self.root.joinpath(f".{sha256_to_hex(code_sha256)}.part")
+
+    @contextmanager
+    def lock(self, code_sha256: str) -> Iterator[None]:
+        """Hold the download of a package, across processes."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root.joinpath(f".{sha256_to_hex(code_sha256)}.lock")
+        with open(path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def entries(self) -> List[Path]:
+        """Cached packages, most recently used first."""
+        if not self.root.is_dir():
+            return []
+        paths = list(self.root.glob("*.zip"))
+        return sorted(paths, key=lambda p: p.stat().st_mtime, reverse=True)
+
+    def get(self, code_sha256: str) -> Optional[Path]:
+        """Get the cached package, marking it as recently used."""
+        path = self.path(code_sha256)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def find(self, prefix: str) -> Path:
+        """Find a cached package by a hex or base64 CodeSha256 prefix."""
+        matches = [
+            p
+            for p in self.entries()
+            if p.stem.startswith(prefix.lower())
+            or hex_to_sha256(p.stem).startswith(prefix)
+        ]
+        if len(matches) != 1:
+            available = ", ".join(p.stem[:12] for p in self.entries()) or "none"
+            raise RuntimeError(
+                f"{len(matches)} cached packages match {prefix}, "
+                f"available: {available}."
+            )
+
+        os.utime(matches[0])
+        return matches[0]
+
+    def put(self, code_sha256: str, src: Path) -> Path:
+        """Move a verified package into the cache."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.path(code_sha256)
+        # Moving within a filesystem is atomic, readers never see half a file.
+        shutil.move(str(src), str(path))
+        os.utime(path)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep: Optional[Path] = None) -> None:
+        """Delete least recently used packages until under max_bytes."""
+        total = 0
+        for path in self.entries():
+            size = path.stat().st_size
+            total += size
+            if total > self.max_bytes and path != keep:
+                logger.debug(f"Evicting {path.name} from the archive cache.")
+                path.unlink()
+                total -= size
@@ -0,0 +1,66 @@
+"""Boto sessions and HTTP connections shared between functions."""
+import logging
+import threading
+from functools import cached_property
+from typing import Any, Dict, Optional, Tuple
+
+import boto3
+import requests
+from boto3.session import Session
+from botocore.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ClientPool:
+    """One session per profile and one client per profile and service.
+
+    boto3 clients are thread safe, so every function using a profile shares the
+    same client and its connection pool. Sessions are not, so creating clients
+    is serialised.
+    """
+
+    def __init__(self, max_connections: int = 10) -> None:
+        """Init empty and set how many connections each client may keep open."""
+        self.max_connections = max_connections
+        self.sessions: Dict[str, Session] = {}
+        self.clients: Dict[Tuple[str, str, Optional[str]], Any] = {}
+        self._lock = threading.Lock()
+
+    def session(self, profile_name: str) -> Session:
+        """The boto session for a profile."""
+        with self._lock:
+            if profile_name not in self.sessions:
+                self.sessions[profile_name] = boto3.Session(profile_name=profile_name)
+            return self.sessions[profile_name]
+
+    def client(
+        self,
+        profile_name: str,
+        service: str = "lambda",
+        endpoint_url: Optional[str] = None,
+    ):
+        """The client for a service, shared by everything using the profile.
+
+        `endpoint_url` points the client at a local stand-in for the service.
+        """
+        session = self.session(profile_name)
+        with self._lock:
+            key = (profile_name, service, endpoint_url)
+            if key not in self.clients:
+                logger.debug(f"Creating {service} client for profile {profile_name}.")
+                self.clients[key] = session.client(
+                    service,
+                    endpoint_url=endpoint_url,
+                    config=Config(max_pool_connections=self.max_connections),
+                )
+            return self.clients[key]
+
+    @cached_property
+    def http(self) -> requests.Session:
+        """Pooled HTTP session for downloading packages."""
+        http = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.max_connections)
+        http.mount("https://", adapter)
+        http.mount("http://", adapter)
+        return http
@@ -0,0 +1,285 @@
+"""Choose how to compress each archive member."""
+import logging
+import sys
+import threading
+import time
+import zipfile
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Already compressed formats, deflating these only costs time.
+INCOMPRESSIBLE = frozenset(
+    (
+        ".zip", ".whl", ".egg", ".jar", ".gz", ".tgz", ".bz2", ".xz", ".zst",
+        ".lz4", ".7z", ".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif",
+        ".mp3", ".mp4", ".ogg", ".woff", ".woff2", ".parquet", ".npz",
+    )
+)
+
+# Files above this are deflated at the fastest level by default.
+LARGE_FILE = 8 * 1024 * 1024
+
+# Deflate levels auto mode chooses between, zero meaning stored.
+CANDIDATE_LEVELS = (0, 1, 3, 6, 9)
+
+# How much data auto mode compresses at each level to measure it.
+SAMPLE_BYTES = 4 * 1024 * 1024
+
+Choice = Tuple[int, Optional[int]]
+
+
+def extension(name: str) -> str:
+    """Lower case extension of a member name, with the dot."""
+    base = name.rsplit("/", 1)[-1]
+    dot = base.rfind(".")
+    return base[dot:].lower() if dot > 0 else ""
+
+
+@dataclass
+class PolicyStats:
+    """Bytes in and out per compression choice."""
+
+    # "stored" or "deflate-<level>" -> [files, bytes in, bytes out]
+    choices: Dict[str, List[int]] = field(default_factory=dict)
+
+    def record(self, choice: str, raw: int, compressed: int) -> None:
+        """Count one compressed member."""
+        totals = self.choices.setdefault(choice, [0, 0, 0])
+        totals[0] += 1
+        totals[1] += raw
+        totals[2] += compressed
+
+    @property
+    def saved(self) -> int:
+        """Bytes compression kept out of the archive."""
+        return sum(raw - out for _, raw, out in self.choices.values())
+
+    def __str__(self) -> str:
+        """Summarise for logging."""
+        parts = [
+            f"{choice} {files} files {raw}->{out} bytes"
+            for choice, (files, raw, out) in sorted(self.choices.items())
+        ]
+        return f"saved {self.saved} bytes so far ({', '.join(parts)})"
+
+
+class Throughput:
+    """Moving average of how fast uploads go, in bytes per second."""
+
+    def __init__(self, initial: float = 2 * 1024 * 1024, weight: float = 0.3) -> None:
+        """Init with a guess to use until something was measured."""
+        self.bytes_per_second = initial
+        self.weight = weight
+        self.samples = 0
+
+    def record(self, size: int, seconds: float) -> None:
+        """Fold in one measured upload."""
+        if seconds <= 0 or size <= 0:
+            return
+        rate = size / seconds
+        if self.samples:
+            rate = self.weight * rate + (1 - self.weight) * self.bytes_per_second
+        self.bytes_per_second = rate
+        self.samples += 1
+        logger.debug(f"Upload throughput now {rate / 1024 / 1024:.2f} MiB/s.")
+
+
+class CompressionPolicy:
+    """Store incompressible types, deflate the rest at a level per class.
+
+    `levels` maps extensions to deflate levels (zero to store). Files of at
+    least `large_file` bytes use `large_level`, anything else `level`.
+    """
+
+    def __init__(
+        self,
+        level: int = 6,
+        levels: Optional[Dict[str, int]] = None,
+        large_file: int = LARGE_FILE,
+        large_level: int = 1,
+        stored: frozenset = INCOMPRESSIBLE,
+    ) -> None:
+        """Init and set the levels to use."""
+        self.level = level
+        self.levels = {k.lower(): v for k, v in (levels or {}).items()}
+        self.large_file = large_file
+        self.large_level = large_level
+        self.stored = stored
+        self.stats = PolicyStats()
+        self._lock = threading.Lock()
+
+    def choose(self, name: str, size: int) -> Choice:
+        """Compression type and deflate level for a member."""
+        ext = extension(name)
+        if ext in self.levels:
+            level = self.levels[ext]
+        elif ext in self.stored:
+            level = 0
+        elif size >= self.large_file:
+            level = self.large_level
+        else:
+            level = self.default_level(size)
+
+        if level == 0:
+            return zipfile.ZIP_STORED, None
+        return zipfile.ZIP_DEFLATED, level
+
+    def default_level(self, size: int) -> int:
+        """Level for anything no other rule applies to."""
+        return self.level
+
+    def sample(self, data: bytes) -> None:
+        """See the contents of a member before it is compressed."""
+
+    def begin(self) -> None:
+        """Called before every archive build."""
+
+    def built(self) -> None:
+        """Called after every archive build."""
+
+    def record(self, choice: Choice, raw: int, compressed: int) -> None:
+        """Count how a member compressed."""
+        compress_type, level = choice
+        label = "stored" if compress_type == zipfile.ZIP_STORED else f"deflate-{level}"
+        with self._lock:
+            self.stats.record(label, raw, compressed)
+
+    def describe(self) -> str:
+        """The settings in use, for logging."""
+        overrides = ", ".join(f"{k}={v}" for k, v in sorted(self.levels.items()))
+        return (
+            f"level {self.level}, {self.large_level} from {self.large_file} bytes, "
+            f"{len(self.stored)} stored types" + (f", {overrides}" if overrides else "")
+        )
+
+    def __str__(self) -> str:
+        """Settings and savings so far."""
+        return f"{self.describe()}: {self.stats}"
+
+
+class StoredPolicy(CompressionPolicy):
+    """Never compress, the quickest build on a fast link."""
+
+    def choose(self, name: str, size: int) -> Choice:
+        """Always stored."""
+        return zipfile.ZIP_STORED, None
+
+    def describe(self) -> str:
+        """The settings in use, for logging."""
+        return "stored"
+
+
+class AutoPolicy(CompressionPolicy):
+    """Pick the default level that minimises build plus upload time.
+
+    The first few MiB of members are compressed at every candidate level to
+    measure speed and ratio. The cost of a level per input byte is then its
+    compression time, spread over `jobs` threads, plus the time to upload its
+    output at the measured throughput.
+
+    Measuring happens once, after the first build, and the level is chosen at
+    the start of each build. One build always uses one level, however its
+    members are spread over threads.
+    """
+
+    def __init__(self, link: Throughput, jobs: int = 1, **kwargs) -> None:
+        """Init and set where upload throughput is measured."""
+        # Large files are priced like any other, not always deflated quickly.
+        kwargs.setdefault("large_file", sys.maxsize)
+        super().__init__(**kwargs)
+        self.link = link
+        self.jobs = max(1, jobs)
+        # level -> (seconds per input byte, output bytes per input byte)
+        self.profile: Dict[int, Tuple[float, float]] = {}
+        self.sampled: List[bytes] = []
+        self.sampled_bytes = 0
+        # default level for the build in progress
+        self.chosen = self.level
+
+    def sample(self, data: bytes) -> None:
+        """Collect member contents until there is enough to measure levels."""
+        with self._lock:
+            if self.profile or self.sampled_bytes >= SAMPLE_BYTES:
+                return
+            self.sampled.append(data[: SAMPLE_BYTES - self.sampled_bytes])
+            self.sampled_bytes += len(self.sampled[-1])
+
+    def calibrate(self, sample: bytes) -> None:
+        """Measure every candidate level on sampled data."""
+        if not sample:
+            return
+        profile = {}
+        for level in CANDIDATE_LEVELS:
+            start = time.perf_counter()
+            if level:
+                compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+                out = len(compressor.compress(sample) + compressor.flush())
+            else:
+                out = len(sample)
+            seconds = time.perf_counter() - start
+            profile[level] = (seconds / len(sample), out / len(sample))
+        self.profile = profile
+        logger.info(
+            "Measured compression: "
+            + ", ".join(
+                f"level {level} {1 / max(s, 1e-12) / 1024 / 1024:.0f} MiB/s "
+                f"ratio {r:.2f}"
+                for level, (s, r) in self.profile.items()
+            )
+        )
+
+    def cost(self, level: int) -> float:
+        """Seconds per input byte to compress at a level and upload the result."""
+        seconds, ratio = self.profile[level]
+        return seconds / self.jobs + ratio / self.link.bytes_per_second
+
+    def begin(self) -> None:
+        """Fix the cheapest level for the link as currently measured."""
+        if self.profile:
+            self.chosen = min(self.profile, key=self.cost)
+
+    def built(self) -> None:
+        """Measure levels on what the first build sampled, for the next one."""
+        with self._lock:
+            if self.profile or not self.sampled:
+                return
+            sampled, self.sampled = self.sampled, []
+        self.calibrate(b"".join(sampled))
+
+    def default_level(self, size: int) -> int:
+        """The level chosen when the build started."""
+        return self.chosen
+
+    def describe(self) -> str:
+        """The settings in use, for logging."""
+        rate = self.link.bytes_per_second / 1024 / 1024
+        if not self.profile:
+            return f"auto, not measured yet, {rate:.2f} MiB/s link"
+        return f"auto, level {self.chosen} for {rate:.2f} MiB/s link"
+
+
+def policy_from_spec(
+    spec: str, link: Optional[Throughput] = None, jobs: int = 1, levels: str = ""
+) -> CompressionPolicy:
+    """Compression policy for a --compression value.
+
+    `default`, `store`, `auto` or a deflate level from 1 to 9. `levels` holds
+    per extension overrides such as `.csv=1,.json=9`.
+    """
+    overrides = {}
+    for item in filter(None, (i.strip() for i in levels.split(","))):
+        ext, _, level = item.partition("=")
+        overrides[ext if ext.startswith(".") else f".{ext}"] = int(level)
+
+    if spec == "store":
+        return StoredPolicy()
+    if spec == "auto":
+        return AutoPolicy(link or Throughput(), jobs=jobs, levels=overrides)
+    if spec in ("", "default"):
+        return CompressionPolicy(levels=overrides)
+    if spec.isdigit() and 1 <= int(spec) <= 9:
+        return CompressionPolicy(level=int(spec), levels=overrides)
+    raise RuntimeError(f"Unknown compression {spec}, use default, store, auto or 1-9.")
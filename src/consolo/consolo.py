@@ -1,41 +1,74 @@
 #!/usr/bin/env python3
 """Map an AWS lambda filesystem onto a local directory."""
-import json
 import logging
 import os
 import shutil
+import threading
 import time
 import zipfile
+from contextlib import nullcontext
 from functools import cached_property
 from pathlib import Path
-from typing import TypeVar
+from typing import Dict, Iterable, List, Optional, Set, TypeVar, Union
 
-import boto3
 import requests
 from argdantic import ArgParser
 from boto3.session import Session
 from botocore.exceptions import ClientError
-from watchdog.events import (FileCreatedEvent, FileModifiedEvent,
+from watchdog.events import (FileCreatedEvent, FileDeletedEvent,
+                             FileModifiedEvent, FileMovedEvent,
                              FileSystemEventHandler)
 from watchdog.observers import Observer
 
+from consolo.archive import (ArchiveSink, BuildStats,
+                             IncrementalArchiveBuilder, SinkPool)
+from consolo.batcher import ChangeSet, EventBatcher
+from consolo.cache import ArchiveCache, hex_to_sha256
+from consolo.clients import ClientPool
+from consolo.compression import CompressionPolicy, Throughput, policy_from_spec
+from consolo.download import stream_download
+from consolo.extract import WriteSuppressor, default_keep, expand_changed
+from consolo.fanout import UPDATED, FanOut, resolve_functions
+from consolo.ignore import EventFilter, IgnoreRules
+from consolo.local import LocalRuntime
+from consolo.layers import (DEFAULT_PATTERNS, LayerPublisher, is_dependency,
+                            split_manifest)
+from consolo.pipeline import SnapshotPipeline
+from consolo.polling import PollingWatcher
+from consolo.remote import (CONFLICT_SUFFIX, RemotePoller, Signature,
+                            package_members, pull_changed)
+from consolo.staging import S3Stager
+from consolo.validate import Validator
+from consolo.manifest import ManifestIndex
+from consolo.metrics import Metrics, metrics_from_spec
+
 logger = logging.getLogger(__name__)
 
 UploadableEvent = TypeVar("T", FileCreatedEvent, FileModifiedEvent)
 
 
 class Watcher:
-    """Watch a directory for file events."""
+    """Watch one or more directories for file events."""
 
-    def __init__(self, dirpath, handler) -> None:
-        """Init and set dirpath to watch and handler to fire."""
+    def __init__(self, dirpath: Union[str, Path, Iterable], handler) -> None:
+        """Init and set dirpath (or a list of them) to watch and handler to fire."""
         self.observer = Observer()
         self.dirpath = dirpath
         self.event_handler = handler
 
+    @property
+    def dirpaths(self) -> list:
+        """Directories to watch, leaving out any inside another one."""
+        if isinstance(self.dirpath, (str, Path)):
+            return [self.dirpath]
+
+        paths = sorted({Path(p).absolute() for p in self.dirpath})
+        return [p for p in paths if not any(o in p.parents for o in paths)]
+
     def run(self) -> None:
         """Start watching self.dirpath."""
-        self.observer.schedule(self.event_handler, self.dirpath, recursive=True)
+        for dirpath in self.dirpaths:
+            self.observer.schedule(self.event_handler, str(dirpath), recursive=True)
         self.observer.start()
         try:
             while True:
@@ -50,51 +83,81 @@ class Watcher:
 class Handler(FileSystemEventHandler):
     """Filter and handlelfile system events."""
 
-    def __init__(self, on_create, on_modify) -> None:
-        """Init and set handler."""
+    def __init__(
+        self, on_create, on_modify, on_delete=None, on_move=None, event_filter=None
+    ) -> None:
+        """Init and set handler.
+
+        `event_filter` gets every file event first and returns the event to
+        handle, or None to drop it.
+        """
         self.on_modify = on_modify
         self.on_create = on_create
+        self.on_delete = on_delete
+        self.on_move = on_move
+        self.event_filter = event_filter
 
     def on_any_event(self, event: UploadableEvent) -> None:
         """Handle file event."""
         if event.is_directory:
             return None
 
-        #TODO: perform file validation.
+        if self.event_filter is not None:
+            event = self.event_filter(event)
+            if event is None:
+                return None
 
         if isinstance(event, FileCreatedEvent):
             # Take any action here when a file is first created.
             logger.debug(f"Received created event - {event.src_path}.")
-
-            # TODO: perform AST check
             return self.on_create(event)
 
         elif isinstance(event, FileModifiedEvent):
             # Taken any action here when a file is modified.
             logger.debug(f"Received modified event - {event.src_path}.")
-
-            # TODO: perform AST check
             return self.on_modify(event)
 
+        elif isinstance(event, FileDeletedEvent) and self.on_delete:
+            logger.debug(f"Received deleted event - {event.src_path}.")
+            return self.on_delete(event)
+
+        elif isinstance(event, FileMovedEvent) and self.on_move:
+            logger.debug(
+                f"Received moved event - {event.src_path} to {event.dest_path}."
+            )
+            return self.on_move(event)
+
 
 class LambdaWrapper:
     """Generic lambda object."""
 
-    def __init__(self, profile_name: str, function_name: str, local_root: str) -> None:
+    def __init__(
+        self,
+        profile_name: str,
+        function_name: str,
+        local_root: str,
+        clients: Optional[ClientPool] = None,
+    ) -> None:
         """Set AWS profile, AWS function name and local path to src."""
         self.profile_name = profile_name
         self.function_name = function_name
         self.local_root = Path(local_root)
+        self.clients = clients if clients is not None else ClientPool()
 
     @cached_property
     def session(self) -> Session:
         """Get the boto session for a given profile."""
-        return boto3.Session(profile_name=self.profile_name)
+        return self.clients.session(self.profile_name)
 
     @cached_property
     def lambda_client(self):
         """Get the lambda client for the current session."""
-        return self.session.client("lambda")
+        return self.clients.client(self.profile_name, "lambda")
+
+    @cached_property
+    def http(self) -> requests.Session:
+        """Pooled HTTP session for downloading packages."""
+        return self.clients.http
 
 
 class LambdaReloader(LambdaWrapper):
@@ -106,13 +169,77 @@ class LambdaReloader(LambdaWrapper):
         function_name: str,
         local_root: str,
         allow_file_creation: bool,
+        quiet_period: float = 0.5,
+        max_latency: float = 5.0,
+        cache: Optional[ArchiveCache] = None,
+        prune: bool = False,
+        jobs: Optional[int] = None,
+        metrics: Optional[Metrics] = None,
+        clients: Optional[ClientPool] = None,
+        upload_slots: Optional[threading.Semaphore] = None,
+        fan_out: Optional[FanOut] = None,
+        stager: Optional[S3Stager] = None,
+        layer: Optional[LayerPublisher] = None,
+        compression: Optional[CompressionPolicy] = None,
+        link: Optional[Throughput] = None,
+        poll_interval: Optional[float] = None,
+        validator: Optional[Validator] = None,
+        local: Optional[LocalRuntime] = None,
+        pull_interval: Optional[float] = None,
     ) -> None:
-        """Set AWS profile, AWS function name and local path to src."""
-        self.profile_name = profile_name
-        self.function_name = function_name
-        self.local_root = Path(local_root)
+        """Set AWS profile, AWS function name and local path to src.
+
+        `upload_slots` bounds how many uploads run at once when it is shared
+        between reloaders. With `fan_out` every archive goes to all of its
+        functions instead of just this one. With `stager` archives above its
+        threshold are uploaded to S3 first. With `layer` dependencies are
+        published as a layer and left out of the uploaded archives.
+        `compression` decides how members are compressed, `link` measures how
+        fast uploads go. With `poll_interval` changes are found by scanning
+        the tree rather than from OS events. With `validator` change sets with
+        files that do not compile or parse are rejected before building. With
+        `local` changes are run by warm local workers instead of uploaded. With
+        `pull_interval` changes made to the function elsewhere are pulled in.
+        """
+        super().__init__(profile_name, function_name, local_root, clients)
         self.allow_file_creation = allow_file_creation
-        self.suppressed_uploads = False
+        self.prune = prune
+        self.jobs = jobs
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.suppressor = WriteSuppressor()
+        self.cache = cache if cache is not None else ArchiveCache()
+        # base64 SHA256 of the package the local tree was expanded from
+        self.code_sha256: Optional[str] = None
+        # base64 SHA256 of the package the function is currently running
+        self.deployed_sha256: Optional[str] = None
+        # configuration the function last reported while waiting for it
+        self.update_status: Optional[dict] = None
+        self.uploads = 0
+        self.skipped_uploads = 0
+        self.upload_slots = upload_slots
+        self.fan_out = fan_out
+        self.stager = stager
+        self.layer = layer
+        # manifest entries that live in the layer rather than the archive
+        self.dependencies: Set[str] = set()
+        self.layer_dirty = layer is not None
+        self.compression = compression
+        self.link = link if link is not None else Throughput()
+        self.ignore = IgnoreRules.from_root(self.local_root)
+        self.poll_interval = poll_interval
+        self.validator = validator
+        self.local = local
+        # member signatures of the package local and remote last agreed on
+        self.synced: Dict[str, Signature] = {}
+        # held while a burst is queued or a pull rewrites the tree, and for synced
+        self.tree_lock = threading.RLock()
+        self.poller = (
+            RemotePoller(self, pull_interval) if pull_interval is not None else None
+        )
+        self.manifest = ManifestIndex(self.manifest_path)
+        self.batcher = EventBatcher(
+            self.handle_changes, quiet_period=quiet_period, max_latency=max_latency
+        )
 
     @property
     def archive_dir(self) -> Path:
@@ -121,9 +248,72 @@ class LambdaReloader(LambdaWrapper):
 
     @property
     def archive(self) -> Path:
-        """Get the archive filename."""
+        """Get the filename of the downloaded archive."""
+        if self.code_sha256 is not None:
+            return self.cache.path(self.code_sha256)
         return self.archive_dir.joinpath(".".join([self.function_name, "zip"]))
 
+    @cached_property
+    def builder(self) -> IncrementalArchiveBuilder:
+        """Archive builder that remembers compressed files between builds."""
+        return IncrementalArchiveBuilder(
+            self.local_root, jobs=self.jobs, policy=self.compression
+        )
+
+    @property
+    def spill_prefix(self) -> Path:
+        """Per-process path prefix for archives too large to keep in memory."""
+        return self.archive_dir.joinpath(f".consolo.{self.function_name}.{os.getpid()}")
+
+    @cached_property
+    def sink(self) -> ArchiveSink:
+        """Reusable in-memory buffer the upload archive is built into."""
+        return ArchiveSink(Path(f"{self.spill_prefix}.zip"))
+
+    @cached_property
+    def pipeline(self) -> SnapshotPipeline:
+        """Build and upload stages that overlap with each other."""
+        pipeline = SnapshotPipeline(
+            build=self.build_archive,
+            upload=lambda snapshot: self.upload_archive(
+                snapshot.sink, snapshot.code_sha256
+            ),
+            is_ready=self.function_ready,
+            sinks=SinkPool(self.spill_prefix),
+            on_live=self.record_snapshot,
+            went_live=self.update_succeeded,
+        )
+
+        fn = self.function_name
+        uploader = pipeline.uploader
+        self.metrics.gauge("upload_queue_depth", lambda: uploader.queue_depth, fn)
+        self.metrics.gauge("upload_retries", lambda: uploader.stats.retries, fn)
+        self.metrics.gauge("upload_superseded", lambda: uploader.stats.superseded, fn)
+        self.metrics.gauge("sink_peak_bytes", lambda: pipeline.sinks.peak_bytes, fn)
+        policy = self.builder.policy
+        self.metrics.gauge("compression_saved_bytes", lambda: policy.stats.saved, fn)
+        return pipeline
+
+    @cached_property
+    def event_filter(self) -> EventFilter:
+        """Drops events for ignored paths before they are queued."""
+        return EventFilter(
+            [(self.local_root, self.ignore, self.function_name)], self.metrics
+        )
+
+    def record_snapshot(self, snapshot) -> None:
+        """Export how long each stage took for a snapshot that went live."""
+        latency = snapshot.latency()
+        for stage, seconds in latency.items():
+            self.metrics.observe(f"{stage}_seconds", seconds, self.function_name)
+        self.metrics.observe(
+            "save_to_live_seconds", sum(latency.values()), self.function_name
+        )
+        if self.poller is not None:
+            synced = package_members(snapshot.sink)
+            with self.tree_lock:
+                self.synced = synced
+
     def validate_root(self) -> bool:
         """Raise if destination directory does not exist."""
         if not os.path.isdir(self.local_root):
@@ -137,16 +327,43 @@ class LambdaReloader(LambdaWrapper):
 
         logger.info("Starting download.")
         response = self.lambda_client.get_function(FunctionName=self.function_name)
-        zip_url = response["Code"]["Location"]
+        code_sha256 = response["Configuration"]["CodeSha256"]
+        self.deployed_sha256 = code_sha256
 
-        r = requests.get(zip_url, allow_redirects=True)
-        open(self.archive, "wb").write(r.content)
+        if self.cache.get(code_sha256) is not None:
+            logger.info(f"Package {code_sha256} is cached, skipping download.")
+            self.code_sha256 = code_sha256
+            return
 
-    def read_manifest(self):
-        """Read the local list of files in the lambda."""
-        self.zip = zipfile.ZipFile(self.archive)
-        self.manifest = self.zip.namelist()
-        self.write_manifest()
+        zip_url = response["Code"]["Location"]
+        with self.cache.lock(code_sha256):
+            # Another process may have finished it while we waited.
+            if self.cache.get(code_sha256) is None:
+                # An interrupted download is kept and resumed next time.
+                partial = self.cache.partial_path(code_sha256)
+                stream_download(
+                    self.http,
+                    zip_url,
+                    partial,
+                    expected_sha256=code_sha256,
+                    resume=True,
+                )
+                self.cache.put(code_sha256, partial)
+        self.code_sha256 = code_sha256
+
+    def read_manifest(self) -> ManifestIndex:
+        """Read the list of files in the lambda from the downloaded archive."""
+        with zipfile.ZipFile(self.archive) as zipf:
+            names = zipf.namelist()
+        self.manifest.replace(n for n in names if not self.ignore.matches(n))
+        if len(self.manifest) < len(names):
+            logger.info(f"Ignoring {len(names) - len(self.manifest)} packaged files.")
+        return self.manifest
+
+    def load_manifest(self) -> ManifestIndex:
+        """Load the manifest once, preferring the persisted copy."""
+        if not self.manifest.loaded and not self.manifest.load():
+            self.read_manifest()
         return self.manifest
 
     @property
@@ -156,26 +373,88 @@ class LambdaReloader(LambdaWrapper):
 
     def write_manifest(self) -> None:
         """Write the in memory list of files to local storate."""
-        with open(self.manifest_path, "w", encoding="utf-8") as f:
-            return json.dump(self.manifest, f, ensure_ascii=False, indent=4)
+        self.manifest.write()
 
     def expand_function_code(self) -> None:
-        """Unpack the archive."""
-        shutil.unpack_archive(self.archive, self.local_root)
+        """Unpack the archive, only rewriting files whose contents differ."""
+        stats = expand_changed(
+            self.archive,
+            self.local_root,
+            remove_stale=self.prune,
+            keep=lambda name: default_keep(name) or self.ignore.matches(name),
+            on_write=self.suppressor.record,
+        )
+        logger.info(f"Expanded archive, {stats}.")
+        if stats.stale and not self.prune:
+            logger.debug(f"Not in package: {', '.join(stats.stale)}")
 
     def clobber_local(self) -> None:
         """Download AWS lambda onto local directory.
 
-        TODO: delete existing files?
+        Local files that are not in the lambda are only removed with `prune`.
         """
         self.download_function_code()
         self.read_manifest()
         self.expand_function_code()
+        synced = package_members(self.archive)
+        with self.tree_lock:
+            self.synced = synced
         logger.info("Finished download.")
 
-    def extract_relative_event_path(self, event) -> str:
-        """Extract relative path from event."""
-        path = str(event.src_path)
+    def busy(self) -> bool:
+        """Whether local changes are still waiting to be uploaded."""
+        pipeline = self.pipeline
+        return (
+            self.batcher.pending is not None
+            or pipeline.builder.busy
+            or pipeline.uploader.busy
+        )
+
+    def pull_remote(self) -> bool:
+        """Download the function's new package and apply only what changed.
+
+        Returns False without pulling if local changes got in first.
+        """
+        fn = self.function_name
+        with self.tree_lock:
+            if self.busy():
+                return False
+            with self.metrics.span("pull_seconds", fn):
+                self.download_function_code()
+                stats, self.synced = pull_changed(
+                    self.archive,
+                    self.local_root,
+                    self.synced,
+                    keep=self.ignore.matches,
+                    on_write=self.suppressor.record,
+                )
+
+            for name in stats.written:
+                self.manifest.add(name)
+            for name in stats.removed:
+                self.manifest.remove(name)
+        self.metrics.incr("pulls_total", 1, fn)
+        for name in stats.conflicts:
+            self.metrics.incr("pull_conflicts_total", 1, fn)
+            logger.warning(
+                f"{name} was changed both locally and remotely, kept the local "
+                f"copy. The function's copy is in {name}{CONFLICT_SUFFIX}."
+            )
+        logger.info(f"Pulled {self.code_sha256}, {stats}.")
+        return True
+
+    def rollback(self, prefix: str) -> None:
+        """Restore a cached package onto the local directory, offline."""
+        path = self.cache.find(prefix)
+        self.code_sha256 = hex_to_sha256(path.stem)
+        logger.info(f"Rolling back to {self.code_sha256}.")
+        self.read_manifest()
+        self.expand_function_code()
+        logger.info("Finished rollback.")
+
+    def extract_relative_path(self, path: str) -> str:
+        """Extract path relative to the local root."""
+        path = str(path)
         prefix = str(self.local_root) + "/"
 
         if prefix and path.startswith(prefix):
@@ -183,39 +462,167 @@ class LambdaReloader(LambdaWrapper):
 
         raise RuntimeError("Prefix was not in path")
 
+    def extract_relative_event_path(self, event) -> str:
+        """Extract relative path from event."""
+        return self.extract_relative_path(event.src_path)
+
     def event_file_is_in_manifest(self, event) -> bool:
         """Determine if the given path is in the manfest."""
-        self.read_manifest()
-
-        # TODO: cache manifest?
-        return self.extract_relative_event_path(event) in self.manifest
+        return self.extract_relative_event_path(event) in self.load_manifest()
 
-    def handle_create(self, event: FileCreatedEvent) -> None:
-        """Handle a file event."""
-        if not self.allow_file_creation:
+    def queue_event(self, event) -> None:
+        """Batch a file event, unless it came from our own expand."""
+        if self.suppressor.is_own(str(event.src_path)):
+            logger.debug(f"Ignoring our own write to {event.src_path}.")
             return None
 
-        self.read_manifest()
-
-        if not self.event_file_is_in_manifest(event):
-            # This should always fire, new file should not be in the manifest.
-            self.add_event_file_to_manifest(event)
+        self.batcher.add(event)
 
-        self.update_function_code()
+    def handle_create(self, event: FileCreatedEvent) -> None:
+        """Handle a file event."""
+        changes = ChangeSet()
+        changes.add(event)
+        self.handle_changes(changes)
 
     def add_event_file_to_manifest(self, event) -> None:
         """Add file path from event to manifest."""
-        self.manifest.append(self.extract_relative_event_path(event))
-        self.write_manifest()
+        self.manifest.add(self.extract_relative_event_path(event))
 
     def handle_modify(self, event: FileModifiedEvent) -> None:
         """Handle a file event."""
-        if not self.event_file_is_in_manifest(event):
-            logger.debug(self.extract_relative_event_path(event))
-            logger.debug("File is not in manifest")
-            return
+        changes = ChangeSet()
+        changes.add(event)
+        self.handle_changes(changes)
+
+    def handle_changes(self, changes: ChangeSet) -> None:
+        """Upload once for a whole burst of file changes."""
+        # A pull must not rewrite the tree while a burst is applied and queued.
+        with self.tree_lock:
+            return self.queue_changes(changes)
+
+    def queue_changes(self, changes: ChangeSet) -> None:
+        """Apply a burst to the manifest and queue what it changed."""
+        fn = self.function_name
+        self.metrics.incr("events_total", changes.events, fn)
+        self.metrics.incr("merged_events_total", changes.merged, fn)
+        if self.local is not None:
+            changed = self.local_changes(changes)
+        else:
+            with self.metrics.span("manifest_lookup_seconds", fn):
+                changed = self.apply_changes(changes)
 
-        self.update_function_code()
+        if not changed:
+            return None
+
+        if self.validator is not None:
+            with self.metrics.span("validate_seconds", fn):
+                self.validator.retain(self.manifest)
+                errors = self.validator.check(changed)
+            if errors:
+                self.metrics.incr("rejected_changes_total", 1, fn)
+                self.report_invalid(errors)
+                return None
+
+        if self.local is not None:
+            logger.info(f"Running locally after {len(changed)} changed files.")
+            self.local.run(changed)
+            return None
+
+        if self.layer is not None and any(
+            is_dependency(name, self.dependencies, self.layer.patterns)
+            for name in changed
+        ):
+            self.layer_dirty = True
+
+        logger.info(
+            f"Queueing upload of {len(changed)} changed files "
+            f"(merged {changes.merged} of {changes.events} events)."
+        )
+        self.pipeline.submit(changes)
+
+    def report_invalid(self, errors: Dict[str, str]) -> None:
+        """Log why a change set was not uploaded."""
+        for error in errors.values():
+            logger.error(error)
+        logger.error(
+            f"Rejecting the change, {len(errors)} files do not compile or parse."
+        )
+
+    def local_changes(self, changes: ChangeSet) -> Dict[str, None]:
+        """Every path in the change set, there is no manifest to keep locally."""
+        paths = [*changes.created, *changes.deleted, *changes.moved]
+        paths += [*changes.moved.values(), *changes.modified]
+        return {self.extract_relative_path(path): None for path in paths}
+
+    def apply_changes(self, changes: ChangeSet) -> Dict[str, None]:
+        """Update the manifest, returning the changed paths it covers."""
+        self.load_manifest()
+        changed = {}
+        rel = self.extract_relative_path
+        moved = {rel(src): rel(dest) for src, dest in changes.moved.items()}
+        # Editors that save by renaming a temp file fire created events, those
+        # paths were in the manifest before anything is removed below.
+        created = [
+            path
+            for path in map(rel, changes.created)
+            if path in self.manifest or self.allow_file_creation
+        ]
+
+        # Vacate paths first, so a path that was moved away and refilled in
+        # the same burst ends up present.
+        moved_in = {dest for src, dest in moved.items() if self.manifest.remove(src)}
+        for relative_path in map(rel, changes.deleted):
+            if self.manifest.remove(relative_path):
+                changed[relative_path] = None
+
+        for relative_path in created:
+            self.manifest.add(relative_path)
+            changed[relative_path] = None
+
+        for relative_dest in moved.values():
+            if (
+                relative_dest in moved_in
+                or relative_dest in self.manifest
+                or self.allow_file_creation
+            ):
+                self.manifest.add(relative_dest)
+                changed[relative_dest] = None
+
+        for relative_path in map(rel, changes.modified):
+            if relative_path not in self.manifest:
+                logger.debug(relative_path)
+                logger.debug("File is not in manifest")
+                continue
+            changed[relative_path] = None
+
+        return changed
+
+    def function_ready(self) -> bool:
+        """Whether the function can take a code update right now."""
+        config = self.lambda_client.get_function_configuration(
+            FunctionName=self.function_name
+        )
+        self.update_status = config
+        return (
+            config.get("LastUpdateStatus") != "InProgress"
+            and config.get("State") != "Pending"
+        )
+
+    def update_succeeded(self) -> bool:
+        """Whether the code update the function last settled from went through."""
+        config = self.update_status
+        if config is None:
+            logger.debug("Stopped before the update settled.")
+            return False
+        if config.get("LastUpdateStatus") != "Failed":
+            return True
+
+        reason = config.get("LastUpdateStatusReason", "no reason given")
+        logger.error(f"Updating {self.function_name} failed: {reason}")
+        self.metrics.incr("failed_updates_total", 1, self.function_name)
+        # The function keeps running what it reports, not what was uploaded.
+        self.deployed_sha256 = config.get("CodeSha256")
+        return False
 
     def update_function_code(self) -> None:
         """
@@ -230,18 +637,44 @@ class LambdaReloader(LambdaWrapper):
         logger.debug("compressing")
         deployment_package = self.make_archive(self.function_name)
         logger.debug(f"compressed {deployment_package}")
-        self.suppressed_uploads = False
+        return self.upload_archive(self.sink, self.sink.sha256())
+
+    def should_upload(self, code_sha256: Optional[str]) -> bool:
+        """Whether an archive differs from what the function is running."""
+        if code_sha256 is not None and code_sha256 == self.deployed_sha256:
+            self.skipped_uploads += 1
+            self.metrics.incr("skipped_uploads_total", 1, self.function_name)
+            logger.info(
+                f"Archive matches deployed {code_sha256}, skipping upload "
+                f"({self.skipped_uploads} skipped, {self.uploads} uploaded)."
+            )
+            return False
+        return True
+
+    def upload_archive(
+        self, sink: ArchiveSink, code_sha256: Optional[str] = None
+    ) -> Optional[dict]:
+        """Upload a built archive, unless the function already runs it."""
+        # Only a status polled after this upload tells whether it went through.
+        self.update_status = None
+        if self.fan_out is not None:
+            return self.fan_out_archive(sink, code_sha256)
+
+        if not self.should_upload(code_sha256):
+            return None
 
         try:
-            response = self.lambda_client.update_function_code(
-                FunctionName=self.function_name, ZipFile=self.read_archive()
-            )
+            with self.upload_slots or nullcontext():
+                start = time.monotonic()
+                response = self.lambda_client.update_function_code(
+                    FunctionName=self.function_name, **self.code_location(sink)
+                )
+                self.link.record(sink.size, time.monotonic() - start)
         except ClientError as err:
             if err.response["Error"]["Code"] == "ResourceConflictException":
-                # TODO: suppress this
+                # The upload worker waits for the function and tries again.
                 logger.debug("Tried to upload while uploading.")
-                self.suppressed_uploads = True
-                return
+                raise
 
             logger.error(
                 "Couldn't update function %s. Here's why: %s: %s",
@@ -251,14 +684,51 @@ class LambdaReloader(LambdaWrapper):
             )
             raise
         else:
+            self.uploads += 1
+            self.metrics.incr("uploads_total", 1, self.function_name)
+            self.deployed_sha256 = response.get("CodeSha256", code_sha256)
             logger.info("Finished uploading.")
+            return response
 
-            if self.suppressed_uploads:
-                logger.info("Supressing uploading.")
-                time.sleep(2)
-                return self.update_function_code()
+    def fan_out_archive(
+        self, sink: ArchiveSink, code_sha256: Optional[str] = None
+    ) -> Optional[dict]:
+        """Upload a built archive to every fan out function at once."""
+        results = self.fan_out.deploy(self.code_location(sink), code_sha256 or "")
+        updated = [result for result in results if result.status == UPDATED]
+        for result in updated:
+            self.metrics.incr("uploads_total", 1, result.function_name)
+            self.metrics.observe(
+                "fan_out_live_seconds", result.live_seconds, result.function_name
+            )
+        if not updated:
+            return None
 
-            return response
+        self.uploads += 1
+        self.deployed_sha256 = code_sha256
+        return {"Functions": results}
+
+    def code_location(self, sink: ArchiveSink) -> dict:
+        """update_function_code arguments for an archive, staging big ones in S3."""
+        if self.stager is not None and self.stager.wants(sink.size):
+            bucket, key = self.stager.stage(
+                self.function_name, sink.payload(), sink.size
+            )
+            return {"S3Bucket": bucket, "S3Key": key}
+        return {"ZipFile": sink.data()}
+
+    def upload_local(self) -> Optional[dict]:
+        """Build the local directory once and upload it."""
+        if not self.manifest.load():
+            # Nothing downloaded here yet, take the file list from the function.
+            self.download_function_code()
+            self.read_manifest()
+        if self.validator is not None:
+            errors = self.validator.check(self.application_names())
+            if errors:
+                self.report_invalid(errors)
+                return None
+        return self.update_function_code()
 
     def make_archive_all(self, name) -> None:
         """Create zipfile of function_name directory and upload to function_name."""
@@ -267,31 +737,105 @@ class LambdaReloader(LambdaWrapper):
         shutil.make_archive(name, "zip", name)
 
     def read_archive(self) -> bytes:
-        """Open archive and return bytes for upload."""
-        with open(self.archive, "rb") as file_data:
-            return file_data.read()
+        """Return the built archive for upload."""
+        return self.sink.data()
+
+    def archive_names(self) -> List[str]:
+        """Manifest entries that go into the uploaded archive."""
+        return [name for name in self.manifest if name not in self.dependencies]
+
+    def application_names(self) -> List[str]:
+        """Archive entries that are the function's own code, not packages."""
+        patterns = self.layer.patterns if self.layer else DEFAULT_PATTERNS
+        app, _ = split_manifest(self.local_root, self.archive_names(), patterns)
+        return app
+
+    def build_archive(self, sink) -> BuildStats:
+        """Build the archive, republishing the dependency layer if it changed."""
+        if self.layer_dirty:
+            self.publish_layer()
+        return self.builder.build(self.archive_names(), sink)
+
+    def publish_layer(self) -> None:
+        """Publish the dependencies in the manifest as a layer of the function."""
+        app, dependencies = self.layer.split(self.load_manifest())
+        if not dependencies:
+            self.layer_dirty = False
+            logger.info("No dependencies in the manifest, leaving layers as they are.")
+            return
+
+        with self.metrics.span("layer_publish_seconds", self.function_name):
+            arn = self.layer.publish(dependencies)
+            targets = self.fan_out.function_names if self.fan_out else []
+            for function_name in targets or [self.function_name]:
+                self.layer.attach(function_name, arn)
+        self.dependencies = set(dependencies)
+        self.layer_dirty = False
+        logger.info(
+            f"{len(dependencies)} files are in {arn}, "
+            f"uploading the other {len(app)}."
+        )
 
     def make_archive(self, name) -> str:
         """Create archive of all files in the manifest."""
-        # Open a zip file at the given filepath. If it doesn't exist, create one.
-        # If the directory does not exist, it fails with FileNotFoundError
-        with zipfile.ZipFile(self.archive, "w") as zipf:
-            for file in self.manifest:
-                # Add a file located at the source_path to the destination within the zip
-                # file. It will overwrite existing files if the names collide, but it
-                # will give a warning
-                source_path = self.local_root.joinpath(file)
-                zipf.write(source_path, file)
-
-        return str(self.local_root.joinpath(self.archive))
+        self.sink.reset()
+        with self.metrics.span("build_seconds", self.function_name):
+            stats = self.build_archive(self.sink)
+
+        logger.info(f"Built archive, {stats}, peak {self.sink.peak_bytes} bytes")
+        return str(self.sink)
 
     def watch(self) -> None:
         """Start the directory watching daemon."""
-        w = Watcher(
-            self.local_root,
-            Handler(on_create=self.handle_create, on_modify=self.handle_modify),
+        handler = Handler(
+            on_create=self.queue_event,
+            on_modify=self.queue_event,
+            on_delete=self.queue_event,
+            on_move=self.queue_event,
+            event_filter=self.event_filter,
         )
-        w.run()
+        if self.poll_interval:
+            w = PollingWatcher(
+                self.local_root,
+                handler,
+                self.poll_interval,
+                ignore=self.event_filter.ignored,
+            )
+        else:
+            w = Watcher(self.local_root, handler)
+        self.start()
+        try:
+            w.run()
+        finally:
+            self.stop()
+            self.metrics.close()
+
+    def start(self) -> None:
+        """Start batching events and building and uploading archives."""
+        if self.local is not None:
+            self.local.start()
+            self.batcher.start()
+            return
+
+        if self.layer_dirty:
+            self.publish_layer()
+        self.batcher.start()
+        self.pipeline.start()
+        if self.poller is not None:
+            self.poller.start()
+
+    def stop(self) -> None:
+        """Stop the background stages and persist the manifest."""
+        if self.poller is not None:
+            self.poller.stop()
+        self.batcher.stop()
+        if self.local is not None:
+            self.local.stop()
+        else:
+            self.pipeline.stop()
+        self.manifest.flush()
+        if self.validator is not None:
+            self.validator.close()
 
 
 logger = logging.getLogger(__name__)
@@ -305,13 +849,42 @@ parser = ArgParser()
 
 @parser.command()
 def _main(
-    profile_name: str,
-    function_name: str,
-    path: str,
+    profile_name: str = "",
+    function_name: str = "",
+    path: str = "",
     upload: bool = False,
     download: bool = False,
     create: bool = False,
     verbose: bool = False,
+    quiet_period: float = 0.5,
+    max_latency: float = 5.0,
+    rollback: str = "",
+    cache_mb: int = 1024,
+    prune: bool = False,
+    jobs: int = 0,
+    metrics: str = "",
+    config: str = "",
+    upload_workers: int = 0,
+    fan_out: str = "",
+    fan_out_workers: int = 8,
+    s3_bucket: str = "",
+    s3_prefix: str = "consolo/",
+    s3_threshold_mb: int = 10,
+    s3_endpoint_url: str = "",
+    split_layer: bool = False,
+    layer_name: str = "",
+    dependency_patterns: str = "",
+    compression: str = "default",
+    compression_levels: str = "",
+    poll: bool = False,
+    poll_interval: float = 1.0,
+    syntax_check: bool = True,
+    local: bool = False,
+    handler: str = "lambda_function.lambda_handler",
+    events_dir: str = "",
+    local_workers: int = 2,
+    pull: bool = False,
+    pull_interval: float = 5.0,
 ) -> None:
     """Entrypoint for AWS lambda hot reloader, CLI args in signature."""
     log_level = "INFO"
@@ -320,18 +893,150 @@ def _main(
 
     logging.basicConfig(level=log_level)
 
+    if config:
+        from consolo.multi import MultiReloader, load_config, upload_slots
+
+        single = {
+            "--rollback": rollback,
+            "--upload": upload,
+            "--local": local,
+            "--fan-out": fan_out,
+            "--s3-bucket": s3_bucket,
+            "--split-layer": split_layer,
+        }
+        given = [flag for flag, value in single.items() if value]
+        if given:
+            print(f"{', '.join(given)} take a single function, not --config.")
+            exit(1)
+
+        settings = load_config(config, profile_name)
+        workers = upload_workers or settings.upload_workers
+        clients = ClientPool(max_connections=max(10, workers))
+        slots = upload_slots(workers)
+        shared_cache = ArchiveCache(max_bytes=cache_mb * 1024 * 1024)
+        shared_metrics = metrics_from_spec(metrics)
+        # Every function measures its own uplink, automatic compression
+        # depends on it.
+        links = [Throughput() for _ in settings.functions]
+        multi = MultiReloader(
+            poll_interval=poll_interval if poll else None,
+            reloaders=[
+                LambdaReloader(
+                    function.profile_name,
+                    function.function_name,
+                    function.path,
+                    allow_file_creation=create or function.create,
+                    quiet_period=quiet_period,
+                    max_latency=max_latency,
+                    cache=shared_cache,
+                    prune=prune,
+                    jobs=jobs or None,
+                    metrics=shared_metrics,
+                    clients=clients,
+                    upload_slots=slots,
+                    compression=policy_from_spec(
+                        compression,
+                        link,
+                        jobs=jobs or os.cpu_count() or 1,
+                        levels=compression_levels,
+                    ),
+                    link=link,
+                    pull_interval=pull_interval if pull else None,
+                    validator=Validator(function.path, jobs or None)
+                    if syntax_check
+                    else None,
+                )
+                for function, link in zip(settings.functions, links)
+            ]
+        )
+        multi.validate_root()
+        multi.clobber_local()
+        if not download:
+            multi.watch()
+        return
+
+    if not ((profile_name or local) and function_name and path):
+        print("--profile-name, --function-name and --path are needed without --config.")
+        exit(1)
+
     relative_path = path
     path = Path(relative_path).absolute()
 
+    clients = ClientPool(max_connections=max(10, fan_out_workers))
+    deploy_to = None
+    if fan_out:
+        client = clients.client(profile_name, "lambda")
+        names = resolve_functions(client, [function_name, *fan_out.split(",")])
+        logger.info(f"Fanning out to {', '.join(names)}.")
+        deploy_to = FanOut(client, names, workers=fan_out_workers)
+
+    stager = None
+    if s3_bucket:
+        stager = S3Stager(
+            clients.client(profile_name, "s3", s3_endpoint_url or None),
+            s3_bucket,
+            prefix=s3_prefix,
+            threshold=s3_threshold_mb * 1024 * 1024,
+        )
+
+    layer = None
+    if split_layer:
+        patterns = [p.strip() for p in dependency_patterns.split(",") if p.strip()]
+        layer = LayerPublisher(
+            clients.client(profile_name, "lambda"),
+            layer_name or f"{function_name}-dependencies",
+            path,
+            patterns=[*DEFAULT_PATTERNS, *patterns],
+            jobs=jobs or None,
+            stager=stager,
+        )
+
+    link = Throughput()
+    policy = policy_from_spec(
+        compression, link, jobs=jobs or os.cpu_count() or 1, levels=compression_levels
+    )
+
+    reloader_metrics = metrics_from_spec(metrics)
     reloader = LambdaReloader(
-        profile_name, function_name, path, allow_file_creation=create
+        profile_name,
+        function_name,
+        path,
+        allow_file_creation=create,
+        quiet_period=quiet_period,
+        max_latency=max_latency,
+        cache=ArchiveCache(max_bytes=cache_mb * 1024 * 1024),
+        prune=prune,
+        jobs=jobs or None,
+        metrics=reloader_metrics,
+        clients=clients,
+        fan_out=deploy_to,
+        stager=stager,
+        layer=layer,
+        compression=policy,
+        link=link,
+        poll_interval=poll_interval if poll else None,
+        validator=Validator(path, jobs or None) if syntax_check else None,
+        local=LocalRuntime(
+            path,
+            handler,
+            events_dir=Path(events_dir).absolute() if events_dir else None,
+            workers=local_workers,
+            function_name=function_name,
+            metrics=reloader_metrics,
+        )
+        if local
+        else None,
+        pull_interval=pull_interval if pull else None,
     )
     reloader.validate_root()
 
-    if upload and not download:
-        print("Not supported yet.")
-        exit(1)
-        reloader.update_function_code()
+    if local:
+        # Nothing to download or upload, just run what is on disk.
+        reloader.watch()
+    elif rollback:
+        reloader.rollback(rollback)
+    elif upload and not download:
+        reloader.upload_local()
     elif download and not upload:
         reloader.clobber_local()
     else:
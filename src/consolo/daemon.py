@@ -0,0 +1,314 @@
+"""Keep sessions, manifests and caches warm in a daemon behind a Unix socket.
+
+Only the standard library is imported at module level, so the thin client
+starts in a few tens of milliseconds. boto3 and the reloader are imported by
+the daemon, once.
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from consolo.consolo import LambdaReloader
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ("ping", "status", "stop", "download", "upload", "rollback")
+
+# How long the client waits for a daemon it started to listen.
+START_TIMEOUT = 10.0
+
+
+def socket_path() -> Path:
+    """Per-user socket path, in the runtime dir when there is one."""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir, "consolo.sock")
+    return Path(f"/tmp/consolo-{os.getuid()}.sock")
+
+
+class RequestLog(logging.Handler):
+    """Collect the log records of one request, to send back to the client."""
+
+    def __init__(self, level: int) -> None:
+        """Init and only take records from the calling thread."""
+        super().__init__(level)
+        self.thread = threading.get_ident()
+        self.lines: List[str] = []
+        self.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Only records logged while handling this request."""
+        return record.thread == self.thread
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """Keep the formatted record."""
+        self.lines.append(self.format(record))
+
+
+class Daemon:
+    """Warm reloaders, one per function and directory, shared clients and cache.
+
+    Requests for the same function are handled one at a time, requests for
+    different functions in parallel.
+    """
+
+    def __init__(
+        self, path: Path, cache_mb: int = 1024, jobs: Optional[int] = None
+    ) -> None:
+        """Init and import everything a request is going to need."""
+        from consolo.cache import ArchiveCache
+        from consolo.clients import ClientPool
+        from consolo.consolo import LambdaReloader
+
+        self.path = Path(path)
+        self.jobs = jobs
+        self.reloader_class = LambdaReloader
+        self.clients = ClientPool()
+        self.cache = ArchiveCache(max_bytes=cache_mb * 1024 * 1024)
+        self.reloaders: Dict[Tuple[str, str, str], "LambdaReloader"] = {}
+        self.locks: Dict[Tuple[str, str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.requests = 0
+        self.server: Optional[socketserver.ThreadingUnixStreamServer] = None
+
+    def reloader(self, request: dict) -> Tuple["LambdaReloader", threading.Lock]:
+        """The warm reloader for a request, created on first use."""
+        from consolo.validate import Validator
+
+        local_root = str(Path(request["path"]).absolute())
+        key = (request["profile_name"], request["function_name"], local_root)
+        with self._lock:
+            if key not in self.reloaders:
+                reloader = self.reloader_class(
+                    key[0],
+                    key[1],
+                    local_root,
+                    allow_file_creation=False,
+                    cache=self.cache,
+                    jobs=self.jobs,
+                    clients=self.clients,
+                    validator=Validator(local_root, self.jobs)
+                    if request.get("syntax_check", True)
+                    else None,
+                )
+                reloader.validate_root()
+                self.reloaders[key] = reloader
+                self.locks[key] = threading.Lock()
+            return self.reloaders[key], self.locks[key]
+
+    def handle(self, request: dict) -> dict:
+        """Run one request, returning its log and whether it worked."""
+        action = request.get("action")
+        log = RequestLog(logging.DEBUG if request.get("verbose") else logging.INFO)
+        root = logging.getLogger()
+        root.addHandler(log)
+        start = time.perf_counter()
+        try:
+            result = self.dispatch(action, request)
+            ok = True
+        except Exception as err:
+            logger.exception(f"{action} failed.")
+            result = str(err)
+            ok = False
+        finally:
+            root.removeHandler(log)
+
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.requests += 1
+        logger.info(f"Handled {action} in {seconds * 1000:.1f}ms.")
+        return {"ok": ok, "result": result, "log": log.lines, "seconds": seconds}
+
+    def dispatch(self, action: str, request: dict):
+        """Do what the request asks for."""
+        if action == "ping":
+            return "pong"
+        if action == "status":
+            return {
+                "uptime": time.monotonic() - self.started,
+                "requests": self.requests,
+                "functions": [
+                    {"profile_name": p, "function_name": f, "path": d}
+                    for p, f, d in self.reloaders
+                ],
+            }
+        if action == "stop":
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return "stopping"
+        if action not in ACTIONS:
+            raise RuntimeError(f"Unknown action {action}.")
+
+        reloader, lock = self.reloader(request)
+        with lock:
+            reloader.allow_file_creation = request.get("create", False)
+            reloader.prune = request.get("prune", False)
+            if action == "download":
+                reloader.clobber_local()
+            elif action == "upload":
+                reloader.upload_local()
+            elif action == "rollback":
+                reloader.rollback(request["version"])
+            reloader.manifest.flush()
+        return reloader.deployed_sha256
+
+    def serve(self) -> None:
+        """Listen on the socket until stopped."""
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                line = self.rfile.readline()
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    response = {"ok": False, "result": "Bad request.", "log": []}
+                else:
+                    response = daemon.handle(request)
+                self.wfile.write(json.dumps(response, default=str).encode() + b"\n")
+
+        if self.path.exists():
+            if ping(self.path):
+                raise RuntimeError(f"A daemon is already listening on {self.path}.")
+            self.path.unlink()
+
+        # Only the owner may talk to the daemon, it acts with their credentials.
+        umask = os.umask(0o077)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(
+                str(self.path), Handler
+            )
+        finally:
+            os.umask(umask)
+        self.server.daemon_threads = True
+        logger.info(f"Listening on {self.path}.")
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            self.path.unlink(missing_ok=True)
+            for reloader in self.reloaders.values():
+                reloader.manifest.flush()
+
+
+def configure_logging(verbose: bool = False) -> None:
+    """Log everything, so verbose requests get DEBUG records too.
+
+    Only the daemon's own output is filtered, by `verbose`.
+    """
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.DEBUG if verbose else logging.INFO)
+    logging.basicConfig(level=logging.DEBUG, handlers=[handler])
+
+
+def send(path: Path, request: dict, timeout: Optional[float] = None) -> dict:
+    """Send one request to the daemon and wait for its response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(str(path))
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())
+
+
+def ping(path: Path) -> bool:
+    """Whether a daemon answers on the socket."""
+    try:
+        return send(path, {"action": "ping"}, timeout=1.0)["ok"]
+    except (OSError, ValueError):
+        return False
+
+
+def start_daemon(path: Path) -> None:
+    """Start a daemon in the background and wait until it listens."""
+    log = open(f"{path}.log", "ab")
+    subprocess.Popen(
+        [sys.executable, "-m", "consolo.daemon", "--socket", str(path), "serve"],
+        stdin=subprocess.DEVNULL,
+        stdout=log,
+        stderr=log,
+        start_new_session=True,
+    )
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        if ping(path):
+            return
+        time.sleep(0.05)
+    raise RuntimeError(f"The daemon did not start, see {path}.log.")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Thin client for the daemon, or the daemon itself with `serve`."""
+    parser = argparse.ArgumentParser(prog="consolo-ctl")
+    parser.add_argument("action", choices=("serve", *ACTIONS))
+    parser.add_argument("--socket", default=str(socket_path()))
+    parser.add_argument("--profile-name", default="")
+    parser.add_argument("--function-name", default="")
+    parser.add_argument("--path", default="")
+    parser.add_argument("--version", default="", help="cached package to roll back to")
+    parser.add_argument("--create", action="store_true")
+    parser.add_argument("--prune", action="store_true")
+    parser.add_argument("--no-syntax-check", action="store_true")
+    parser.add_argument("--no-start", action="store_true")
+    parser.add_argument("--cache-mb", type=int, default=1024)
+    parser.add_argument("--jobs", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    path = Path(args.socket)
+
+    if args.action == "serve":
+        configure_logging(args.verbose)
+        Daemon(path, cache_mb=args.cache_mb, jobs=args.jobs or None).serve()
+        return
+
+    if args.action in ("download", "upload", "rollback"):
+        if not (args.profile_name and args.function_name and args.path):
+            parser.error(f"{args.action} needs --profile-name, --function-name, --path")
+        if args.action == "rollback" and not args.version:
+            parser.error("rollback needs --version")
+
+    if not ping(path):
+        if args.action == "stop":
+            return
+        if args.no_start:
+            print(f"No daemon is listening on {path}.", file=sys.stderr)
+            exit(1)
+        start_daemon(path)
+
+    response = send(
+        path,
+        {
+            "action": args.action,
+            "profile_name": args.profile_name,
+            "function_name": args.function_name,
+            "path": args.path,
+            "version": args.version,
+            "create": args.create,
+            "prune": args.prune,
+            "syntax_check": not args.no_syntax_check,
+            "verbose": args.verbose,
+        },
+    )
+    for line in response["log"]:
+        print(line, file=sys.stderr)
+    if response["result"] is not None and args.action in ("ping", "status"):
+        print(json.dumps(response["result"], indent=2))
+    if not response["ok"]:
+        print(response["result"], file=sys.stderr)
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Stream deployment packages to disk."""
+import base64
+import hashlib
+import logging
+import re
+import time
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 2.0
+
+
+class DownloadError(RuntimeError):
+    """The package could not be downloaded intact."""
+
+
+def stream_download(
+    http: requests.Session,
+    url: str,
+    dest: Path,
+    expected_sha256: Optional[str] = None,
+    chunk_size: int = CHUNK_SIZE,
+    retries: int = 5,
+    timeout: float = 30.0,
+    resume: bool = False,
+) -> int:
+    """Download url to dest in fixed size chunks, returning the size.
+
+    Dropped connections are resumed with a Range request from where they left
+    off, and with `resume` so is whatever an earlier attempt left in dest. The
+    SHA256 is computed while streaming and compared to `expected_sha256`
+    (base64, as lambda reports CodeSha256). dest is deleted if it does not
+    match.
+    """
+    hasher = hashlib.sha256()
+    received = 0
+    attempt = 0
+    start = time.monotonic()
+
+    with open(dest, "a+b" if resume else "w+b") as f:
+        f.seek(0)
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+            received += len(chunk)
+        if received:
+            logger.info(f"Resuming the download at {received} bytes.")
+
+        while True:
+            headers = {"Range": f"bytes={received}-"} if received else {}
+            try:
+                with http.get(url, headers=headers, stream=True, timeout=timeout) as r:
+                    if received and r.status_code == 416:
+                        # Nothing left to send, or a partial from another package.
+                        logger.info("Server refused the range request, restarting.")
+                        received = restart(f)
+                        hasher = hashlib.sha256()
+                        continue
+                    r.raise_for_status()
+                    if received and r.status_code != 206:
+                        logger.info("Server ignored the range request, restarting.")
+                        received = restart(f)
+                        hasher = hashlib.sha256()
+                    elif received and range_start(r) != received:
+                        logger.info("Server sent a different range, restarting.")
+                        received = restart(f)
+                        hasher = hashlib.sha256()
+                        continue
+
+                    total = received + int(r.headers.get("Content-Length", 0))
+                    last_report = time.monotonic()
+                    for chunk in r.iter_content(chunk_size):
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        received += len(chunk)
+
+                        now = time.monotonic()
+                        if now - last_report >= PROGRESS_INTERVAL:
+                            last_report = now
+                            log_progress(received, total, now - start)
+                break
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+            ) as err:
+                attempt += 1
+                if attempt > retries:
+                    raise DownloadError(
+                        f"Gave up downloading after {retries} retries."
+                    ) from err
+                logger.warning(
+                    f"Download interrupted at {received} bytes ({err}), resuming."
+                )
+                time.sleep(min(2**attempt * 0.1, 5))
+
+    elapsed = time.monotonic() - start
+    log_progress(received, received, elapsed)
+
+    if expected_sha256 is not None:
+        digest = base64.b64encode(hasher.digest()).decode()
+        if digest != expected_sha256:
+            Path(dest).unlink(missing_ok=True)
+            raise DownloadError(
+                f"Downloaded package {digest} is not {expected_sha256}."
+            )
+
+    return received
+
+
+def restart(f: BinaryIO) -> int:
+    """Throw away what was downloaded so far, returning the new offset."""
+    f.seek(0)
+    f.truncate()
+    return 0
+
+
+def range_start(response: requests.Response) -> Optional[int]:
+    """Offset a partial response starts at, from its Content-Range."""
+    match = re.match(r"bytes (\d+)-", response.headers.get("Content-Range", ""))
+    return int(match.group(1)) if match else None
+
+
+def log_progress(received: int, total: int, elapsed: float) -> None:
+    """Log how far along a download is and how fast it is going."""
+    rate = received / elapsed / 1024 / 1024 if elapsed else 0.0
+    if total:
+        logger.info(
+            f"Downloaded {received}/{total} bytes "
+            f"({received * 100 // total}%) at {rate:.2f} MiB/s."
+        )
+    else:
+        logger.info(f"Downloaded {received} bytes at {rate:.2f} MiB/s.")
@@ -0,0 +1,186 @@
+"""Expand deployment packages, only touching files that differ."""
+import logging
+import os
+import threading
+import time
+import zipfile
+import zlib
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class ExpandStats:
+    """What one expand wrote, skipped and found left over."""
+
+    written: int = 0
+    unchanged: int = 0
+    bytes_written: int = 0
+    stale: List[str] = field(default_factory=list)
+    removed: int = 0
+    seconds: float = 0.0
+
+    def __str__(self) -> str:
+        """Summarise the expand for logging."""
+        return (
+            f"wrote {self.written} files ({self.bytes_written} bytes), "
+            f"{self.unchanged} unchanged, {len(self.stale)} not in package, "
+            f"removed {self.removed} in {self.seconds:.3f}s"
+        )
+
+
+def default_keep(name: str) -> bool:
+    """Never report or remove hidden files and directories or bytecode caches.
+
+    Hidden files such as .env, .gitignore or .python-version are rarely in a
+    package but should survive --prune.
+    """
+    return any(
+        part.startswith(".") or part == "__pycache__"
+        for part in PurePosixPath(name).parts
+    )
+
+
+def file_crc32(path: Path) -> int:
+    """CRC32 of a local file, as zip stores it."""
+    crc = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return crc
+            crc = zlib.crc32(chunk, crc)
+
+
+def is_unchanged(path: Path, info: zipfile.ZipInfo) -> bool:
+    """Whether the local file already has the member's contents."""
+    try:
+        if os.stat(path).st_size != info.file_size:
+            return False
+        return file_crc32(path) == info.CRC
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        return False
+
+
+def safe_name(name: str) -> bool:
+    """Refuse member names that would escape the destination."""
+    parts = PurePosixPath(name).parts
+    return bool(parts) and not name.startswith("/") and ".." not in parts
+
+
+class WriteSuppressor:
+    """Remember files we wrote so the watcher can ignore their events."""
+
+    def __init__(self) -> None:
+        """Init with nothing written."""
+        self.writes: Dict[str, Optional[Tuple[int, int]]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, path: Path) -> None:
+        """Record a write (or removal) of path."""
+        try:
+            st = os.stat(path)
+            signature = (st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            signature = None
+        with self._lock:
+            self.writes[str(path)] = signature
+
+    def is_own(self, path: str) -> bool:
+        """Whether path is still exactly as we left it."""
+        with self._lock:
+            if path not in self.writes:
+                return False
+            expected = self.writes[path]
+
+        try:
+            st = os.stat(path)
+            signature = (st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            signature = None
+
+        if signature == expected:
+            return True
+
+        # Someone else changed it since, stop suppressing.
+        with self._lock:
+            self.writes.pop(path, None)
+        return False
+
+
+def extract_member(zipf: zipfile.ZipFile, info: zipfile.ZipInfo, dest: Path) -> None:
+    """Stream one member to dest, creating its directory."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    with zipf.open(info) as src, open(dest, "wb") as f:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            f.write(chunk)
+
+
+def expand_changed(
+    archive: Path,
+    local_root: Path,
+    remove_stale: bool = False,
+    keep: Callable[[str], bool] = default_keep,
+    on_write: Optional[Callable[[Path], None]] = None,
+) -> ExpandStats:
+    """Extract only the members of archive that differ from local_root.
+
+    Members are compared by size and CRC32. Local files that are not in the
+    archive are reported, and removed if `remove_stale` is set, unless `keep`
+    says otherwise.
+    """
+    start = time.perf_counter()
+    stats = ExpandStats()
+    local_root = Path(local_root)
+    names = set()
+
+    with zipfile.ZipFile(archive) as zipf:
+        for info in zipf.infolist():
+            if not safe_name(info.filename):
+                logger.warning(f"Skipping unsafe member {info.filename}.")
+                continue
+
+            names.add(info.filename.rstrip("/"))
+            dest = local_root.joinpath(info.filename)
+            if info.is_dir():
+                dest.mkdir(parents=True, exist_ok=True)
+                continue
+
+            if is_unchanged(dest, info):
+                stats.unchanged += 1
+                continue
+
+            extract_member(zipf, info, dest)
+            stats.written += 1
+            stats.bytes_written += info.file_size
+            if on_write is not None:
+                on_write(dest)
+
+    for dirpath, dirnames, filenames in os.walk(local_root):
+        prefix = Path(dirpath).relative_to(local_root).as_posix() + "/"
+        prefix = "" if prefix == "./" else prefix
+        # Kept directories such as .git or .venv are not even walked.
+        dirnames[:] = [d for d in dirnames if not keep(f"{prefix}{d}/")]
+        for filename in filenames:
+            path = Path(dirpath, filename)
+            name = path.relative_to(local_root).as_posix()
+            if name in names or keep(name):
+                continue
+
+            stats.stale.append(name)
+            if remove_stale:
+                path.unlink()
+                stats.removed += 1
+                if on_write is not None:
+                    on_write(path)
+
+    stats.seconds = time.perf_counter() - start
+    return stats
@@ -0,0 +1,185 @@
+"""Deploy one built package to many functions at once."""
+import fnmatch
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+from consolo.upload import Backoff, is_conflict
+
+logger = logging.getLogger(__name__)
+
+UPDATED = "updated"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+def resolve_functions(client, patterns: Iterable[str]) -> List[str]:
+    """Function names matching a list of names and globs, in order.
+
+    Plain names are taken as they are, globs are matched against every
+    function in the account and region.
+    """
+    patterns = [p.strip() for p in patterns if p.strip()]
+    globs = [p for p in patterns if any(c in p for c in "*?[")]
+    available: List[str] = []
+    if globs:
+        paginator = client.get_paginator("list_functions")
+        for page in paginator.paginate():
+            available.extend(f["FunctionName"] for f in page["Functions"])
+
+    names: List[str] = []
+    for pattern in patterns:
+        matched = fnmatch.filter(available, pattern) if pattern in globs else [pattern]
+        if not matched:
+            logger.warning(f"No functions match {pattern}.")
+        names.extend(name for name in matched if name not in names)
+    return names
+
+
+@dataclass
+class DeployResult:
+    """How deploying to one function went."""
+
+    function_name: str
+    status: str = ""
+    attempts: int = 0
+    upload_seconds: float = 0.0
+    live_seconds: float = 0.0
+    error: str = ""
+
+    def __str__(self) -> str:
+        """One line for the report."""
+        line = (
+            f"{self.function_name}: {self.status} after {self.attempts} attempts, "
+            f"upload {self.upload_seconds:.3f}s, live {self.live_seconds:.3f}s"
+        )
+        return f"{line} ({self.error})" if self.error else line
+
+
+class FanOut:
+    """Send the same archive to several functions on a bounded thread pool.
+
+    Each function is updated independently, waiting until it can take an
+    update and retrying with backoff while it is busy, so the whole deploy
+    takes about as long as the slowest function rather than all of them added
+    up.
+    """
+
+    def __init__(
+        self,
+        client,
+        function_names: List[str],
+        workers: int = 8,
+        max_retries: int = 5,
+        backoff: Optional[Backoff] = None,
+    ) -> None:
+        """Init and set where to deploy and how many uploads run at once."""
+        self.client = client
+        self.function_names = function_names
+        self.workers = max(1, min(workers, len(function_names)))
+        self.max_retries = max_retries
+        self.backoff = backoff or Backoff()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Thread pool for uploads, created on first use."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix="consolo-fanout"
+            )
+        return self._executor
+
+    def deploy(self, code: dict, code_sha256: str = "") -> List[DeployResult]:
+        """Deploy to every function, returning a result for each.
+
+        `code` is what update_function_code should be called with, either the
+        archive as `ZipFile` or where it was staged as `S3Bucket` and `S3Key`.
+        """
+        start = time.monotonic()
+        results = list(
+            self.executor.map(
+                lambda name: self.deploy_one(name, code, code_sha256),
+                self.function_names,
+            )
+        )
+        elapsed = time.monotonic() - start
+        self.report(results, elapsed)
+        return results
+
+    def deploy_one(
+        self, function_name: str, code: dict, code_sha256: str
+    ) -> DeployResult:
+        """Update one function, waiting for it and retrying while it is busy."""
+        result = DeployResult(function_name)
+        start = time.monotonic()
+        try:
+            config = self.wait_until_ready(function_name)
+            if code_sha256 and config.get("CodeSha256") == code_sha256:
+                result.status = SKIPPED
+                return result
+
+            for attempt in range(self.max_retries + 1):
+                result.attempts += 1
+                try:
+                    self.client.update_function_code(FunctionName=function_name, **code)
+                    break
+                except Exception as err:
+                    if not is_conflict(err) or attempt == self.max_retries:
+                        raise
+                    logger.debug(f"{function_name} busy, retrying upload.")
+                    time.sleep(self.backoff.delay(attempt))
+                    self.wait_until_ready(function_name)
+
+            result.upload_seconds = time.monotonic() - start
+            config = self.wait_until_ready(function_name)
+            result.live_seconds = time.monotonic() - start
+            if config.get("LastUpdateStatus") == "Failed":
+                result.status = FAILED
+                result.error = config.get("LastUpdateStatusReason", "update failed")
+            else:
+                result.status = UPDATED
+        except Exception as err:
+            result.status = FAILED
+            result.error = str(err)
+            logger.debug(f"Deploying to {function_name} failed.", exc_info=True)
+        return result
+
+    def wait_until_ready(self, function_name: str, timeout: float = 300.0) -> dict:
+        """Poll a function with backoff until no update is in progress."""
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            config = self.client.get_function_configuration(FunctionName=function_name)
+            if (
+                config.get("LastUpdateStatus") != "InProgress"
+                and config.get("State") != "Pending"
+            ):
+                return config
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{function_name} still updating after {timeout}s.")
+            time.sleep(self.backoff.delay(attempt))
+            attempt += 1
+
+    def report(self, results: List[DeployResult], elapsed: float) -> None:
+        """Log how every function went."""
+        counts = {
+            status: sum(r.status == status for r in results)
+            for status in (UPDATED, SKIPPED, FAILED)
+        }
+        summed = sum(r.live_seconds for r in results)
+        logger.info(
+            f"Deployed to {len(results)} functions in {elapsed:.3f}s "
+            f"({summed:.3f}s one after another): "
+            + ", ".join(f"{n} {status}" for status, n in counts.items())
+        )
+        for result in results:
+            log = logger.warning if result.status == FAILED else logger.info
+            log(f"  {result}")
+
+    def close(self) -> None:
+        """Stop the upload threads."""
+        if self._executor is not None:
+            self._executor.shutdown()
@@ -0,0 +1,225 @@
+"""Gitignore style rules for paths that should never trigger anything."""
+import logging
+import re
+from pathlib import Path
+from typing import Iterable, List, Optional, Pattern, Tuple
+
+from watchdog.events import FileCreatedEvent, FileDeletedEvent, FileMovedEvent
+
+from consolo.metrics import Metrics
+from consolo.remote import CONFLICT_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+IGNORE_FILE = ".consoloignore"
+
+# Caches, VCS metadata and editor droppings. A .consoloignore can re-include
+# any of these with `!`.
+DEFAULT_RULES = (
+    "__pycache__/",
+    "*.py[cod]",
+    ".git/",
+    ".hg/",
+    ".svn/",
+    ".pytest_cache/",
+    ".mypy_cache/",
+    ".ruff_cache/",
+    ".tox/",
+    ".venv/",
+    ".idea/",
+    ".vscode/",
+    ".DS_Store",
+    "*.sw[a-p]",
+    "*~",
+    ".#*",
+    "#*#",
+    "4913",
+    f"*{CONFLICT_SUFFIX}",
+    IGNORE_FILE,
+)
+
+
+def translate(pattern: str) -> str:
+    """Regex for the body of a gitignore pattern, without anchors."""
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i) and (i == 0 or pattern[i - 1] == "/"):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif c == "*":
+            out.append("[^/]*")
+            i += 1
+        elif c == "?":
+            out.append("[^/]")
+            i += 1
+        elif c == "[":
+            end = pattern.find("]", i + 2 if pattern[i + 1 : i + 2] in "!^" else i + 1)
+            if end == -1:
+                out.append(re.escape(c))
+                i += 1
+                continue
+            body = pattern[i + 1 : end]
+            if body[:1] in ("!", "^"):
+                body = "^" + body[1:]
+            out.append("[" + body.replace("\\", "\\\\") + "]")
+            i = end + 1
+        elif c == "\\" and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(c))
+            i += 1
+    return "".join(out)
+
+
+def compile_rule(line: str) -> Optional[Tuple[bool, str]]:
+    """Whether a .gitignore line negates, and the regex for it, if it is a rule."""
+    if not line.strip() or line.startswith("#"):
+        return None
+
+    line = line.rstrip("\n")
+    # Trailing spaces are ignored unless escaped.
+    while line.endswith(" ") and not line.endswith("\\ "):
+        line = line[:-1]
+
+    negate = line.startswith("!")
+    if negate:
+        line = line[1:]
+    elif line.startswith("\\!") or line.startswith("\\#"):
+        line = line[1:]
+
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+
+    # A slash anywhere but the end anchors the pattern to the root.
+    anchored = "/" in line
+    line = line.lstrip("/")
+    prefix = "" if anchored else "(?:.*/)?"
+    # Directories match everything inside them, files only themselves too.
+    suffix = "/.*" if dir_only else "(?:/.*)?"
+    return negate, f"{prefix}{translate(line)}{suffix}"
+
+
+class IgnoreRules:
+    """Gitignore rules compiled into a few regexes.
+
+    Consecutive rules of the same kind are joined into one alternation, and the
+    groups are tried last first, so the last matching rule still decides as in
+    git.
+    """
+
+    def __init__(self, lines: Iterable[str]) -> None:
+        """Init and compile the rules."""
+        self.groups: List[Tuple[bool, Pattern]] = []
+        run: List[str] = []
+        negate = False
+        count = 0
+        for line in lines:
+            rule = compile_rule(line)
+            if rule is None:
+                continue
+            count += 1
+            if run and rule[0] != negate:
+                self.groups.append((negate, self.join(run)))
+                run = []
+            negate = rule[0]
+            run.append(rule[1])
+        if run:
+            self.groups.append((negate, self.join(run)))
+        self.groups.reverse()
+        self.count = count
+
+    @staticmethod
+    def join(patterns: List[str]) -> Pattern:
+        """One regex matching any of the patterns."""
+        return re.compile("^(?:" + "|".join(f"(?:{p})" for p in patterns) + ")$")
+
+    @classmethod
+    def from_root(cls, local_root: Path) -> "IgnoreRules":
+        """Defaults plus whatever the root's .consoloignore says."""
+        lines = list(DEFAULT_RULES)
+        path = Path(local_root, IGNORE_FILE)
+        if path.is_file():
+            lines.extend(path.read_text().splitlines())
+        rules = cls(lines)
+        logger.debug(f"Compiled {rules.count} ignore rules for {local_root}.")
+        return rules
+
+    def matches(self, name: str) -> bool:
+        """Whether a path relative to the root is ignored."""
+        for negate, regex in self.groups:
+            if regex.match(name):
+                return not negate
+        return False
+
+
+class EventFilter:
+    """Drop events for ignored paths before they reach a reloader.
+
+    A move out of an ignored path, like an editor renaming its temporary file
+    over the original, becomes a create of the destination. A move into one
+    becomes a delete of the source.
+    """
+
+    def __init__(
+        self,
+        roots: Iterable[Tuple[Path, IgnoreRules, str]],
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        """Init and set the rules of each root and the function it belongs to."""
+        self.roots = sorted(
+            ((Path(root), rules, fn) for root, rules, fn in roots),
+            key=lambda entry: len(entry[0].parts),
+            reverse=True,
+        )
+        self.metrics = metrics
+        self.dropped = 0
+
+    def ignored(self, path: str) -> bool:
+        """Whether an absolute path is ignored by the root it is in.
+
+        Directories are only matched by directory rules with a trailing slash.
+        """
+        slash = "/" if str(path).endswith("/") else ""
+        path = Path(path)
+        for root, rules, _ in self.roots:
+            if root in path.parents:
+                return rules.matches(path.relative_to(root).as_posix() + slash)
+        return False
+
+    def drop(self, path: str) -> None:
+        """Count a dropped event."""
+        self.dropped += 1
+        logger.debug(f"Ignoring {path}.")
+        if self.metrics is not None:
+            path = Path(path)
+            for root, _, fn in self.roots:
+                if root in path.parents:
+                    self.metrics.incr("ignored_events_total", 1, fn)
+                    break
+
+    def __call__(self, event):
+        """The event to handle instead, None to drop it."""
+        if isinstance(event, FileMovedEvent):
+            src = self.ignored(event.src_path)
+            dest = self.ignored(event.dest_path)
+            if src and dest:
+                self.drop(event.src_path)
+                return None
+            if src:
+                return FileCreatedEvent(event.dest_path)
+            if dest:
+                return FileDeletedEvent(event.src_path)
+            return event
+
+        if self.ignored(event.src_path):
+            self.drop(event.src_path)
+            return None
+        return event
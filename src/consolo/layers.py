@@ -0,0 +1,225 @@
+"""Publish vendored dependencies as a layer, apart from the application."""
+import csv
+import fnmatch
+import hashlib
+import logging
+import os
+import posixpath
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from consolo.archive import ArchiveSink, IncrementalArchiveBuilder
+from consolo.staging import S3Stager
+from consolo.upload import Backoff, is_conflict
+
+logger = logging.getLogger(__name__)
+
+# Always dependencies, whether or not a RECORD lists them.
+DEFAULT_PATTERNS = ("*.dist-info/*", "*.egg-info/*")
+
+# Where the python runtime looks for packages inside a layer.
+LAYER_PREFIX = "python/"
+
+
+def installed_files(local_root: Path, manifest: Iterable[str]) -> Set[str]:
+    """Files installed by packages at the top level, per their dist-info RECORDs.
+
+    Only top level packages are moved to the layer, as only they end up on the
+    same import path under /opt/python.
+    """
+    installed: Set[str] = set()
+    for name in manifest:
+        parts = name.split("/")
+        if len(parts) != 2 or not parts[0].endswith(".dist-info"):
+            continue
+        if parts[1] != "RECORD":
+            continue
+
+        try:
+            with open(Path(local_root, name), newline="") as f:
+                for row in csv.reader(f):
+                    if not row:
+                        continue
+                    path = posixpath.normpath(row[0])
+                    # Console scripts point outside the package root.
+                    if not path.startswith(("../", "/")):
+                        installed.add(path)
+        except OSError:
+            logger.warning(f"Could not read {name}.")
+
+    # Directory entries of installed packages go along with their files.
+    for path in list(installed):
+        parent = posixpath.dirname(path)
+        while parent:
+            installed.add(parent + "/")
+            parent = posixpath.dirname(parent)
+    return installed
+
+
+def split_manifest(
+    local_root: Path,
+    manifest: Iterable[str],
+    patterns: Sequence[str] = DEFAULT_PATTERNS,
+) -> Tuple[List[str], List[str]]:
+    """Split a manifest into application files and dependencies."""
+    names = list(manifest)
+    installed = installed_files(local_root, names)
+    app, dependencies = [], []
+    for name in names:
+        if is_dependency(name, installed, patterns):
+            dependencies.append(name)
+        else:
+            app.append(name)
+    return app, dependencies
+
+
+def is_dependency(name: str, installed: Set[str], patterns: Sequence[str]) -> bool:
+    """Whether a manifest entry belongs in the dependency layer."""
+    return name in installed or any(fnmatch.fnmatch(name, p) for p in patterns)
+
+
+def content_hash(local_root: Path, names: Iterable[str]) -> str:
+    """Digest of the names and contents of files, ignoring their mtimes."""
+    digest = hashlib.sha256()
+    for name in sorted(names):
+        digest.update(name.encode() + b"\0")
+        path = Path(local_root, name)
+        if path.is_file():
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LayerPublisher:
+    """Publish dependencies as versions of a layer and attach them to functions.
+
+    Versions are described by the content hash of what is in them, so unchanged
+    dependencies are never zipped or published twice, not even across runs.
+    """
+
+    def __init__(
+        self,
+        client,
+        layer_name: str,
+        local_root: Path,
+        patterns: Sequence[str] = DEFAULT_PATTERNS,
+        jobs: Optional[int] = None,
+        stager: Optional[S3Stager] = None,
+    ) -> None:
+        """Init and set the layer name and where the dependencies live."""
+        self.client = client
+        self.layer_name = layer_name
+        self.local_root = Path(local_root)
+        self.patterns = tuple(patterns)
+        self.stager = stager
+        self.builder = IncrementalArchiveBuilder(
+            self.local_root, jobs=jobs, prefix=LAYER_PREFIX
+        )
+        # Per process, so that two publishing the same layer do not share it.
+        self.sink = ArchiveSink(
+            Path(f"/tmp/.consolo.{layer_name}.{os.getpid()}.layer.zip")
+        )
+        # content hash -> layer version ARN
+        self.versions: Dict[str, str] = {}
+
+    def split(self, manifest: Iterable[str]) -> Tuple[List[str], List[str]]:
+        """Application files and dependencies in a manifest."""
+        return split_manifest(self.local_root, manifest, self.patterns)
+
+    def publish(self, dependencies: List[str]) -> str:
+        """ARN of a layer version holding dependencies, publishing if needed."""
+        digest = content_hash(self.local_root, dependencies)
+        if digest not in self.versions:
+            arn = self.find(digest)
+            if arn is None:
+                arn = self.publish_version(dependencies, digest)
+            else:
+                logger.info(f"Dependencies {digest[:12]} already published as {arn}.")
+            self.versions[digest] = arn
+        return self.versions[digest]
+
+    def description(self, digest: str) -> str:
+        """Layer version description recording its content hash."""
+        return f"consolo dependencies {digest}"
+
+    def find(self, digest: str) -> Optional[str]:
+        """An existing version of the layer with this content, if any."""
+        paginator = self.client.get_paginator("list_layer_versions")
+        for page in paginator.paginate(LayerName=self.layer_name):
+            for version in page["LayerVersions"]:
+                if version.get("Description") == self.description(digest):
+                    return version["LayerVersionArn"]
+        return None
+
+    def publish_version(self, dependencies: List[str], digest: str) -> str:
+        """Zip dependencies under python/ and publish them as a new version."""
+        self.sink.reset()
+        stats = self.builder.build(dependencies, self.sink)
+        size = self.sink.size
+        logger.info(f"Built layer {self.layer_name}, {stats}.")
+
+        if self.stager is not None and self.stager.wants(size):
+            bucket, key = self.stager.stage(
+                f"{self.layer_name}-layer", self.sink.payload(), size
+            )
+            content = {"S3Bucket": bucket, "S3Key": key}
+        else:
+            content = {"ZipFile": self.sink.data()}
+
+        response = self.client.publish_layer_version(
+            LayerName=self.layer_name,
+            Description=self.description(digest),
+            Content=content,
+        )
+        arn = response["LayerVersionArn"]
+        logger.info(f"Published {size} bytes of dependencies as {arn}.")
+        return arn
+
+    def attach(self, function_name: str, arn: str) -> bool:
+        """Point a function at a layer version, replacing older versions of it.
+
+        Returns whether the function configuration had to change.
+        """
+        config = self.client.get_function_configuration(FunctionName=function_name)
+        current = [layer["Arn"] for layer in config.get("Layers", [])]
+        unversioned = arn.rsplit(":", 1)[0]
+        layers = [a for a in current if a.rsplit(":", 1)[0] != unversioned]
+        layers.append(arn)
+        if layers == current:
+            return False
+
+        backoff = Backoff()
+        for attempt in range(10):
+            try:
+                self.client.update_function_configuration(
+                    FunctionName=function_name, Layers=layers
+                )
+                break
+            except Exception as err:
+                if not is_conflict(err) or attempt == 9:
+                    raise
+                logger.debug(f"{function_name} busy, retrying layer update.")
+                time.sleep(backoff.delay(attempt))
+        logger.info(f"Attached {arn} to {function_name}.")
+        # The code update that usually follows is refused until this settles.
+        self.wait_until_ready(function_name)
+        return True
+
+    def wait_until_ready(self, function_name: str, timeout: float = 300.0) -> dict:
+        """Poll a function with backoff until no update is in progress."""
+        backoff = Backoff()
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            config = self.client.get_function_configuration(FunctionName=function_name)
+            if (
+                config.get("LastUpdateStatus") != "InProgress"
+                and config.get("State") != "Pending"
+            ):
+                return config
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{function_name} still updating after {timeout}s.")
+            time.sleep(backoff.delay(attempt))
+            attempt += 1
@@ -0,0 +1,442 @@
+"""Run the handler locally in warm worker processes, without any network."""
+import importlib
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import tempfile
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Set, Tuple
+
+from consolo.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# Longest result shown in the log for each invocation.
+PREVIEW_CHARS = 200
+
+
+def module_name(name: str) -> Optional[str]:
+    """Dotted module name of a path relative to the root, None if not Python."""
+    if not name.endswith(".py"):
+        return None
+    parts = name[:-3].split("/")
+    if parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts) or None
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def exported(module) -> List[Any]:
+    """A module's own globals, leaving out dunders and singletons."""
+    return [
+        value
+        for key, value in list(vars(module).items())
+        if not key.startswith("__")
+        and value is not None
+        and value is not True
+        and value is not False
+    ]
+
+
+class LocalContext:
+    """Enough of the Lambda context object for most handlers."""
+
+    def __init__(self, function_name: str, memory_mb: int, timeout: float) -> None:
+        """Init and start the clock on the invocation."""
+        self.function_name = function_name
+        self.function_version = "$LATEST"
+        self.invoked_function_arn = (
+            f"arn:aws:lambda:local:000000000000:function:{function_name}"
+        )
+        self.memory_limit_in_mb = memory_mb
+        self.aws_request_id = str(uuid.uuid4())
+        self.log_group_name = f"/aws/lambda/{function_name}"
+        self.log_stream_name = "local"
+        self.deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self) -> int:
+        """Milliseconds left before the invocation times out."""
+        return max(int((self.deadline - time.monotonic()) * 1000), 0)
+
+
+class WorkerState:
+    """The handler as imported inside a worker process."""
+
+    def __init__(self, local_root: str, handler: str) -> None:
+        """Init and set where the code is and which function to call."""
+        self.local_root = os.path.realpath(local_root)
+        self.module, _, self.function = handler.rpartition(".")
+        self.handler = None
+        self.error: Optional[str] = None
+
+    def load(self) -> None:
+        """Import the handler module and everything it imports."""
+        try:
+            module = importlib.import_module(self.module)
+            self.handler = getattr(module, self.function)
+            self.error = None
+        except Exception:
+            self.handler = None
+            self.error = traceback.format_exc()
+
+    def is_local(self, module) -> bool:
+        """Whether a module was imported from the function's code."""
+        path = getattr(module, "__file__", None)
+        if not path:
+            return False
+        return os.path.realpath(path).startswith(self.local_root + os.sep)
+
+    def stale(self, touched: Iterable[str]) -> Set[str]:
+        """Touched modules plus the local modules holding on to anything of theirs.
+
+        A module depends on a stale one if it holds the module itself, a
+        function or class defined in it, or the very object one of its globals
+        is bound to, which catches `from helper import VALUE` of constants.
+        """
+        local = {
+            name: module
+            for name, module in list(sys.modules.items())
+            if module is not None and self.is_local(module)
+        }
+        stale = {name for name in touched if name in local}
+        grew = bool(stale)
+        while grew:
+            grew = False
+            # Functions, classes and modules are matched by where they are
+            # defined, as the same one is often imported all over the place.
+            held = {
+                id(value)
+                for name in stale
+                for value in exported(local[name])
+                if not (
+                    inspect.ismodule(value)
+                    or inspect.isclass(value)
+                    or inspect.isroutine(value)
+                )
+            }
+            for name, module in local.items():
+                if name in stale:
+                    continue
+                for value in exported(module):
+                    owner = (
+                        value.__name__
+                        if inspect.ismodule(value)
+                        else getattr(value, "__module__", None)
+                    )
+                    if owner in stale or id(value) in held:
+                        stale.add(name)
+                        grew = True
+                        break
+        return stale
+
+    def reload(self, touched: List[str]) -> Tuple[int, Optional[str]]:
+        """Drop stale modules and import the handler again."""
+        stale = self.stale(touched)
+        for name in stale:
+            del sys.modules[name]
+        importlib.invalidate_caches()
+        if stale or self.handler is None:
+            self.load()
+        return len(stale), self.error
+
+    def invoke(self, event: Any, context: LocalContext) -> dict:
+        """Call the handler once, timing it and measuring memory."""
+        if self.handler is None:
+            return {"seconds": 0.0, "error": self.error, "result": None}
+
+        start = time.perf_counter()
+        try:
+            result = self.handler(event, context)
+            error = None
+        except Exception:
+            result = None
+            error = traceback.format_exc()
+        seconds = time.perf_counter() - start
+
+        if result is not None:
+            result = json.dumps(result, default=str)
+        return {"seconds": seconds, "error": error, "result": result}
+
+
+def serve(conn, local_root: str, handler: str, environment: dict) -> None:
+    """Worker process loop: import once, then reload and invoke on request."""
+    os.chdir(local_root)
+    # Cached bytecode is only checked by size and mtime in whole seconds, so
+    # quick same-size edits could run stale code. Always compile from source.
+    sys.dont_write_bytecode = True
+    sys.pycache_prefix = tempfile.mkdtemp(prefix="consolo-pycache-")
+    sys.path.insert(0, local_root)
+    os.environ.update(environment)
+    state = WorkerState(local_root, handler)
+    state.load()
+    conn.send(("ready", state.error))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+
+        kind, payload = message
+        if kind == "reload":
+            conn.send(state.reload(payload))
+        elif kind == "invoke":
+            event, function_name, memory_mb, timeout = payload
+            context = LocalContext(function_name, memory_mb, timeout)
+            reply = state.invoke(event, context)
+            reply["rss_bytes"] = rss_bytes()
+            reply["peak_bytes"] = max(peak_rss_bytes(), reply["rss_bytes"])
+            conn.send(reply)
+
+
+@dataclass
+class Invocation:
+    """Outcome of running the handler on one test event."""
+
+    event: str
+    seconds: float
+    rss_bytes: int = 0
+    peak_bytes: int = 0
+    error: Optional[str] = None
+    result: Optional[str] = None
+
+    def __str__(self) -> str:
+        """One line summary for the log."""
+        status = "failed" if self.error else "ok"
+        return (
+            f"{self.event} {status} in {self.seconds * 1000:.1f}ms, "
+            f"rss {self.rss_bytes / 2**20:.1f} MiB "
+            f"(peak {self.peak_bytes / 2**20:.1f} MiB)"
+        )
+
+
+class Worker:
+    """One warm process with the handler imported."""
+
+    def __init__(self, runtime: "LocalRuntime") -> None:
+        """Init and start the process."""
+        self.runtime = runtime
+        self.process = None
+        self.conn = None
+        self.spawn()
+
+    def spawn(self) -> None:
+        """Start a fresh process and wait for its first import."""
+        # Spawned rather than forked, so each worker starts as clean as a
+        # Lambda sandbox and without the watcher's threads.
+        context = multiprocessing.get_context("spawn")
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=serve,
+            args=(
+                child,
+                str(self.runtime.local_root),
+                self.runtime.handler,
+                self.runtime.environment,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+        _, error = self.conn.recv()
+        if error:
+            logger.error(f"Importing {self.runtime.handler} failed:\n{error}")
+
+    def reload(self, modules: List[str]) -> Tuple[int, Optional[str]]:
+        """Reload touched modules in the worker."""
+        self.conn.send(("reload", modules))
+        return self.conn.recv()
+
+    def invoke(self, name: str, event: Any) -> Invocation:
+        """Run the handler on an event, restarting the worker on a timeout."""
+        runtime = self.runtime
+        start = time.perf_counter()
+        self.conn.send(
+            (
+                "invoke",
+                (event, runtime.function_name, runtime.memory_mb, runtime.timeout),
+            )
+        )
+        if not self.conn.poll(runtime.timeout):
+            self.restart()
+            return Invocation(
+                name,
+                time.perf_counter() - start,
+                error=f"Timed out after {runtime.timeout}s.",
+            )
+        reply = self.conn.recv()
+        return Invocation(name, **reply)
+
+    def restart(self) -> None:
+        """Replace a stuck process with a fresh one."""
+        self.process.kill()
+        self.process.join()
+        self.spawn()
+
+    def stop(self) -> None:
+        """Ask the process to exit."""
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class LocalRuntime:
+    """A pool of warm workers that run the handler on test events.
+
+    Every worker imports the handler module, and so the function's own
+    modules and its dependencies, once at start. After a change only the
+    touched modules, and local modules that hold references into them, are
+    imported again. Test events are the `*.json` files in `events_dir`, run
+    across the workers in parallel.
+    """
+
+    def __init__(
+        self,
+        local_root: Path,
+        handler: str = "lambda_function.lambda_handler",
+        events_dir: Optional[Path] = None,
+        workers: int = 2,
+        function_name: str = "local",
+        memory_mb: int = 128,
+        timeout: float = 30.0,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        """Init and set the code, the handler and where the events are."""
+        if "." not in handler:
+            raise RuntimeError(f"Handler {handler} is not module.function.")
+        self.local_root = Path(local_root)
+        self.handler = handler
+        self.events_dir = Path(events_dir) if events_dir else None
+        self.size = max(workers, 1)
+        self.function_name = function_name
+        self.memory_mb = memory_mb
+        self.timeout = timeout
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.environment = {
+            "AWS_LAMBDA_FUNCTION_NAME": function_name,
+            "AWS_LAMBDA_FUNCTION_MEMORY_SIZE": str(memory_mb),
+            "LAMBDA_TASK_ROOT": str(self.local_root),
+        }
+        self.workers: List[Worker] = []
+        self.idle: "queue.Queue[Worker]" = queue.Queue()
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self) -> None:
+        """Start the workers and run every event once."""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.size) as executor:
+            self.workers = list(executor.map(lambda _: Worker(self), range(self.size)))
+        for worker in self.workers:
+            self.idle.put(worker)
+        self.executor = ThreadPoolExecutor(self.size)
+        logger.info(
+            f"Started {self.size} workers for {self.handler} in "
+            f"{time.perf_counter() - start:.2f}s."
+        )
+        self.invoke_all()
+
+    def stop(self) -> None:
+        """Stop the workers."""
+        if self.executor is not None:
+            self.executor.shutdown()
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+
+    def events(self) -> List[Tuple[str, Any]]:
+        """Test events by name, an empty event if there are none."""
+        if self.events_dir is None:
+            return [("{}", {})]
+        events = []
+        for path in sorted(self.events_dir.glob("*.json")):
+            try:
+                events.append((path.stem, json.loads(path.read_text())))
+            except ValueError as err:
+                logger.error(f"Skipping event {path}: {err}")
+        if not events:
+            logger.warning(f"No *.json events in {self.events_dir}, using {{}}.")
+            return [("{}", {})]
+        return events
+
+    def reload(self, changed: Iterable[str]) -> None:
+        """Reload the modules behind changed files in every worker."""
+        modules = [m for m in map(module_name, changed) if m is not None]
+        if not modules:
+            return
+        start = time.perf_counter()
+        for worker in self.workers:
+            stale, error = worker.reload(modules)
+        elapsed = time.perf_counter() - start
+        self.metrics.observe("local_reload_seconds", elapsed, self.function_name)
+        if error:
+            logger.error(f"Importing {self.handler} failed:\n{error}")
+        else:
+            logger.info(f"Reloaded {stale} modules in {elapsed * 1000:.1f}ms.")
+
+    def invoke(self, name: str, event: Any) -> Invocation:
+        """Run one event on the next idle worker."""
+        worker = self.idle.get()
+        try:
+            return worker.invoke(name, event)
+        finally:
+            self.idle.put(worker)
+
+    def invoke_all(self) -> List[Invocation]:
+        """Run every test event, reporting how each one went."""
+        events = self.events()
+        invocations = list(self.executor.map(lambda e: self.invoke(*e), events))
+        fn = self.function_name
+        for invocation in invocations:
+            self.metrics.observe("local_invoke_seconds", invocation.seconds, fn)
+            self.metrics.observe("local_rss_bytes", invocation.rss_bytes, fn)
+            if invocation.error:
+                self.metrics.incr("local_errors_total", 1, fn)
+                logger.error(f"{invocation}\n{invocation.error}")
+                continue
+
+            if invocation.peak_bytes > self.memory_mb * 2**20:
+                logger.warning(
+                    f"{invocation.event} peaked above the {self.memory_mb} MiB "
+                    "the function is given."
+                )
+            result = invocation.result or ""
+            if len(result) > PREVIEW_CHARS:
+                result = result[:PREVIEW_CHARS] + "..."
+            logger.info(f"{invocation}: {result}")
+        return invocations
+
+    def run(self, changed: Iterable[str]) -> List[Invocation]:
+        """Pick up changed files and run every event again."""
+        self.reload(changed)
+        return self.invoke_all()
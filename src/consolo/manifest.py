@@ -0,0 +1,115 @@
+"""In-memory index of the files that make up a lambda."""
+import json
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ManifestIndex:
+    """Ordered set of archive paths, persisted to a JSON file.
+
+    Membership checks never touch the disk. Changes are written back atomically
+    `persist_delay` seconds after the last one, so a burst costs one write.
+    """
+
+    def __init__(self, path: Path, persist_delay: float = 1.0) -> None:
+        """Init and set where the manifest is persisted."""
+        self.path = Path(path)
+        self.persist_delay = persist_delay
+        # A dict rather than a set, archive order follows manifest order.
+        self.entries: Dict[str, None] = {}
+        self.loaded = False
+        self._lock = threading.RLock()
+        self._timer: Optional[threading.Timer] = None
+
+    def __contains__(self, name: str) -> bool:
+        """Whether the path is part of the lambda."""
+        return name in self.entries
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over a snapshot of the paths, in archive order."""
+        with self._lock:
+            return iter(list(self.entries))
+
+    def __len__(self) -> int:
+        """Number of paths in the manifest."""
+        return len(self.entries)
+
+    def load(self) -> bool:
+        """Load the persisted manifest, if there is one."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                names = json.load(f)
+        except FileNotFoundError:
+            return False
+
+        with self._lock:
+            self.entries = dict.fromkeys(names)
+            self.loaded = True
+        logger.debug(f"Loaded {len(self)} manifest entries from {self.path}.")
+        return True
+
+    def replace(self, names: Iterable[str]) -> None:
+        """Replace every entry, e.g. after downloading a new archive."""
+        with self._lock:
+            self.entries = dict.fromkeys(names)
+            self.loaded = True
+        self.write()
+
+    def add(self, name: str) -> bool:
+        """Add a path, returning whether it was new."""
+        with self._lock:
+            if name in self.entries:
+                return False
+            self.entries[name] = None
+        self.schedule_write()
+        return True
+
+    def remove(self, name: str) -> bool:
+        """Remove a path, returning whether it was present."""
+        with self._lock:
+            if name not in self.entries:
+                return False
+            del self.entries[name]
+        self.schedule_write()
+        return True
+
+    def schedule_write(self) -> None:
+        """Write the manifest once changes settle down."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.persist_delay, self.write)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> None:
+        """Write any scheduled change now."""
+        with self._lock:
+            pending = self._timer is not None
+        if pending:
+            self.write()
+
+    def write(self) -> None:
+        """Atomically write the manifest to disk."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            names = list(self.entries)
+
+        fd, tmp = tempfile.mkstemp(
+            dir=self.path.parent, prefix=self.path.name, suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(names, f, ensure_ascii=False, indent=4)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
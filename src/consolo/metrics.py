@@ -0,0 +1,228 @@
+"""Latency histograms and counters for the reload loop."""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from an in-memory build to a slow activation.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Key = Tuple[str, str]
+
+
+class Histogram:
+    """Cumulative histogram, as Prometheus expects them."""
+
+    def __init__(self, buckets=BUCKETS) -> None:
+        """Init empty."""
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Record one value."""
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Metrics:
+    """Histograms, counters and gauges labelled by function name.
+
+    Every observation is also handed to the exporters, e.g. to be written as a
+    JSON line.
+    """
+
+    def __init__(self, exporters: Optional[List["Exporter"]] = None) -> None:
+        """Init and set where observations go."""
+        self.exporters = exporters or []
+        self.histograms: Dict[Key, Histogram] = {}
+        self.counters: Dict[Key, float] = {}
+        self.gauges: Dict[Key, Callable[[], float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, function: str = "") -> None:
+        """Record a duration (or any other value) in a histogram."""
+        with self._lock:
+            key = (name, function)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+        self.export("histogram", name, value, function)
+
+    def incr(self, name: str, value: float = 1, function: str = "") -> None:
+        """Add to a counter."""
+        with self._lock:
+            key = (name, function)
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.export("counter", name, value, function)
+
+    def gauge(self, name: str, read: Callable[[], float], function: str = "") -> None:
+        """Register a value that is read whenever metrics are collected."""
+        with self._lock:
+            self.gauges[(name, function)] = read
+
+    @contextmanager
+    def span(self, name: str, function: str = "") -> Iterator[None]:
+        """Time the body into a histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, function)
+
+    def export(self, kind: str, name: str, value: float, function: str) -> None:
+        """Hand an observation to every exporter."""
+        for exporter in self.exporters:
+            try:
+                exporter.record(kind, name, value, function)
+            except Exception:
+                logger.exception(f"Could not export {name}.")
+
+    def close(self) -> None:
+        """Stop all exporters."""
+        for exporter in self.exporters:
+            exporter.close()
+
+    def prometheus(self) -> str:
+        """Everything collected so far, in Prometheus text format."""
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+
+        typed = set()
+        for (name, function), hist in histograms:
+            metric = f"consolo_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            for bound, count in zip(hist.buckets, hist.counts):
+                lines.append(f'{metric}_bucket{labels(function, le=bound)} {count}')
+            lines.append(f'{metric}_bucket{labels(function, le="+Inf")} {hist.count}')
+            lines.append(f"{metric}_sum{labels(function)} {hist.sum}")
+            lines.append(f"{metric}_count{labels(function)} {hist.count}")
+
+        for (name, function), value in counters:
+            metric = f"consolo_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{labels(function)} {value}")
+
+        for (name, function), read in gauges:
+            metric = f"consolo_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} gauge")
+                typed.add(metric)
+            lines.append(f"{metric}{labels(function)} {read()}")
+
+        return "\n".join(lines) + "\n"
+
+
+def labels(function: str, **extra) -> str:
+    """Render Prometheus labels."""
+    pairs = {"function": function, **extra} if function else dict(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs.items()) + "}"
+
+
+class Exporter:
+    """Somewhere observations are sent as they happen."""
+
+    def record(self, kind: str, name: str, value: float, function: str) -> None:
+        """Export one observation."""
+
+    def close(self) -> None:
+        """Release whatever the exporter holds."""
+
+
+class JsonLinesExporter(Exporter):
+    """Append every observation to a file as a JSON line."""
+
+    def __init__(self, path: str) -> None:
+        """Init and open the file."""
+        self.file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, name: str, value: float, function: str) -> None:
+        """Write one JSON line."""
+        line = json.dumps(
+            {
+                "ts": time.time(),
+                "kind": kind,
+                "metric": name,
+                "value": value,
+                "function": function,
+            }
+        )
+        with self._lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self) -> None:
+        """Close the file."""
+        self.file.close()
+
+
+class PrometheusExporter(Exporter):
+    """Serve collected metrics at http://host:port/metrics."""
+
+    def __init__(self, metrics: Metrics, host: str, port: int) -> None:
+        """Init and start serving."""
+        outer = metrics
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = outer.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="consolo-metrics", daemon=True
+        )
+        self.thread.start()
+        port = self.server.server_port
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    def close(self) -> None:
+        """Stop serving."""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def metrics_from_spec(spec: str) -> Metrics:
+    """Metrics exported according to a --metrics value.
+
+    A port (`9102`) or `host:port` serves Prometheus text, anything else is a
+    path to append JSON lines to. An empty spec only collects in memory.
+    """
+    metrics = Metrics()
+    if not spec:
+        return metrics
+
+    host, _, port = spec.rpartition(":")
+    if port.isdigit() and "/" not in spec:
+        metrics.exporters.append(
+            PrometheusExporter(metrics, host or "127.0.0.1", int(port))
+        )
+    else:
+        metrics.exporters.append(JsonLinesExporter(spec))
+    return metrics
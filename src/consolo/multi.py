@@ -0,0 +1,181 @@
+"""Hot reload many functions from one process."""
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from watchdog.events import FileCreatedEvent, FileDeletedEvent, FileMovedEvent
+
+from consolo.consolo import Handler, LambdaReloader, Watcher
+from consolo.ignore import EventFilter
+from consolo.polling import PollingWatcher
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FunctionConfig:
+    """A local directory and the function it is mapped onto."""
+
+    path: Path
+    function_name: str
+    profile_name: str
+    create: bool = False
+
+
+@dataclass
+class MultiConfig:
+    """Everything in a multi-function config file."""
+
+    functions: List[FunctionConfig]
+    upload_workers: int = 4
+
+
+def load_config(path: str, profile_name: str = "") -> MultiConfig:
+    """Read a JSON config mapping directories to functions.
+
+    ``` json
+    {
+      "profile_name": "dev",
+      "upload_workers": 4,
+      "functions": [
+        {"path": "services/orders", "function_name": "orders-api"},
+        {"path": "services/billing", "function_name": "billing", "create": true}
+      ]
+    }
+    ```
+
+    Relative paths are relative to the config file. A function without a
+    profile uses the file's, and then `profile_name`.
+    """
+    config_path = Path(path).absolute()
+    with open(config_path) as f:
+        raw = json.load(f)
+
+    default_profile = raw.get("profile_name", profile_name)
+    functions = []
+    for entry in raw.get("functions", []):
+        if "path" not in entry or "function_name" not in entry:
+            raise RuntimeError(f"{config_path}: every function needs a path and name.")
+        profile = entry.get("profile_name", default_profile)
+        if not profile:
+            raise RuntimeError(
+                f"{config_path}: no profile for {entry['function_name']}."
+            )
+        functions.append(
+            FunctionConfig(
+                path=(config_path.parent / entry["path"]).absolute(),
+                function_name=entry["function_name"],
+                profile_name=profile,
+                create=entry.get("create", False),
+            )
+        )
+
+    if not functions:
+        raise RuntimeError(f"{config_path}: no functions configured.")
+
+    names = [function.function_name for function in functions]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise RuntimeError(f"{config_path}: mapped more than once: {duplicates}.")
+
+    return MultiConfig(functions, raw.get("upload_workers", 4))
+
+
+def upload_slots(workers: int) -> threading.BoundedSemaphore:
+    """Shared limit on how many functions upload at once."""
+    return threading.BoundedSemaphore(max(1, workers))
+
+
+class MultiReloader:
+    """Route events from a single observer to one reloader per function.
+
+    Each function keeps its own batcher and build and upload stages, so a slow
+    function never holds up the others beyond the shared upload slots.
+    """
+
+    def __init__(
+        self, reloaders: List[LambdaReloader], poll_interval: Optional[float] = None
+    ) -> None:
+        """Init and set the reloaders, matched longest local root first.
+
+        With `poll_interval` every root is scanned for changes instead.
+        """
+        self.reloaders = sorted(
+            reloaders, key=lambda reloader: len(reloader.local_root.parts), reverse=True
+        )
+        self.poll_interval = poll_interval
+
+    def route(self, path: str) -> Optional[LambdaReloader]:
+        """The reloader whose local root contains path."""
+        path = Path(path)
+        for reloader in self.reloaders:
+            if reloader.local_root == path or reloader.local_root in path.parents:
+                return reloader
+        return None
+
+    def queue_event(self, event) -> None:
+        """Hand an event to the reloader of the function it belongs to."""
+        if isinstance(event, FileMovedEvent):
+            source = self.route(event.src_path)
+            dest = self.route(event.dest_path)
+            if source is not dest:
+                # Moved between functions, removed from one and added to the other.
+                if source is not None:
+                    source.queue_event(FileDeletedEvent(event.src_path))
+                if dest is not None:
+                    dest.queue_event(FileCreatedEvent(event.dest_path))
+                return None
+
+        reloader = self.route(event.src_path)
+        if reloader is None:
+            logger.debug(f"No function for {event.src_path}.")
+            return None
+
+        reloader.queue_event(event)
+
+    def validate_root(self) -> bool:
+        """Raise if any destination directory does not exist."""
+        return all(reloader.validate_root() for reloader in self.reloaders)
+
+    def clobber_local(self) -> None:
+        """Download every function onto its local directory."""
+        for reloader in self.reloaders:
+            logger.info(f"Downloading {reloader.function_name}.")
+            reloader.clobber_local()
+
+    def event_filter(self) -> EventFilter:
+        """Drops events for paths ignored by the function they belong to."""
+        return EventFilter(
+            [(r.local_root, r.ignore, r.function_name) for r in self.reloaders],
+            self.reloaders[0].metrics,
+        )
+
+    def watch(self) -> None:
+        """Watch every local root with a single observer."""
+        roots = [reloader.local_root for reloader in self.reloaders]
+        event_filter = self.event_filter()
+        handler = Handler(
+            on_create=self.queue_event,
+            on_modify=self.queue_event,
+            on_delete=self.queue_event,
+            on_move=self.queue_event,
+            event_filter=event_filter,
+        )
+        if self.poll_interval:
+            w = PollingWatcher(
+                roots, handler, self.poll_interval, ignore=event_filter.ignored
+            )
+        else:
+            w = Watcher(roots, handler)
+        for reloader in self.reloaders:
+            reloader.start()
+        try:
+            w.run()
+        finally:
+            for reloader in self.reloaders:
+                reloader.stop()
+            for metrics in {id(r.metrics): r.metrics for r in self.reloaders}.values():
+                metrics.close()
@@ -0,0 +1,155 @@
+"""Overlap building the next archive with the upload in flight."""
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+from consolo.archive import ArchiveSink, BuildStats, SinkPool
+from consolo.batcher import ChangeSet
+from consolo.upload import UploadWorker
+
+logger = logging.getLogger(__name__)
+
+# How long stopping waits for the last change set to be built and sent.
+DRAIN_TIMEOUT = 60.0
+
+# stage -> the marks it starts and ends at, in the order a change goes through
+STAGES = {
+    "debounce": ("event", "queued"),
+    "queue": ("queued", "built_start"),
+    "build": ("built_start", "built"),
+    "wait": ("built", "sent_start"),
+    "upload": ("sent_start", "sent"),
+    "activate": ("sent", "live"),
+}
+
+
+@dataclass
+class Snapshot:
+    """A built archive on its way to the function."""
+
+    changes: ChangeSet
+    sink: ArchiveSink
+    stats: Optional[BuildStats] = None
+    code_sha256: str = ""
+    marks: Dict[str, float] = field(default_factory=dict)
+
+    def mark(self, name: str) -> None:
+        """Record when the snapshot reached a stage boundary."""
+        self.marks[name] = time.monotonic()
+
+    def latency(self) -> Dict[str, float]:
+        """Seconds spent in each stage so far."""
+        return {
+            stage: self.marks[end] - self.marks[start]
+            for stage, (start, end) in STAGES.items()
+            if start in self.marks and end in self.marks
+        }
+
+    def __str__(self) -> str:
+        """Per stage latency for logging."""
+        stages = ", ".join(f"{k} {v:.3f}s" for k, v in self.latency().items())
+        total = self.marks.get("live", time.monotonic()) - self.marks["event"]
+        return f"{total:.3f}s save to live: {stages}"
+
+
+class SnapshotPipeline:
+    """Separate build and upload stages, each keeping only the newest work.
+
+    While one archive is uploading and activating, the next change set is
+    already being built, so it is ready the moment the function is.
+    """
+
+    def __init__(
+        self,
+        build: Callable[[ArchiveSink], BuildStats],
+        upload: Callable[[Snapshot], Optional[Any]],
+        is_ready: Callable[[], bool],
+        sinks: SinkPool,
+        on_live: Optional[Callable[[Snapshot], None]] = None,
+        went_live: Callable[[], bool] = lambda: True,
+    ) -> None:
+        """Init and set how to build, upload and check readiness.
+
+        `went_live` is asked once the function settled after an upload, and
+        returns False if the update failed.
+        """
+        self.build = build
+        self.upload = upload
+        self.sinks = sinks
+        self.on_live = on_live
+        self.went_live = went_live
+        self.last: Optional[Snapshot] = None
+        # build fingerprint -> archive digest, to avoid rehashing identical builds
+        self.digests: Dict[str, str] = {}
+        self.builder: UploadWorker[ChangeSet] = UploadWorker(
+            self.build_snapshot, lambda: True, name="consolo-build"
+        )
+        self.uploader: UploadWorker[Snapshot] = UploadWorker(
+            self.upload_snapshot,
+            is_ready,
+            name="consolo-upload",
+            release=lambda snapshot: self.sinks.release(snapshot.sink),
+        )
+
+    def submit(self, changes: ChangeSet) -> None:
+        """Queue a change set for building, then upload."""
+        if changes.flushed is None:
+            changes.flushed = time.monotonic()
+        self.builder.submit(changes)
+
+    def start(self) -> None:
+        """Start both stages."""
+        self.builder.start()
+        self.uploader.start()
+
+    def stop(self, timeout: Optional[float] = DRAIN_TIMEOUT) -> None:
+        """Finish building and sending what was submitted, then stop both stages."""
+        if not self.join(timeout):
+            logger.warning("Stopping with changes that were not uploaded.")
+        self.builder.stop()
+        self.uploader.stop()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything submitted is built and sent."""
+        return self.builder.join(timeout) and self.uploader.join(timeout)
+
+    def build_snapshot(self, changes: ChangeSet) -> None:
+        """Build stage, hand the archive over to the upload stage."""
+        snapshot = Snapshot(changes, self.sinks.acquire())
+        snapshot.marks["event"] = changes.started
+        snapshot.marks["queued"] = changes.flushed
+        snapshot.mark("built_start")
+        try:
+            snapshot.stats = self.build(snapshot.sink)
+        except BaseException:
+            self.sinks.release(snapshot.sink)
+            raise
+        snapshot.code_sha256 = self.digest(snapshot)
+        snapshot.mark("built")
+        self.uploader.submit(snapshot)
+
+    def digest(self, snapshot: Snapshot) -> str:
+        """CodeSha256 of a built snapshot, remembered by build fingerprint."""
+        fingerprint = snapshot.stats.fingerprint
+        if fingerprint not in self.digests:
+            if len(self.digests) >= 16:
+                self.digests.pop(next(iter(self.digests)))
+            self.digests[fingerprint] = snapshot.sink.sha256()
+        return self.digests[fingerprint]
+
+    def upload_snapshot(self, snapshot: Snapshot) -> None:
+        """Upload stage, sends and waits for the function to go live."""
+        snapshot.mark("sent_start")
+        if self.upload(snapshot) is None:
+            # Nothing to send, the function already runs this archive.
+            return
+        snapshot.mark("sent")
+        self.uploader.wait_until_ready()
+        if not self.went_live():
+            return
+        snapshot.mark("live")
+        self.last = snapshot
+        logger.info(f"Live, {snapshot}.")
+        if self.on_live is not None:
+            self.on_live(snapshot)
@@ -0,0 +1,219 @@
+"""Find changes by polling, for filesystems that do not deliver events."""
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from watchdog.events import (FileCreatedEvent, FileDeletedEvent,
+                             FileModifiedEvent, FileMovedEvent,
+                             FileSystemEventHandler)
+
+logger = logging.getLogger(__name__)
+
+# (inode, size, mtime_ns) of a file as last seen
+FileKey = Tuple[int, int, int]
+
+# Directories changed this recently are listed again on the next scan, as
+# some filesystems only keep mtimes to the second or two.
+MTIME_GRANULARITY_NS = 2_000_000_000
+
+
+@dataclass
+class DirState:
+    """A directory's mtime and entries as of the last time it was listed."""
+
+    mtime_ns: int
+    files: Set[str] = field(default_factory=set)
+    dirs: Set[str] = field(default_factory=set)
+
+
+class PollingScanner:
+    """Diff stat snapshots of a tree to produce file events.
+
+    A directory is only listed again when its mtime changed, which is exactly
+    when entries were added, removed or renamed in it. Files are still stat'ed
+    on every scan, as writing to a file does not touch its directory. Paths for
+    which `ignore` is true are never descended into.
+    """
+
+    def __init__(
+        self, root: Path, ignore: Optional[Callable[[str], bool]] = None
+    ) -> None:
+        """Init with an empty snapshot."""
+        self.root = Path(root)
+        self.ignore = ignore
+        self.dirs: Dict[str, DirState] = {}
+        self.files: Dict[str, FileKey] = {}
+        self.scanned = False
+
+    def path(self, rel: str) -> str:
+        """Absolute path of a path relative to the root."""
+        return os.path.join(self.root, rel) if rel else str(self.root)
+
+    def ignored(self, rel: str) -> bool:
+        """Whether a path should not be looked at."""
+        return self.ignore is not None and self.ignore(self.path(rel))
+
+    def list_dir(self, rel: str, mtime_ns: int) -> DirState:
+        """List a directory, leaving out ignored entries."""
+        state = DirState(mtime_ns)
+        try:
+            entries = list(os.scandir(self.path(rel)))
+        except (FileNotFoundError, NotADirectoryError):
+            return state
+        for entry in entries:
+            child = f"{rel}/{entry.name}" if rel else entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                if not self.ignored(child + "/"):
+                    state.dirs.add(child)
+            elif not self.ignored(child):
+                state.files.add(child)
+        return state
+
+    def drop(self, name: str, gone: List[Tuple[str, int]]) -> None:
+        """Drop a file from the snapshot, noting its inode to spot renames."""
+        key = self.files.pop(name, None)
+        if key is not None:
+            gone.append((name, key[0]))
+
+    def forget(self, rel: str, gone: List[Tuple[str, int]]) -> None:
+        """Drop a directory and everything under it from the snapshot."""
+        state = self.dirs.pop(rel, None)
+        if state is None:
+            return
+        for name in state.files:
+            self.drop(name, gone)
+        for child in state.dirs:
+            self.forget(child, gone)
+
+    def scan(self) -> List:
+        """Walk the tree once, returning events for what changed since last time.
+
+        The first scan only takes the snapshot.
+        """
+        created: List[str] = []
+        modified: List[str] = []
+        gone: List[Tuple[str, int]] = []
+        stack = [""]
+
+        while stack:
+            rel = stack.pop()
+            try:
+                st = os.stat(self.path(rel))
+            except FileNotFoundError:
+                self.forget(rel, gone)
+                continue
+
+            state = self.dirs.get(rel)
+            if state is None or state.mtime_ns != st.st_mtime_ns:
+                listed = self.list_dir(rel, st.st_mtime_ns)
+                if state is not None:
+                    for name in state.files - listed.files:
+                        self.drop(name, gone)
+                    for child in state.dirs - listed.dirs:
+                        self.forget(child, gone)
+                self.dirs[rel] = state = listed
+                if time.time_ns() - st.st_mtime_ns < MTIME_GRANULARITY_NS:
+                    state.mtime_ns = -1
+
+            for name in list(state.files):
+                try:
+                    fst = os.stat(self.path(name))
+                except FileNotFoundError:
+                    state.files.discard(name)
+                    # List it again next time, whatever its mtime says.
+                    state.mtime_ns = -1
+                    self.drop(name, gone)
+                    continue
+
+                key = (fst.st_ino, fst.st_size, fst.st_mtime_ns)
+                previous = self.files.get(name)
+                if previous is None:
+                    created.append(name)
+                elif previous != key:
+                    modified.append(name)
+                self.files[name] = key
+
+            stack.extend(state.dirs)
+
+        if not self.scanned:
+            self.scanned = True
+            return []
+        return self.events(created, modified, gone)
+
+    def events(
+        self, created: List[str], modified: List[str], gone: List[Tuple[str, int]]
+    ) -> List:
+        """Turn changed paths into events, pairing renames up by inode."""
+        events = []
+        inodes = {self.files[name][0]: name for name in created}
+        for name, inode in gone:
+            dest = inodes.pop(inode, None)
+            if dest is not None:
+                created.remove(dest)
+                events.append(FileMovedEvent(self.path(name), self.path(dest)))
+            else:
+                events.append(FileDeletedEvent(self.path(name)))
+        events.extend(FileCreatedEvent(self.path(name)) for name in created)
+        events.extend(FileModifiedEvent(self.path(name)) for name in modified)
+        return events
+
+
+class PollingWatcher:
+    """Drop-in for Watcher that polls instead of relying on OS events."""
+
+    def __init__(
+        self,
+        dirpath: Union[str, Path, Iterable],
+        handler: FileSystemEventHandler,
+        interval: float = 1.0,
+        ignore: Optional[Callable[[str], bool]] = None,
+    ) -> None:
+        """Init and set what to scan, how often and which handler to fire."""
+        if isinstance(dirpath, (str, Path)):
+            dirpath = [dirpath]
+        paths = sorted({Path(p).absolute() for p in dirpath})
+        roots = [p for p in paths if not any(o in p.parents for o in paths)]
+        self.scanners = [PollingScanner(root, ignore) for root in roots]
+        self.event_handler = handler
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def poll(self) -> int:
+        """Scan every root once and dispatch the events, returning how many."""
+        count = 0
+        for scanner in self.scanners:
+            start = time.perf_counter()
+            events = scanner.scan()
+            elapsed = time.perf_counter() - start
+            if elapsed > self.interval / 2:
+                logger.warning(
+                    f"Scanning {len(scanner.files)} files in {scanner.root} took "
+                    f"{elapsed:.3f}s, consider a longer --poll-interval."
+                )
+            for event in events:
+                self.event_handler.dispatch(event)
+            count += len(events)
+        return count
+
+    def run(self) -> None:
+        """Poll until interrupted."""
+        self.poll()
+        files = sum(len(scanner.files) for scanner in self.scanners)
+        logger.info(f"Polling {files} files every {self.interval}s.")
+        try:
+            while not self.stopped.wait(self.interval):
+                self.poll()
+        except KeyboardInterrupt:
+            pass
+
+    def stop(self) -> None:
+        """Stop polling."""
+        self.stopped.set()
@@ -0,0 +1,212 @@
+"""Notice changes made to the function elsewhere and pull in only those."""
+import logging
+import os
+import threading
+import time
+import zipfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (TYPE_CHECKING, BinaryIO, Callable, Dict, List, Optional,
+                    Tuple, Union)
+
+from consolo.extract import extract_member, file_crc32, safe_name
+
+if TYPE_CHECKING:
+    from consolo.consolo import LambdaReloader
+
+logger = logging.getLogger(__name__)
+
+# (size, CRC32) of a file, as a zip central directory records it
+Signature = Tuple[int, int]
+
+# Where the function's version of a file goes when the local copy was edited too.
+CONFLICT_SUFFIX = ".consolo-remote"
+
+
+def package_members(archive: Union[Path, BinaryIO]) -> Dict[str, Signature]:
+    """Signature of every file in a package, from its central directory."""
+    with zipfile.ZipFile(archive) as zipf:
+        return {
+            info.filename: (info.file_size, info.CRC)
+            for info in zipf.infolist()
+            if not info.is_dir() and safe_name(info.filename)
+        }
+
+
+def local_signature(path: Path) -> Optional[Signature]:
+    """Signature of a local file, None if there is none."""
+    try:
+        size = os.stat(path).st_size
+        return size, file_crc32(path)
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        return None
+
+
+@dataclass
+class PullStats:
+    """What one pull wrote, removed and could not apply."""
+
+    written: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    conflicts: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    seconds: float = 0.0
+
+    def __str__(self) -> str:
+        """Summarise the pull for logging."""
+        return (
+            f"wrote {len(self.written)} files, removed {len(self.removed)}, "
+            f"{len(self.conflicts)} conflicts, {self.unchanged} unchanged "
+            f"in {self.seconds:.3f}s"
+        )
+
+
+def pull_changed(
+    archive: Path,
+    local_root: Path,
+    base: Dict[str, Signature],
+    keep: Callable[[str], bool] = lambda name: False,
+    on_write: Optional[Callable[[Path], None]] = None,
+) -> Tuple[PullStats, Dict[str, Signature]]:
+    """Apply what changed between the last synced package and a new one.
+
+    `base` holds the signatures both sides last agreed on. Members the new
+    package did not change are not even looked at locally. A changed member
+    only replaces a local file that still matches `base`. Otherwise the local
+    copy was edited too, and the package's version is written next to it with
+    CONFLICT_SUFFIX instead. Returns the signatures of the new package, the
+    next base.
+    """
+    start = time.perf_counter()
+    stats = PullStats()
+    local_root = Path(local_root)
+
+    with zipfile.ZipFile(archive) as zipf:
+        infos = {
+            info.filename: info
+            for info in zipf.infolist()
+            if not info.is_dir() and safe_name(info.filename)
+        }
+        remote = {name: (i.file_size, i.CRC) for name, i in infos.items()}
+
+        for name in [*remote, *(n for n in base if n not in remote)]:
+            theirs = remote.get(name)
+            if keep(name) or theirs == base.get(name):
+                stats.unchanged += 1
+                continue
+
+            dest = local_root.joinpath(name)
+            ours = local_signature(dest)
+            if ours == theirs:
+                stats.unchanged += 1
+                continue
+
+            if ours != base.get(name):
+                stats.conflicts.append(name)
+                if theirs is not None:
+                    copy = dest.with_name(dest.name + CONFLICT_SUFFIX)
+                    extract_member(zipf, infos[name], copy)
+                continue
+
+            if theirs is None:
+                dest.unlink()
+                stats.removed.append(name)
+            else:
+                extract_member(zipf, infos[name], dest)
+                stats.written.append(name)
+            if on_write is not None:
+                on_write(dest)
+
+    stats.seconds = time.perf_counter() - start
+    return stats, remote
+
+
+class RemotePoller:
+    """Poll the function's CodeSha256 and pull whenever someone else changed it.
+
+    Polling is a single get_function_configuration call. The interval starts
+    at `min_interval`, doubles after every poll that finds nothing up to
+    `max_interval`, and drops back to the minimum after any local or remote
+    change. Polls are skipped while local changes are still on their way up,
+    and our own uploads are recognised by their CodeSha256. The pull itself
+    holds the reloader's tree lock, so no burst is queued while it runs.
+    """
+
+    def __init__(
+        self,
+        reloader: "LambdaReloader",
+        min_interval: float = 5.0,
+        max_interval: float = 60.0,
+    ) -> None:
+        """Init and set the reloader to pull into and the interval bounds."""
+        self.reloader = reloader
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.interval = min_interval
+        self.revision_id: Optional[str] = None
+        self.polls = 0
+        self.pulls = 0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def check(self) -> bool:
+        """Poll once, pulling if the function changed. Whether anything did."""
+        reloader = self.reloader
+        if reloader.busy():
+            return True
+
+        self.polls += 1
+        config = reloader.lambda_client.get_function_configuration(
+            FunctionName=reloader.function_name
+        )
+        revision_id = config.get("RevisionId")
+        if revision_id != self.revision_id:
+            logger.debug(f"Function is at revision {revision_id}.")
+            self.revision_id = revision_id
+
+        code_sha256 = config["CodeSha256"]
+        if code_sha256 == reloader.deployed_sha256:
+            return False
+        if config.get("LastUpdateStatus") == "InProgress":
+            # Still being deployed, pull once it settles.
+            return True
+
+        logger.info(f"Function changed remotely to {code_sha256}, pulling.")
+        if reloader.pull_remote():
+            self.pulls += 1
+        return True
+
+    def poll(self) -> None:
+        """Poll once and adapt the interval."""
+        try:
+            changed = self.check()
+        except Exception:
+            logger.exception("Could not check the function for remote changes.")
+            changed = False
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+
+    def run(self) -> None:
+        """Poll until stopped."""
+        while not self._stopped.wait(self.interval):
+            self.poll()
+
+    def start(self) -> None:
+        """Start polling in the background."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self.run, name="consolo-remote", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"Checking for remote changes every {self.min_interval}s or so.")
+
+    def stop(self) -> None:
+        """Stop polling."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
@@ -0,0 +1,175 @@
+"""Stage large packages in S3 with parallel multipart uploads."""
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# S3 rejects multipart parts under 5 MiB, except the last one.
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+@dataclass
+class StageStats:
+    """What staging one package took."""
+
+    parts: int = 0
+    uploaded: int = 0
+    copied: int = 0
+    bytes_uploaded: int = 0
+    seconds: float = 0.0
+
+    def __str__(self) -> str:
+        """Summarise for logging."""
+        return (
+            f"{self.uploaded} of {self.parts} parts uploaded "
+            f"({self.bytes_uploaded} bytes), {self.copied} copied in place, "
+            f"{self.seconds:.3f}s"
+        )
+
+
+class S3Stager:
+    """Upload packages above a size threshold to S3 for update_function_code.
+
+    Packages are split into fixed size parts and sent as a concurrent multipart
+    upload to a key per function. The MD5 (the part ETag) of every part is
+    remembered, and parts that have not changed since the last upload to that
+    key are copied server side from the previous object instead of being sent
+    again.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        prefix: str = "consolo/",
+        threshold: int = 10 * 1024 * 1024,
+        part_size: int = 8 * 1024 * 1024,
+        workers: int = 8,
+    ) -> None:
+        """Init and set where packages go and when to use S3 at all."""
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.threshold = threshold
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.workers = workers
+        # key -> ETags of the parts of the last object uploaded there
+        self.etags: Dict[str, List[str]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Thread pool for part uploads, created on first use."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix="consolo-s3"
+            )
+        return self._executor
+
+    def wants(self, size: int) -> bool:
+        """Whether a package of this many bytes is big enough to go through S3."""
+        return size >= self.threshold
+
+    def key(self, function_name: str) -> str:
+        """Where a function's package is staged."""
+        return f"{self.prefix}{function_name}.zip"
+
+    def part_ranges(self, size: int) -> List[Tuple[int, int]]:
+        """Start and end offsets of every part."""
+        return [
+            (start, min(start + self.part_size, size))
+            for start in range(0, max(size, 1), self.part_size)
+        ]
+
+    def stage(
+        self, function_name: str, payload: Union[memoryview, BinaryIO], size: int
+    ) -> Tuple[str, str]:
+        """Upload payload, returning the bucket and key it can be deployed from.
+
+        `payload` is the package in memory or a file holding it, which is read
+        one part at a time.
+        """
+        stats = StageStats()
+        start = time.monotonic()
+        key = self.key(function_name)
+        ranges = self.part_ranges(size)
+        lock = threading.Lock()
+
+        def part(a: int, b: int) -> bytes:
+            if isinstance(payload, (bytes, bytearray, memoryview)):
+                return bytes(payload[a:b])
+            with lock:
+                payload.seek(a)
+                return payload.read(b - a)
+
+        etags = [f'"{hashlib.md5(part(a, b)).hexdigest()}"' for a, b in ranges]
+        previous = self.etags.get(key, [])
+        reused = [
+            i < len(previous) and previous[i] == etag for i, etag in enumerate(etags)
+        ]
+        stats.parts = len(ranges)
+        stats.copied = sum(reused)
+        stats.uploaded = stats.parts - stats.copied
+        stats.bytes_uploaded = sum(
+            b - a for (a, b), copy in zip(ranges, reused) if not copy
+        )
+
+        if etags == previous:
+            logger.info(f"s3://{self.bucket}/{key} is unchanged, not staging.")
+            return self.bucket, key
+
+        upload = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)
+        upload_id = upload["UploadId"]
+
+        def send(number: int) -> dict:
+            a, b = ranges[number - 1]
+            if reused[number - 1]:
+                response = self.client.upload_part_copy(
+                    Bucket=self.bucket,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=number,
+                    CopySource={"Bucket": self.bucket, "Key": key},
+                    CopySourceRange=f"bytes={a}-{b - 1}",
+                )
+                etag = response["CopyPartResult"]["ETag"]
+                return {"PartNumber": number, "ETag": etag}
+
+            response = self.client.upload_part(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=number,
+                Body=part(a, b),
+            )
+            return {"PartNumber": number, "ETag": response["ETag"]}
+
+        try:
+            parts = list(self.executor.map(send, range(1, len(ranges) + 1)))
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            self.etags.pop(key, None)
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id
+            )
+            raise
+
+        self.etags[key] = etags
+        stats.seconds = time.monotonic() - start
+        logger.info(f"Staged s3://{self.bucket}/{key}, {stats}.")
+        return self.bucket, key
+
+    def close(self) -> None:
+        """Stop the upload threads."""
+        if self._executor is not None:
+            self._executor.shutdown()
@@ -0,0 +1,247 @@
+"""Send uploads from a dedicated worker, newest snapshot first."""
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Generic, Optional, TypeVar
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CONFLICT_CODES = ("ResourceConflictException", "TooManyRequestsException")
+
+
+def is_conflict(err: Exception) -> bool:
+    """Whether an upload failed only because the function was busy."""
+    return (
+        isinstance(err, ClientError)
+        and err.response["Error"]["Code"] in CONFLICT_CODES
+    )
+
+
+@dataclass
+class UploadStats:
+    """Counters for the upload worker."""
+
+    submitted: int = 0
+    superseded: int = 0
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    polls: int = 0
+    last_wait: float = 0.0
+    total_wait: float = 0.0
+
+    def __str__(self) -> str:
+        """Summarise the counters for logging."""
+        return (
+            f"{self.sent} sent, {self.superseded} superseded, "
+            f"{self.retries} retries, {self.failed} failed, "
+            f"last waited {self.last_wait:.2f}s"
+        )
+
+
+class Backoff:
+    """Exponential backoff with full jitter."""
+
+    def __init__(self, base: float = 0.25, cap: float = 5.0) -> None:
+        """Init and set the first and the longest delay."""
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait before the given (zero based) attempt."""
+        return random.uniform(0, min(self.cap, self.base * 2**attempt))
+
+
+class LatestSlot(Generic[T]):
+    """Single slot queue where putting replaces whatever was waiting."""
+
+    def __init__(self) -> None:
+        """Init empty."""
+        self.item: Optional[T] = None
+        # when the waiting item was first queued, and when the last taken one was
+        self.since = 0.0
+        self.taken_since = 0.0
+        self.full = False
+        self._cond = threading.Condition()
+
+    def __len__(self) -> int:
+        """Queue depth, zero or one."""
+        return int(self.full)
+
+    def put(self, item: T) -> Optional[T]:
+        """Put an item, returning the waiting one it replaced, if any."""
+        with self._cond:
+            replaced = self.item if self.full else None
+            if not self.full:
+                self.since = time.monotonic()
+            self.item = item
+            self.full = True
+            self._cond.notify_all()
+            return replaced
+
+    def take(self, timeout: Optional[float] = None) -> Optional[T]:
+        """Wait for and remove the waiting item, None on timeout."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.full, timeout):
+                return None
+            item, self.item, self.full = self.item, None, False
+            self.taken_since = self.since
+            return item
+
+
+class UploadWorker(Generic[T]):
+    """Upload from a background thread, always sending the newest snapshot.
+
+    Submitting while an upload is waiting replaces the waiting one. Before each
+    send the worker polls `is_ready` with backoff until the function can take an
+    update, then sends whatever is newest at that point.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[T], Any],
+        is_ready: Callable[[], bool],
+        backoff: Optional[Backoff] = None,
+        max_retries: int = 10,
+        name: str = "consolo-upload",
+        release: Optional[Callable[[T], None]] = None,
+    ) -> None:
+        """Init and set how to send an item and how to tell if we may.
+
+        `release` is called once the worker is done with an item, whether it was
+        sent, failed or superseded.
+        """
+        self.send = send
+        self.is_ready = is_ready
+        self.release = release
+        self.backoff = backoff or Backoff()
+        self.max_retries = max_retries
+        self.name = name
+        self.slot: LatestSlot[T] = LatestSlot()
+        self.stats = UploadStats()
+        # set from submit until the worker finds nothing left to send
+        self.busy = False
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._idle = threading.Condition()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of snapshots waiting to be sent, zero or one."""
+        return len(self.slot)
+
+    def submit(self, item: T) -> None:
+        """Queue item for upload, superseding anything not yet sent."""
+        self.stats.submitted += 1
+        with self._idle:
+            self.busy = True
+        replaced = self.slot.put(item)
+        if replaced is not None:
+            self.stats.superseded += 1
+            logger.debug(f"{self.name}: superseded a waiting item.")
+            self.done(replaced)
+
+        if self._thread is None:
+            self.start()
+
+    def start(self) -> None:
+        """Start the upload thread."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop after the upload in flight, dropping anything still waiting."""
+        self._stopped.set()
+        dropped = self.slot.put(None)
+        if dropped is not None:
+            logger.warning(f"{self.name}: stopped with an item still waiting.")
+            self.done(dropped)
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until nothing is waiting or in flight."""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self.busy, timeout)
+
+    def done(self, item: T) -> None:
+        """Hand an item back once the worker no longer needs it."""
+        if self.release is not None and item is not None:
+            self.release(item)
+
+    def wait_until_ready(self) -> None:
+        """Poll readiness with backoff until the function can be updated."""
+        attempt = 0
+        while not self._stopped.is_set():
+            self.stats.polls += 1
+            try:
+                if self.is_ready():
+                    return
+            except Exception:
+                logger.exception("Could not check whether the function is ready.")
+            self._stopped.wait(self.backoff.delay(attempt))
+            attempt += 1
+
+    def _run(self) -> None:
+        """Send snapshots until stopped."""
+        while not self._stopped.is_set():
+            item = self.slot.take()
+            if self._stopped.is_set():
+                return
+
+            try:
+                item = self.deliver(item, self.slot.taken_since)
+            finally:
+                self.done(item)
+                with self._idle:
+                    self.busy = bool(self.queue_depth)
+                    self._idle.notify_all()
+
+    def deliver(self, item: T, since: float) -> T:
+        """Send item, or anything newer, retrying while the function is busy.
+
+        Returns whichever item was actually sent.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.wait_until_ready()
+            if self._stopped.is_set():
+                return item
+
+            newer = self.slot.take(timeout=0)
+            if newer is not None:
+                self.done(item)
+                item = newer
+                self.stats.superseded += 1
+
+            self.stats.last_wait = time.monotonic() - since
+            self.stats.total_wait += self.stats.last_wait
+            try:
+                self.send(item)
+            except Exception as err:
+                if is_conflict(err) and attempt < self.max_retries:
+                    self.stats.retries += 1
+                    logger.debug("Function busy, retrying upload.")
+                    continue
+                self.stats.failed += 1
+                logger.exception(f"{self.name}: failed.")
+                return item
+            else:
+                self.stats.sent += 1
+                logger.debug(f"{self.name}: {self}.")
+                return item
+
+        return item
+
+    def __str__(self) -> str:
+        """Counters and queue depth for logging."""
+        return f"{self.stats}, {self.queue_depth} waiting"
@@ -0,0 +1,149 @@
+"""Reject change sets that would not even import, before building anything."""
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Container, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import yaml
+except ImportError:  # pragma: no cover
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+# Below this many files a process pool costs more than it saves.
+PARALLEL_MIN = 32
+
+CHECKED = (".py", ".json", ".yaml", ".yml")
+
+
+def check_source(name: str, data: bytes) -> Optional[str]:
+    """Error message for a file that does not compile or parse, else None."""
+    ext = os.path.splitext(name)[1].lower()
+    try:
+        if ext == ".py":
+            compile(data, name, "exec", dont_inherit=True)
+        elif ext == ".json":
+            json.loads(data)
+        elif ext in (".yaml", ".yml") and yaml is not None:
+            yaml.safe_load(data)
+    except SyntaxError as err:
+        if err.lineno is None:
+            return f"{name}: {err.msg}"
+        where = f"{name}:{err.lineno}:{err.offset or 0}"
+        text = (err.text or "").rstrip("\n")
+        if not text:
+            return f"{where}: {err.msg}"
+        pad = " " * max((err.offset or 1) - 1, 0)
+        return f"{where}: {err.msg}\n    {text}\n    {pad}^"
+    except json.JSONDecodeError as err:
+        return f"{name}:{err.lineno}:{err.colno}: {err.msg}"
+    except ValueError as err:
+        # Source with null bytes or undecodable text.
+        return f"{name}: {err}"
+    except Exception as err:
+        if yaml is not None and isinstance(err, yaml.YAMLError):
+            return f"{name}: {err}"
+        raise
+    return None
+
+
+def check_many(items: List[Tuple[str, bytes]]) -> List[Optional[str]]:
+    """Check a batch of files, in a worker process."""
+    return [check_source(name, data) for name, data in items]
+
+
+class Validator:
+    """Compile and parse changed files, remembering results by content.
+
+    Files whose contents were checked before are not checked again, and large
+    sets of files are spread over a process pool. Files that failed stay
+    failing until they are fixed or removed, so a later change set that does
+    not touch them is rejected too.
+    """
+
+    def __init__(self, local_root: Path, jobs: Optional[int] = None) -> None:
+        """Init and set the directory names are relative to."""
+        self.local_root = Path(local_root)
+        self.jobs = jobs or os.cpu_count() or 1
+        # (extension, sha256 of contents) -> error, None for a valid file
+        self.results: Dict[Tuple[str, bytes], Optional[str]] = {}
+        # name -> error, for every file currently known to be broken
+        self.failing: Dict[str, str] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Process pool for checking, created on first use."""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.jobs)
+        return self._executor
+
+    def check(self, names: Iterable[str]) -> Dict[str, str]:
+        """Check files, returning every failing file and its error."""
+        pending: List[Tuple[str, bytes]] = []
+        keys: List[Tuple[str, bytes]] = []
+        for name in names:
+            ext = os.path.splitext(name)[1].lower()
+            if ext not in CHECKED:
+                continue
+            try:
+                data = self.local_root.joinpath(name).read_bytes()
+            except (FileNotFoundError, IsADirectoryError):
+                self.forget(name)
+                continue
+
+            key = (ext, hashlib.sha256(data).digest())
+            if key in self.results:
+                self.record(name, self.results[key])
+            else:
+                pending.append((name, data))
+                keys.append(key)
+
+        if pending:
+            for key, (name, _), error in zip(keys, pending, self.run(pending)):
+                self.results[key] = error
+                self.record(name, error)
+            logger.debug(f"Checked {len(pending)} files.")
+
+        return dict(self.failing)
+
+    def run(self, pending: List[Tuple[str, bytes]]) -> List[Optional[str]]:
+        """Check files, in parallel when there are enough of them."""
+        if self.jobs < 2 or len(pending) < PARALLEL_MIN:
+            return check_many(pending)
+
+        size = -(-len(pending) // self.jobs)
+        batches = [pending[i : i + size] for i in range(0, len(pending), size)]
+        results: List[Optional[str]] = []
+        for batch in self.executor.map(check_many, batches):
+            results.extend(batch)
+        return results
+
+    def record(self, name: str, error: Optional[str]) -> None:
+        """Remember whether a file is currently broken."""
+        if error is None:
+            self.failing.pop(name, None)
+        else:
+            self.failing[name] = error
+
+    def forget(self, name: str) -> None:
+        """Stop tracking a file, e.g. because it was deleted."""
+        self.failing.pop(name, None)
+
+    def retain(self, names: Container[str]) -> None:
+        """Stop tracking failing files that are no longer among names.
+
+        Files renamed or deleted out of the package are not always passed to
+        `check` again, but must not keep rejecting every later change.
+        """
+        for name in [name for name in self.failing if name not in names]:
+            self.forget(name)
+
+    def close(self) -> None:
+        """Stop the worker processes."""
+        if self._executor is not None:
+            self._executor.shutdown()
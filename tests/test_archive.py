@@ -0,0 +1,128 @@
+"""Incremental archive builds."""
+import io
+import os
+import random
+import zipfile
+
+import pytest
+
+from consolo.archive import ArchiveSink, IncrementalArchiveBuilder
+from consolo.compression import (SAMPLE_BYTES, AutoPolicy, CompressionPolicy,
+                                 Throughput)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    rng = random.Random(0)
+    names = []
+    for i in range(40):
+        name = f"pkg/mod{i}.py"
+        path = tmp_path / name
+        path.parent.mkdir(exist_ok=True)
+        words = [rng.choice(["alpha", "beta", "gamma", "delta"]) for _ in range(4000)]
+        path.write_text(" ".join(words))
+        names.append(name)
+    # Enough data to fill the auto policy's sample partway through the build.
+    (tmp_path / "blob.bin").write_bytes(rng.randbytes(SAMPLE_BYTES))
+    names.insert(20, "blob.bin")
+    return tmp_path, names
+
+
+def build(root, names, jobs, policy=None):
+    builder = IncrementalArchiveBuilder(root, jobs=jobs, policy=policy)
+    out = io.BytesIO()
+    builder.build(names, out)
+    return builder, out.getvalue()
+
+
+def test_auto_compression_does_not_depend_on_jobs(tree):
+    root, names = tree
+    policies = [AutoPolicy(Throughput(), jobs=jobs) for jobs in (1, 4)]
+    (_, one), (_, four) = [
+        build(root, names, jobs, policy) for jobs, policy in zip((1, 4), policies)
+    ]
+    assert one == four
+    for policy in policies:
+        # Measured after the build, for the next one.
+        assert policy.profile
+        assert list(policy.stats.choices) == [f"deflate-{policy.level}"]
+
+
+def test_auto_compression_uses_one_level_per_build(tree):
+    root, names = tree
+    policy = AutoPolicy(Throughput(), jobs=4)
+    builder, _ = build(root, names, 4, policy)
+    for name in names:
+        (root / name).write_bytes((root / name).read_bytes() + b"\n")
+    policy.stats.choices.clear()
+    builder.build(names, io.BytesIO())
+    assert list(policy.stats.choices) == [f"deflate-{policy.chosen}"]
+
+
+def test_fingerprint_covers_the_compression_level(tree):
+    root, names = tree
+    fast, fast_bytes = build(root, names, 1, CompressionPolicy(level=1))
+    best, best_bytes = build(root, names, 1, CompressionPolicy(level=9))
+    assert fast_bytes != best_bytes
+    assert fast.stats.fingerprint != best.stats.fingerprint
+
+    again, again_bytes = build(root, names, 4, CompressionPolicy(level=1))
+    assert again_bytes == fast_bytes
+    assert again.stats.fingerprint == fast.stats.fingerprint
+
+
+def test_sink_keeps_its_buffer_between_builds(tmp_path):
+    sink = ArchiveSink(tmp_path / "spill.zip")
+    sink.write(b"x" * 1000)
+    with sink.payload() as payload:
+        assert bytes(payload) == b"x" * 1000
+
+    sink.reset()
+    sink.write(b"y" * 10)
+    assert bytes(sink.payload()) == b"y" * 10
+    assert sink.data() == b"y" * 10
+    assert len(sink.buffer) == 1000
+
+
+def test_sink_grows_while_a_view_is_alive(tmp_path):
+    sink = ArchiveSink(tmp_path / "spill.zip")
+    sink.write(b"old")
+    view = sink.payload()
+    sink.reset()
+    sink.write(b"a longer archive")
+    assert bytes(view) == b"old"
+    assert sink.data() == b"a longer archive"
+
+
+def test_archive_does_not_depend_on_jobs(tree):
+    root, names = tree
+    _, one = build(root, names, 1)
+    _, four = build(root, names, 4)
+    assert one == four
+
+
+def test_edit_recompresses_only_the_changed_member(tree):
+    root, names = tree
+    builder, _ = build(root, names, 4)
+
+    (root / "pkg/mod3.py").write_text("changed = True\n")
+    out = io.BytesIO()
+    stats = builder.build(names, out)
+
+    assert (stats.compressed, stats.reused) == (1, len(names) - 1)
+    with zipfile.ZipFile(out) as zipf:
+        assert zipf.testzip() is None
+        assert zipf.read("pkg/mod3.py") == b"changed = True\n"
+        assert zipf.namelist() == names
+
+
+def test_touch_without_change_rebuilds_the_same_bytes(tree):
+    root, names = tree
+    builder, first = build(root, names, 1)
+
+    os.utime(root / "pkg/mod3.py", ns=(10**18, 10**18))
+    out = io.BytesIO()
+    stats = builder.build(names, out)
+
+    assert stats.compressed == 0
+    assert out.getvalue() == first
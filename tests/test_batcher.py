@@ -0,0 +1,59 @@
+"""Debouncing file events into change sets."""
+import threading
+import time
+
+from watchdog.events import FileModifiedEvent
+
+from consolo.batcher import EventBatcher
+
+
+def modified(name):
+    return FileModifiedEvent(f"/src/{name}")
+
+
+def collect(**kwargs):
+    batches = []
+    flushed = threading.Event()
+
+    def on_batch(changes):
+        batches.append((time.monotonic(), changes))
+        flushed.set()
+
+    return EventBatcher(on_batch, **kwargs), batches, flushed
+
+
+def test_burst_is_flushed_once_after_quiet_period():
+    batcher, batches, flushed = collect(quiet_period=0.1, max_latency=5.0)
+    start = time.monotonic()
+    for name in ["a.py", "b.py", "a.py"]:
+        batcher.add(modified(name))
+    assert flushed.wait(5)
+    batcher.stop()
+
+    [(when, changes)] = batches
+    assert when - start >= 0.1
+    assert changes.events == 3
+    assert sorted(changes.modified) == ["/src/a.py", "/src/b.py"]
+
+
+def test_steady_events_are_flushed_after_max_latency():
+    batcher, batches, flushed = collect(quiet_period=0.2, max_latency=0.3)
+    start = time.monotonic()
+    while not flushed.is_set() and time.monotonic() - start < 2:
+        batcher.add(modified("a.py"))
+        time.sleep(0.05)
+    batcher.stop()
+
+    first, changes = batches[0]
+    # Never quiet for 0.2s, so only max_latency could have flushed it.
+    assert 0.3 <= first - start < 1.0
+    assert changes.events > 1
+
+
+def test_stop_flushes_what_is_pending():
+    batcher, batches, _ = collect(quiet_period=60, max_latency=60)
+    batcher.add(modified("a.py"))
+    batcher.stop()
+
+    assert [changes.events for _, changes in batches] == [1]
+    assert batcher.pending is None
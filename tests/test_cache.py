@@ -0,0 +1,65 @@
+"""Downloaded packages cached by CodeSha256."""
+import base64
+import hashlib
+import os
+
+import pytest
+
+from consolo.cache import ArchiveCache, hex_to_sha256, sha256_to_hex
+
+
+def code_sha256(data):
+    return base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+
+def put(cache, tmp_path, data, mtime):
+    src = tmp_path / "download.part"
+    src.write_bytes(data)
+    path = cache.put(code_sha256(data), src)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_sha256_round_trip():
+    digest = code_sha256(b"package")
+    assert hex_to_sha256(sha256_to_hex(digest)) == digest
+    assert sha256_to_hex(digest) == hashlib.sha256(b"package").hexdigest()
+
+
+def test_put_get_and_find(tmp_path):
+    cache = ArchiveCache(tmp_path / "cache")
+    digest = code_sha256(b"one")
+    assert cache.get(digest) is None
+
+    path = put(cache, tmp_path, b"one", 1000)
+    assert path.read_bytes() == b"one"
+    assert cache.get(digest) == path
+    assert cache.find(sha256_to_hex(digest)[:8]) == path
+    assert cache.find(digest[:8]) == path
+    with pytest.raises(RuntimeError):
+        cache.find("zzzz")
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ArchiveCache(tmp_path / "cache", max_bytes=250)
+    old = put(cache, tmp_path, b"a" * 100, 1000)
+    used = put(cache, tmp_path, b"b" * 100, 2000)
+    # Using a package makes it recent again.
+    cache.get(code_sha256(b"a" * 100))
+
+    new = put(cache, tmp_path, b"c" * 100, 3000)
+
+    assert old.exists() and new.exists()
+    assert not used.exists()
+    assert cache.get(code_sha256(b"b" * 100)) is None
+
+
+def test_partial_path_is_the_same_in_every_process(tmp_path):
+    cache = ArchiveCache(tmp_path / "cache")
+    digest = code_sha256(b"one")
+    partial = cache.partial_path(digest)
+    assert str(os.getpid()) not in partial.name
+    assert partial == ArchiveCache(tmp_path / "cache").partial_path(digest)
+    with cache.lock(digest):
+        assert partial.parent.is_dir()
+    assert cache.entries() == []
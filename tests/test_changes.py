@@ -0,0 +1,133 @@
+"""Bursts of editor events applied to the manifest."""
+import pytest
+from watchdog.events import (FileCreatedEvent, FileDeletedEvent,
+                             FileModifiedEvent, FileMovedEvent)
+
+from consolo.batcher import ChangeSet
+from consolo.consolo import LambdaReloader
+from consolo.manifest import ManifestIndex
+
+
+@pytest.fixture
+def reloader(tmp_path):
+    root = tmp_path / "src"
+    root.mkdir()
+    reloader = LambdaReloader("profile", "function", str(root), False)
+    reloader.manifest = ManifestIndex(tmp_path / "manifest.json")
+    reloader.manifest.replace(["app.py", "lib.py"])
+    return reloader
+
+
+def burst(root, *events):
+    changes = ChangeSet()
+    for kind, *paths in events:
+        paths = [str(root / path) for path in paths]
+        if kind == "create":
+            changes.add(FileCreatedEvent(paths[0]))
+        elif kind == "modify":
+            changes.add(FileModifiedEvent(paths[0]))
+        elif kind == "delete":
+            changes.add(FileDeletedEvent(paths[0]))
+        elif kind == "move":
+            changes.add(FileMovedEvent(*paths))
+    return changes
+
+
+def apply(reloader, *events):
+    changes = burst(reloader.local_root, *events)
+    return reloader.apply_changes(changes), sorted(reloader.manifest)
+
+
+def test_modify(reloader):
+    changed, manifest = apply(reloader, ("modify", "app.py"), ("modify", "app.py"))
+    assert list(changed) == ["app.py"]
+    assert manifest == ["app.py", "lib.py"]
+
+
+def test_jetbrains_safe_write(reloader):
+    changed, manifest = apply(
+        reloader,
+        ("create", "app.py___jb_tmp___"),
+        ("modify", "app.py___jb_tmp___"),
+        ("move", "app.py", "app.py___jb_old___"),
+        ("move", "app.py___jb_tmp___", "app.py"),
+        ("delete", "app.py___jb_old___"),
+    )
+    assert list(changed) == ["app.py"]
+    assert manifest == ["app.py", "lib.py"]
+
+
+def test_vim_backup_write(reloader):
+    changed, manifest = apply(
+        reloader,
+        ("move", "app.py", "app.py~"),
+        ("create", "app.py"),
+        ("modify", "app.py"),
+        ("delete", "app.py~"),
+    )
+    assert list(changed) == ["app.py"]
+    assert manifest == ["app.py", "lib.py"]
+
+
+def test_delete_then_create(reloader):
+    changed, manifest = apply(reloader, ("delete", "app.py"), ("create", "app.py"))
+    assert list(changed) == ["app.py"]
+    assert manifest == ["app.py", "lib.py"]
+
+
+def test_move_then_delete_destination(reloader):
+    changed, manifest = apply(
+        reloader, ("move", "app.py", "b.py"), ("delete", "b.py")
+    )
+    assert list(changed) == ["app.py"]
+    assert manifest == ["lib.py"]
+
+
+def test_rename_chain(reloader):
+    changed, manifest = apply(
+        reloader, ("move", "app.py", "b.py"), ("move", "b.py", "c.py")
+    )
+    assert list(changed) == ["c.py"]
+    assert manifest == ["c.py", "lib.py"]
+
+
+def test_move_onto_vacated_path(reloader):
+    changed, manifest = apply(
+        reloader, ("move", "app.py", "old.py"), ("move", "lib.py", "app.py")
+    )
+    assert sorted(changed) == ["app.py", "old.py"]
+    assert manifest == ["app.py", "old.py"]
+
+
+def test_swap_through_temp(reloader):
+    changed, manifest = apply(
+        reloader,
+        ("move", "app.py", "tmp.py"),
+        ("move", "lib.py", "app.py"),
+        ("move", "tmp.py", "lib.py"),
+    )
+    assert sorted(changed) == ["app.py", "lib.py"]
+    assert manifest == ["app.py", "lib.py"]
+
+
+def test_new_file_needs_create(reloader):
+    changed, manifest = apply(reloader, ("create", "new.py"))
+    assert changed == {}
+    assert manifest == ["app.py", "lib.py"]
+
+    reloader.allow_file_creation = True
+    changed, manifest = apply(reloader, ("create", "tmp"), ("move", "tmp", "new.py"))
+    assert list(changed) == ["new.py"]
+    assert manifest == ["app.py", "lib.py", "new.py"]
+
+
+def test_created_and_deleted_in_burst(reloader):
+    changes = burst(reloader.local_root, ("create", "tmp"), ("delete", "tmp"))
+    assert not changes
+    assert changes.merged == 2
+
+
+def test_delete_after_modify(reloader):
+    changed, manifest = apply(reloader, ("modify", "lib.py"), ("delete", "lib.py"))
+    assert list(changed) == ["lib.py"]
+    assert manifest == ["app.py"]
@@ -0,0 +1,68 @@
+"""Talking to the daemon over its socket."""
+import logging
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from consolo import daemon
+from consolo.daemon import Daemon, ping, send
+
+
+@pytest.fixture
+def socket_path():
+    # Unix socket paths are short, pytest's tmp_path can be too long.
+    with tempfile.TemporaryDirectory(dir="/tmp") as tmp:
+        yield Path(tmp, "consolo.sock")
+
+
+def test_ping_status_and_stop(socket_path):
+    server = Daemon(socket_path, cache_mb=1)
+    thread = threading.Thread(target=server.serve, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while not ping(socket_path):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    status = send(socket_path, {"action": "status"}, timeout=5)
+    assert status["ok"]
+    assert status["result"]["requests"] == 1
+    assert status["result"]["functions"] == []
+
+    unknown = send(socket_path, {"action": "nope"}, timeout=5)
+    assert not unknown["ok"]
+    assert "Unknown action nope" in unknown["result"]
+
+    assert send(socket_path, {"action": "stop"}, timeout=5)["result"] == "stopping"
+    thread.join(5)
+    assert not thread.is_alive()
+    assert not socket_path.exists()
+
+
+def test_verbose_requests_get_debug_records(socket_path, caplog, monkeypatch):
+    caplog.set_level(logging.DEBUG)
+    server = Daemon(socket_path, cache_mb=1)
+    monkeypatch.setattr(
+        server, "dispatch", lambda action, request: daemon.logger.debug("detail")
+    )
+
+    verbose = server.handle({"action": "ping", "verbose": True})
+    quiet = server.handle({"action": "ping"})
+
+    assert "DEBUG:consolo.daemon:detail" in verbose["log"]
+    assert quiet["log"] == []
+    assert server.requests == 2
+
+
+def test_serve_logging_passes_debug_records_to_requests(monkeypatch):
+    root = logging.getLogger()
+    monkeypatch.setattr(root, "handlers", [])
+    monkeypatch.setattr(root, "level", root.level)
+
+    daemon.configure_logging(verbose=False)
+
+    assert root.level == logging.DEBUG
+    assert [handler.level for handler in root.handlers] == [logging.INFO]
@@ -0,0 +1,105 @@
+"""Streaming and resuming package downloads."""
+import base64
+import hashlib
+
+import pytest
+import requests
+
+from consolo import download
+from consolo.download import DownloadError, stream_download
+
+DATA = bytes(range(256)) * 64
+
+
+def sha256(data):
+    return base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+
+class Response:
+    def __init__(self, status_code, body, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = {"Content-Length": str(len(body)), **(headers or {})}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(self.status_code)
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i : i + chunk_size]
+
+
+class Server:
+    def __init__(self, offset=None, fail=0):
+        # offset a ranged response starts at, None to honour the request
+        self.offset = offset
+        self.fail = fail
+        self.ranges = []
+
+    def get(self, url, headers, stream, timeout):
+        self.ranges.append(headers.get("Range"))
+        if self.fail:
+            self.fail -= 1
+            raise requests.ConnectionError("dropped")
+        if "Range" not in headers:
+            return Response(200, DATA)
+        start = int(headers["Range"][len("bytes=") : -1])
+        if self.offset is not None:
+            start = self.offset
+        content_range = f"bytes {start}-{len(DATA) - 1}/{len(DATA)}"
+        return Response(206, DATA[start:], {"Content-Range": content_range})
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(download.time, "sleep", lambda seconds: None)
+
+
+def test_resumes_what_an_earlier_run_left(tmp_path):
+    dest = tmp_path / "package.part"
+    dest.write_bytes(DATA[:1000])
+    server = Server()
+
+    size = stream_download(
+        server, "url", dest, expected_sha256=sha256(DATA), chunk_size=512, resume=True
+    )
+
+    assert size == len(DATA)
+    assert dest.read_bytes() == DATA
+    assert server.ranges == ["bytes=1000-"]
+
+
+def test_restarts_on_a_different_range(tmp_path):
+    dest = tmp_path / "package.part"
+    dest.write_bytes(DATA[:1000])
+    server = Server(offset=500)
+
+    stream_download(server, "url", dest, expected_sha256=sha256(DATA), resume=True)
+
+    assert dest.read_bytes() == DATA
+    assert server.ranges == ["bytes=1000-", None]
+
+
+def test_gives_up_and_keeps_the_partial(tmp_path):
+    dest = tmp_path / "package.part"
+    dest.write_bytes(DATA[:1000])
+
+    with pytest.raises(DownloadError) as info:
+        stream_download(Server(fail=3), "url", dest, retries=2, resume=True)
+
+    assert isinstance(info.value.__cause__, requests.ConnectionError)
+    assert dest.read_bytes() == DATA[:1000]
+
+
+def test_checksum_mismatch_removes_the_partial(tmp_path):
+    dest = tmp_path / "package.part"
+    with pytest.raises(DownloadError):
+        stream_download(Server(), "url", dest, expected_sha256=sha256(b"other"))
+    assert not dest.exists()
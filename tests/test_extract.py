@@ -0,0 +1,41 @@
+"""Expanding a package over a local tree."""
+import zipfile
+
+from consolo.extract import default_keep, expand_changed
+
+
+def test_prune_keeps_hidden_files_and_skips_hidden_dirs(tmp_path):
+    archive = tmp_path / "package.zip"
+    with zipfile.ZipFile(archive, "w") as zipf:
+        zipf.writestr("app.py", "V = 1\n")
+    root = tmp_path / "src"
+    for name in [
+        "app.py",
+        "stale.py",
+        ".env",
+        ".gitignore",
+        "pkg/.python-version",
+        ".git/config",
+        ".venv/lib/site.py",
+        "pkg/__pycache__/mod.cpython-311.pyc",
+    ]:
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_text("x")
+
+    asked = []
+
+    def keep(name):
+        asked.append(name)
+        return default_keep(name)
+
+    stats = expand_changed(archive, root, remove_stale=True, keep=keep)
+
+    assert stats.stale == ["stale.py"]
+    assert not (root / "stale.py").exists()
+    assert (root / ".env").exists()
+    assert (root / "pkg/.python-version").exists()
+    assert (root / ".git/config").exists()
+    assert (root / "app.py").read_text() == "V = 1\n"
+    # Kept directories are skipped as a whole.
+    assert ".git/config" not in asked
+    assert ".venv/lib/site.py" not in asked
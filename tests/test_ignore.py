@@ -0,0 +1,70 @@
+"""Gitignore style rules and the event filter built on them."""
+import pytest
+from watchdog.events import (FileCreatedEvent, FileDeletedEvent,
+                             FileModifiedEvent, FileMovedEvent)
+
+from consolo.ignore import IGNORE_FILE, EventFilter, IgnoreRules
+
+
+@pytest.mark.parametrize(
+    "lines, name, ignored",
+    [
+        (["*.log"], "a.log", True),
+        (["*.log"], "deep/down/a.log", True),
+        (["*.log"], "a.log.py", False),
+        (["/build"], "build/x.py", True),
+        (["/build"], "src/build/x.py", False),
+        (["docs/"], "docs/index.md", True),
+        (["docs/"], "docs", False),
+        (["docs/"], "docs/", True),
+        (["a/**/b.py"], "a/b.py", True),
+        (["a/**/b.py"], "a/x/y/b.py", True),
+        (["a/*.py"], "a/x/b.py", False),
+        (["data?.csv"], "data1.csv", True),
+        (["data[0-9].csv"], "datax.csv", False),
+        (["*.py", "!keep.py"], "keep.py", False),
+        (["*.py", "!keep.py"], "other.py", True),
+        (["!keep.py", "*.py"], "keep.py", True),
+        (["# comment", "", "x"], "x", True),
+        (["\\#hash"], "#hash", True),
+        (["trailing   "], "trailing", True),
+    ],
+)
+def test_rules(lines, name, ignored):
+    assert IgnoreRules(lines).matches(name) == ignored
+
+
+def test_defaults_and_reinclude(tmp_path):
+    rules = IgnoreRules.from_root(tmp_path)
+    assert rules.matches("pkg/__pycache__/mod.cpython-311.pyc")
+    assert rules.matches(".git/HEAD")
+    assert rules.matches("app.py.swp")
+    assert rules.matches("app.py~")
+    assert rules.matches(IGNORE_FILE)
+    assert not rules.matches("app.py")
+    assert not rules.matches(".venv")
+
+    (tmp_path / IGNORE_FILE).write_text("*.csv\n!.vscode/\n")
+    rules = IgnoreRules.from_root(tmp_path)
+    assert rules.matches("data/x.csv")
+    assert not rules.matches(".vscode/settings.json")
+
+
+def test_event_filter(tmp_path):
+    events = EventFilter([(tmp_path, IgnoreRules(["*.tmp", "cache/"]), "fn")])
+    path = str(tmp_path / "app.py")
+    tmp = str(tmp_path / "app.py.tmp")
+
+    assert events(FileModifiedEvent(path)).src_path == path
+    assert events(FileModifiedEvent(tmp)) is None
+    assert events(FileCreatedEvent(str(tmp_path / "cache/x.py"))) is None
+    assert events.ignored(str(tmp_path / "cache") + "/")
+    assert events.dropped == 2
+
+    saved = events(FileMovedEvent(tmp, path))
+    assert isinstance(saved, FileCreatedEvent)
+    assert saved.src_path == path
+    hidden = events(FileMovedEvent(path, tmp))
+    assert isinstance(hidden, FileDeletedEvent)
+    assert hidden.src_path == path
+    assert events(FileMovedEvent(tmp, str(tmp_path / "b.tmp"))) is None
@@ -0,0 +1,57 @@
+"""Attaching a dependency layer to a function."""
+import os
+
+from consolo import layers
+from consolo.layers import LayerPublisher, is_dependency
+
+ARN = "arn:aws:lambda:us-east-1:1:layer:deps"
+
+
+class Client:
+    def __init__(self, layers, busy_polls):
+        self.layers = layers
+        self.busy_polls = busy_polls
+        self.calls = []
+
+    def get_function_configuration(self, FunctionName):
+        self.calls.append("get")
+        status = "Successful"
+        if "update" in self.calls and self.busy_polls:
+            self.busy_polls -= 1
+            status = "InProgress"
+        return {
+            "Layers": [{"Arn": arn} for arn in self.layers],
+            "LastUpdateStatus": status,
+        }
+
+    def update_function_configuration(self, FunctionName, Layers):
+        self.calls.append("update")
+        self.layers = Layers
+
+
+def test_attach_waits_for_update(tmp_path, monkeypatch):
+    monkeypatch.setattr(layers.time, "sleep", lambda seconds: None)
+    client = Client([f"{ARN}:1", "arn:other:3"], busy_polls=2)
+    publisher = LayerPublisher(client, "deps", tmp_path)
+
+    assert publisher.attach("fn", f"{ARN}:2")
+    assert client.layers == ["arn:other:3", f"{ARN}:2"]
+    # Only returns once the configuration change is no longer in progress.
+    assert client.calls == ["get", "update", "get", "get", "get"]
+
+    client.calls = []
+    assert not publisher.attach("fn", f"{ARN}:2")
+    assert client.calls == ["get"]
+
+
+def test_is_dependency():
+    deps = {"requests/api.py"}
+    patterns = layers.DEFAULT_PATTERNS
+    assert is_dependency("requests/api.py", deps, patterns)
+    assert is_dependency("six-1.16.0.dist-info/RECORD", set(), patterns)
+    assert not is_dependency("app.py", deps, patterns)
+
+
+def test_spill_file_is_per_process(tmp_path):
+    publisher = LayerPublisher(Client([], 0), "deps", tmp_path)
+    assert f".{os.getpid()}." in publisher.sink.spill_path.name
@@ -0,0 +1,68 @@
+"""Which modules a warm worker has to import again after a change."""
+import sys
+
+import pytest
+
+from consolo.local import WorkerState, module_name
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "__init__.py").write_text("")
+    (tmp_path / "helper.py").write_text(
+        "import json\nVALUE = 1\nNAMES = {'a': 1}\ndef greet():\n    return 'hi'\n"
+    )
+    (tmp_path / "pkg" / "other.py").write_text("import json\nN = 2\n")
+    (tmp_path / "uses_value.py").write_text("from helper import VALUE\n")
+    (tmp_path / "uses_names.py").write_text("from helper import NAMES\n")
+    (tmp_path / "uses_function.py").write_text("from helper import greet\n")
+    (tmp_path / "uses_module.py").write_text("import helper\n")
+    (tmp_path / "unrelated.py").write_text("import json\nimport pkg.other\n")
+    (tmp_path / "handler.py").write_text(
+        "import uses_value, uses_names, uses_function, uses_module, unrelated\n"
+        "def handle(event, context):\n    return uses_value.VALUE\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    names = [
+        "helper", "pkg", "pkg.other", "uses_value", "uses_names",
+        "uses_function", "uses_module", "unrelated", "handler",
+    ]
+    yield WorkerState(str(tmp_path), "handler.handle")
+    for name in names:
+        sys.modules.pop(name, None)
+
+
+def test_module_name():
+    assert module_name("app.py") == "app"
+    assert module_name("pkg/__init__.py") == "pkg"
+    assert module_name("pkg/sub/mod.py") == "pkg.sub.mod"
+    assert module_name("data.json") is None
+
+
+def test_stale(state):
+    state.load()
+    assert state.error is None
+    assert state.stale(["helper"]) == {
+        "helper",
+        "uses_value",
+        "uses_names",
+        "uses_function",
+        "uses_module",
+        "handler",
+    }
+    assert state.stale(["pkg.other"]) == {"pkg.other", "pkg", "unrelated", "handler"}
+    assert state.stale(["not_imported"]) == set()
+
+
+def test_reload_constant(state, tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    monkeypatch.setattr(sys, "pycache_prefix", str(tmp_path / "pycache"))
+    state.load()
+    assert state.handler({}, None) == 1
+    (tmp_path / "helper.py").write_text(
+        "VALUE = 2\nNAMES = {}\ndef greet():\n    return 'hi'\n"
+    )
+    count, error = state.reload(["helper"])
+    assert (count, error) == (6, None)
+    assert state.handler({}, None) == 2
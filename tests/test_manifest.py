@@ -0,0 +1,54 @@
+"""Persisting the manifest."""
+import json
+import time
+
+from consolo.manifest import ManifestIndex
+
+
+def test_replace_writes_and_load_reads_it_back(tmp_path):
+    path = tmp_path / "manifest.json"
+    manifest = ManifestIndex(path)
+    manifest.replace(["b.py", "a.py"])
+    assert json.loads(path.read_text()) == ["b.py", "a.py"]
+
+    loaded = ManifestIndex(path)
+    assert not loaded.loaded
+    assert loaded.load()
+    assert list(loaded) == ["b.py", "a.py"]
+    assert "a.py" in loaded and "c.py" not in loaded
+
+
+def test_load_without_a_file(tmp_path):
+    manifest = ManifestIndex(tmp_path / "manifest.json")
+    assert not manifest.load()
+    assert not manifest.loaded
+
+
+def test_changes_are_written_once_they_settle(tmp_path):
+    path = tmp_path / "manifest.json"
+    manifest = ManifestIndex(path, persist_delay=0.1)
+    manifest.replace(["a.py"])
+
+    assert manifest.add("b.py")
+    assert not manifest.add("b.py")
+    assert manifest.remove("a.py")
+    assert not manifest.remove("a.py")
+    assert json.loads(path.read_text()) == ["a.py"]
+
+    deadline = time.monotonic() + 5
+    while json.loads(path.read_text()) != ["b.py"]:
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def test_flush_writes_pending_changes_now(tmp_path):
+    path = tmp_path / "manifest.json"
+    manifest = ManifestIndex(path, persist_delay=60)
+    manifest.replace(["a.py"])
+    manifest.add("b.py")
+
+    manifest.flush()
+
+    assert json.loads(path.read_text()) == ["a.py", "b.py"]
+    assert manifest._timer is None
+    assert [p.name for p in tmp_path.iterdir()] == ["manifest.json"]
@@ -0,0 +1,84 @@
+import threading
+import zipfile
+
+from consolo.archive import BuildStats, SinkPool
+from consolo.batcher import ChangeSet
+from consolo.consolo import LambdaReloader
+from consolo.pipeline import SnapshotPipeline
+from consolo.upload import UploadWorker
+
+
+def test_stop_sends_the_last_change_set(tmp_path):
+    sent = []
+    uploading = threading.Event()
+    release = threading.Event()
+
+    def build(sink):
+        with zipfile.ZipFile(sink, "w") as zipf:
+            zipf.writestr("app.py", f"V = {len(sent)}\n")
+        return BuildStats(fingerprint=str(len(sent)))
+
+    def upload(snapshot):
+        uploading.set()
+        release.wait(5)
+        sent.append(snapshot.changes)
+        return True
+
+    pipeline = SnapshotPipeline(build, upload, lambda: True, SinkPool(tmp_path / "s"))
+    pipeline.start()
+    first, last = ChangeSet(), ChangeSet()
+    pipeline.submit(first)
+    assert uploading.wait(5)
+    pipeline.submit(last)
+
+    threading.Timer(0.1, release.set).start()
+    pipeline.stop(timeout=5)
+
+    assert sent == [first, last]
+    assert len(pipeline.sinks.free) == len(pipeline.sinks.sinks)
+
+
+def test_stop_releases_the_waiting_item():
+    released = []
+    worker = UploadWorker(lambda item: None, lambda: False, release=released.append)
+    worker.slot.put("waiting")
+    worker.stop()
+    assert released == ["waiting"]
+
+
+def test_failed_update_is_not_live(tmp_path):
+    live = []
+
+    def build(sink):
+        with zipfile.ZipFile(sink, "w") as zipf:
+            zipf.writestr("app.py", "V = 1\n")
+        return BuildStats(fingerprint="1")
+
+    pipeline = SnapshotPipeline(
+        build,
+        lambda snapshot: True,
+        lambda: True,
+        SinkPool(tmp_path / "s"),
+        on_live=live.append,
+        went_live=lambda: False,
+    )
+    pipeline.submit(ChangeSet())
+    pipeline.stop(timeout=5)
+    assert live == []
+    assert pipeline.last is None
+
+
+def test_update_succeeded_reports_failures(tmp_path):
+    reloader = LambdaReloader("profile", "function", str(tmp_path), False)
+    reloader.deployed_sha256 = "uploaded"
+    reloader.update_status = {"LastUpdateStatus": "Successful"}
+    assert reloader.update_succeeded()
+
+    reloader.update_status = {
+        "LastUpdateStatus": "Failed",
+        "LastUpdateStatusReason": "Handler module not found",
+        "CodeSha256": "previous",
+    }
+    assert not reloader.update_succeeded()
+    assert reloader.metrics.counters[("failed_updates_total", "function")] == 1
+    assert reloader.deployed_sha256 == "previous"
@@ -0,0 +1,110 @@
+"""Finding changes by polling the tree."""
+from watchdog.events import (FileCreatedEvent, FileDeletedEvent,
+                             FileModifiedEvent, FileMovedEvent)
+
+from consolo.polling import PollingScanner, PollingWatcher
+
+
+def kinds(events):
+    return sorted(
+        (type(e).__name__, e.src_path, getattr(e, "dest_path", "")) for e in events
+    )
+
+
+def test_first_scan_only_takes_the_snapshot(tmp_path):
+    (tmp_path / "a.py").write_text("a")
+    scanner = PollingScanner(tmp_path)
+    assert scanner.scan() == []
+    assert scanner.scan() == []
+    assert list(scanner.files) == ["a.py"]
+
+
+def test_created_modified_and_deleted(tmp_path):
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "a.py").write_text("a")
+    (tmp_path / "b.py").write_text("b")
+    scanner = PollingScanner(tmp_path)
+    scanner.scan()
+
+    (tmp_path / "pkg" / "new.py").write_text("new")
+    (tmp_path / "pkg" / "a.py").write_text("a changed")
+    (tmp_path / "b.py").unlink()
+    events = scanner.scan()
+
+    assert kinds(events) == kinds([
+        FileCreatedEvent(str(tmp_path / "pkg" / "new.py")),
+        FileModifiedEvent(str(tmp_path / "pkg" / "a.py")),
+        FileDeletedEvent(str(tmp_path / "b.py")),
+    ])
+    assert scanner.scan() == []
+
+
+def test_rename_is_one_move(tmp_path):
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "old.py").write_text("x")
+    scanner = PollingScanner(tmp_path)
+    scanner.scan()
+
+    (tmp_path / "old.py").rename(tmp_path / "pkg" / "new.py")
+
+    assert kinds(scanner.scan()) == kinds([
+        FileMovedEvent(str(tmp_path / "old.py"), str(tmp_path / "pkg" / "new.py"))
+    ])
+
+
+def test_deleted_directory_drops_its_files(tmp_path):
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "a.py").write_text("a")
+    scanner = PollingScanner(tmp_path)
+    scanner.scan()
+
+    (tmp_path / "pkg" / "a.py").unlink()
+    (tmp_path / "pkg").rmdir()
+
+    assert kinds(scanner.scan()) == kinds(
+        [FileDeletedEvent(str(tmp_path / "pkg" / "a.py"))]
+    )
+    assert scanner.files == {}
+
+
+def test_ignored_directories_are_not_descended_into(tmp_path):
+    (tmp_path / "node_modules" / "dep").mkdir(parents=True)
+    (tmp_path / "node_modules" / "dep" / "index.js").write_text("x")
+    (tmp_path / "a.py").write_text("a")
+    seen = []
+
+    def ignore(path):
+        seen.append(path)
+        return path.endswith("/node_modules/")
+
+    scanner = PollingScanner(tmp_path, ignore=ignore)
+    scanner.scan()
+    (tmp_path / "node_modules" / "dep" / "index.js").write_text("changed")
+
+    assert scanner.scan() == []
+    assert list(scanner.files) == ["a.py"]
+    assert not any("/dep" in path for path in seen)
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+
+    def dispatch(self, event):
+        self.events.append(event)
+
+
+def test_watcher_dispatches_events_once_per_root(tmp_path):
+    (tmp_path / "pkg").mkdir()
+    handler = Recorder()
+    # A root inside another root is not scanned twice.
+    watcher = PollingWatcher([tmp_path, tmp_path / "pkg"], handler)
+    assert len(watcher.scanners) == 1
+    assert watcher.poll() == 0
+
+    (tmp_path / "pkg" / "a.py").write_text("a")
+
+    assert watcher.poll() == 1
+    assert kinds(handler.events) == kinds(
+        [FileCreatedEvent(str(tmp_path / "pkg" / "a.py"))]
+    )
@@ -0,0 +1,153 @@
+"""Applying a remote package on top of local edits."""
+import threading
+import zipfile
+
+from watchdog.events import FileModifiedEvent
+
+from consolo import consolo
+from consolo.batcher import ChangeSet
+from consolo.consolo import LambdaReloader
+from consolo.ignore import IgnoreRules
+from consolo.manifest import ManifestIndex
+from consolo.remote import (CONFLICT_SUFFIX, PullStats, package_members,
+                            pull_changed)
+
+
+def package(path, files):
+    with zipfile.ZipFile(path, "w") as zipf:
+        for name, text in files.items():
+            zipf.writestr(name, text)
+    return path
+
+
+def tree(root):
+    return {
+        path.relative_to(root).as_posix(): path.read_text()
+        for path in sorted(root.rglob("*"))
+        if path.is_file()
+    }
+
+
+def test_pull_changed(tmp_path):
+    root = tmp_path / "src"
+    files = {
+        "same.py": "s",
+        "remote.py": "1",
+        "both.py": "1",
+        "gone.py": "g",
+        "gone_edited.py": "g",
+        "pkg/mod.py": "m",
+    }
+    old = package(tmp_path / "old.zip", files)
+    for name, text in {**files, "local_only.py": "l"}.items():
+        root.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+        root.joinpath(name).write_text(text)
+    root.joinpath("both.py").write_text("mine")
+    root.joinpath("gone_edited.py").write_text("mine")
+
+    new = package(
+        tmp_path / "new.zip",
+        {
+            "same.py": "s",
+            "remote.py": "2",
+            "both.py": "2",
+            "new.py": "n",
+            "pkg/mod.py": "m",
+            "__pycache__/x.pyc": "c",
+        },
+    )
+    written = []
+    stats, synced = pull_changed(
+        new,
+        root,
+        package_members(old),
+        keep=IgnoreRules.from_root(root).matches,
+        on_write=written.append,
+    )
+
+    assert stats.written == ["remote.py", "new.py"]
+    assert stats.removed == ["gone.py"]
+    assert stats.conflicts == ["both.py", "gone_edited.py"]
+    assert [p.name for p in written] == ["remote.py", "new.py", "gone.py"]
+    assert tree(root) == {
+        "both.py": "mine",
+        f"both.py{CONFLICT_SUFFIX}": "2",
+        "gone_edited.py": "mine",
+        "local_only.py": "l",
+        "new.py": "n",
+        "pkg/mod.py": "m",
+        "remote.py": "2",
+        "same.py": "s",
+    }
+    assert synced == package_members(new)
+
+    # Pulling the same package again has nothing left to do.
+    stats, _ = pull_changed(new, root, synced)
+    assert not (stats.written or stats.removed or stats.conflicts)
+
+
+def test_pull_matching_local_edit(tmp_path):
+    root = tmp_path / "src"
+    root.mkdir()
+    old = package(tmp_path / "old.zip", {"app.py": "1"})
+    root.joinpath("app.py").write_text("2")
+    new = package(tmp_path / "new.zip", {"app.py": "2"})
+
+    stats, _ = pull_changed(new, root, package_members(old))
+    assert stats.unchanged == 1
+    assert not stats.conflicts
+
+
+def puller(tmp_path, monkeypatch):
+    root = tmp_path / "src"
+    root.mkdir()
+    (root / "app.py").write_text("V = 1\n")
+    reloader = LambdaReloader(
+        "profile", "function", str(root), False, pull_interval=5.0
+    )
+    reloader.manifest = ManifestIndex(tmp_path / "manifest.json")
+    reloader.manifest.replace(["app.py"])
+    monkeypatch.setattr(
+        consolo, "pull_changed", lambda *args, **kwargs: (PullStats(), {"new": (1, 1)})
+    )
+    return reloader
+
+
+def test_save_during_pull_waits_for_it(tmp_path, monkeypatch):
+    reloader = puller(tmp_path, monkeypatch)
+    downloading, release = threading.Event(), threading.Event()
+    order = []
+
+    def download():
+        downloading.set()
+        release.wait(5)
+        order.append("pulled")
+
+    monkeypatch.setattr(reloader, "download_function_code", download)
+    monkeypatch.setattr(reloader.pipeline, "submit", lambda c: order.append("queued"))
+
+    pull = threading.Thread(target=reloader.pull_remote)
+    pull.start()
+    assert downloading.wait(5)
+
+    changes = ChangeSet()
+    changes.add(FileModifiedEvent(str(reloader.local_root / "app.py")))
+    save = threading.Thread(target=reloader.handle_changes, args=(changes,))
+    save.start()
+    save.join(0.2)
+    assert order == []
+
+    release.set()
+    pull.join(5)
+    save.join(5)
+    assert order == ["pulled", "queued"]
+    assert reloader.synced == {"new": (1, 1)}
+
+
+def test_pull_yields_to_local_changes(tmp_path, monkeypatch):
+    reloader = puller(tmp_path, monkeypatch)
+    downloads = []
+    monkeypatch.setattr(reloader, "download_function_code", lambda: downloads.append(1))
+    monkeypatch.setattr(reloader, "busy", lambda: True)
+    assert not reloader.pull_remote()
+    assert downloads == []
@@ -0,0 +1,89 @@
+import hashlib
+
+from consolo.archive import ArchiveSink
+from consolo.staging import MIN_PART_SIZE, S3Stager
+
+
+class FakeS3:
+    def __init__(self):
+        self.parts = {}
+        self.copied = []
+        self.completed = 0
+
+    def create_multipart_upload(self, **kwargs):
+        self.parts, self.copied = {}, []
+        return {"UploadId": "u"}
+
+    def upload_part(self, PartNumber, Body, **kwargs):
+        self.parts[PartNumber] = Body
+        return {"ETag": f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def upload_part_copy(self, PartNumber, CopySourceRange, **kwargs):
+        self.copied.append((PartNumber, CopySourceRange))
+        return {"CopyPartResult": {"ETag": f'"copy-{PartNumber}"'}}
+
+    def complete_multipart_upload(self, **kwargs):
+        self.completed += 1
+
+
+def spilled_sink(tmp_path, data):
+    sink = ArchiveSink(tmp_path / "spill.zip", spill_threshold=1024)
+    sink.write(data)
+    assert sink.spilled
+    return sink
+
+
+def test_spilled_payload_is_not_read_into_memory(tmp_path):
+    sink = spilled_sink(tmp_path, b"x" * 4096)
+    payload = sink.payload()
+    assert not isinstance(payload, (bytes, bytearray))
+    assert payload.tell() == 0
+    assert sink.data() == b"x" * 4096
+
+
+def test_stage_reads_a_spilled_payload_part_by_part(tmp_path):
+    data = bytes(range(256)) * (MIN_PART_SIZE // 128 + 3)
+    sink = spilled_sink(tmp_path, data)
+    client = FakeS3()
+    stager = S3Stager(client, "bucket", threshold=1, part_size=MIN_PART_SIZE)
+
+    assert stager.wants(sink.size)
+    assert stager.stage("fn", sink.payload(), sink.size) == ("bucket", "consolo/fn.zip")
+    assert len(client.parts) == 3
+    assert b"".join(client.parts[n] for n in sorted(client.parts)) == data
+
+
+def three_parts(change=None):
+    data = bytearray(b"a" * MIN_PART_SIZE + b"b" * MIN_PART_SIZE + b"c" * 100)
+    if change is not None:
+        data[change] = ord("z")
+    return memoryview(data)
+
+
+def test_restage_copies_unchanged_parts():
+    client = FakeS3()
+    stager = S3Stager(client, "bucket", part_size=MIN_PART_SIZE)
+    stager.stage("fn", three_parts(), MIN_PART_SIZE * 2 + 100)
+    assert sorted(client.parts) == [1, 2, 3]
+
+    stager.stage("fn", three_parts(change=MIN_PART_SIZE), MIN_PART_SIZE * 2 + 100)
+    assert sorted(client.parts) == [2]
+    assert client.parts[2][:1] == b"z"
+    assert sorted(client.copied) == [
+        (1, f"bytes=0-{MIN_PART_SIZE - 1}"),
+        (3, f"bytes={MIN_PART_SIZE * 2}-{MIN_PART_SIZE * 2 + 99}"),
+    ]
+    assert client.completed == 2
+
+
+def test_unchanged_package_is_not_staged_again():
+    client = FakeS3()
+    stager = S3Stager(client, "bucket", part_size=MIN_PART_SIZE)
+    size = MIN_PART_SIZE * 2 + 100
+    stager.stage("fn", three_parts(), size)
+
+    client.parts = {}
+    assert stager.stage("fn", three_parts(), size) == ("bucket", "consolo/fn.zip")
+    assert client.parts == {}
+    assert client.copied == []
+    assert client.completed == 1
@@ -0,0 +1,70 @@
+"""Syntax checks before uploading."""
+from watchdog.events import FileModifiedEvent, FileMovedEvent
+
+from consolo.batcher import ChangeSet
+from consolo.consolo import LambdaReloader
+from consolo.manifest import ManifestIndex
+from consolo.validate import Validator, check_source
+
+
+def test_check_source_points_at_the_error():
+    error = check_source("app.py", b"def f(:\n    pass\n")
+    assert error.startswith("app.py:1:")
+    assert check_source("app.py", b"x = 1\n") is None
+    assert check_source("event.json", b"{").startswith("event.json:1:")
+
+
+def test_upload_local_skips_vendored_packages(tmp_path, monkeypatch):
+    root = tmp_path / "src"
+    (root / "oldpkg").mkdir(parents=True)
+    (root / "oldpkg-1.0.dist-info").mkdir()
+    (root / "app.py").write_text("import oldpkg\n")
+    (root / "oldpkg" / "__init__.py").write_text("print 'python 2'\n")
+    (root / "oldpkg-1.0.dist-info" / "RECORD").write_text(
+        "oldpkg/__init__.py,,\noldpkg-1.0.dist-info/RECORD,,\n"
+    )
+    names = ["app.py", "oldpkg/__init__.py", "oldpkg-1.0.dist-info/RECORD"]
+
+    validator = Validator(root, jobs=1)
+    reloader = LambdaReloader(
+        "profile", "function", str(root), False, validator=validator
+    )
+    reloader.manifest = ManifestIndex(tmp_path / "manifest.json")
+    reloader.manifest.replace(names)
+    reloader.manifest.flush()
+    monkeypatch.setattr(reloader, "update_function_code", lambda: "uploaded")
+
+    assert reloader.application_names() == ["app.py"]
+    assert reloader.upload_local() == "uploaded"
+
+    (root / "app.py").write_text("import oldpkg(\n")
+    assert reloader.upload_local() is None
+
+
+def test_renaming_a_broken_file_away_stops_rejecting(tmp_path, monkeypatch):
+    root = tmp_path / "src"
+    root.mkdir()
+    (root / "a.py").write_text("def f(:\n")
+    (root / "b.py").write_text("x = 1\n")
+    reloader = LambdaReloader(
+        "profile", "function", str(root), False, validator=Validator(root, jobs=1)
+    )
+    reloader.manifest = ManifestIndex(tmp_path / "manifest.json")
+    reloader.manifest.replace(["a.py", "b.py"])
+    queued = []
+    monkeypatch.setattr(reloader.pipeline, "submit", queued.append)
+
+    broken = ChangeSet()
+    broken.add(FileModifiedEvent(str(root / "a.py")))
+    reloader.handle_changes(broken)
+    assert not queued
+
+    (root / "a.py").rename(root / "a.py.bak")
+    renamed = ChangeSet()
+    renamed.add(FileMovedEvent(str(root / "a.py"), str(root / "a.py.bak")))
+    reloader.handle_changes(renamed)
+
+    edit = ChangeSet()
+    edit.add(FileModifiedEvent(str(root / "b.py")))
+    reloader.handle_changes(edit)
+    assert queued == [renamed, edit]